@@ -0,0 +1,191 @@
+import asyncio
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from fastapi import HTTPException, Request
+from metrics import metrics
+
+# Idle buckets are pruned once the table grows past this many users.
+MAX_TRACKED_USERS = 10000
+# With db_concurrency set, this many requests per slot may wait for one,
+# and the threadpool keeps this many threads beyond the slots for sync
+# routes that do not use the database.
+QUEUE_PER_SLOT = 4
+SPARE_THREADS = 8
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, capacity:float, now:float):
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, rate:float, capacity:float, now:float):
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+class BorrowAdmission:
+    # Runs before the route opens a database connection, so rejected
+    # requests never wait on the book's row lock or hold a pooled connection.
+    def __init__(
+            self,
+            user_rate:float,
+            user_burst:int,
+            book_max_in_flight:int,
+            clock=time.monotonic
+            ):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.book_max_in_flight = book_max_in_flight
+        self._clock = clock
+        self._buckets = {}
+        self._in_flight = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+            self._in_flight.clear()
+
+    def in_flight(self) -> int:
+        return sum(self._in_flight.values())
+
+    def acquire(self, user_id:int, book_id:int, book_slot:bool=True):
+        # Without book_slot only the user's rate is checked: a coalesced
+        # borrow runs in a batch whose leader takes the book's slot.
+        with self._lock:
+            now = self._clock()
+            bucket = self._take_bucket(user_id, now)
+            if bucket.tokens < 1:
+                metrics.increment("admission.borrow.rejected_user_rate")
+                retry_after = (1 - bucket.tokens) / self.user_rate if self.user_rate > 0 else 60
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many borrow requests for this user.",
+                    headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+                    )
+            if book_slot:
+                self._take_book_slot(book_id)
+            bucket.tokens -= 1
+            metrics.increment("admission.borrow.admitted")
+
+    def acquire_book(self, book_id:int):
+        with self._lock:
+            self._take_book_slot(book_id)
+
+    def release(self, book_id:int):
+        with self._lock:
+            self._in_flight[book_id] -= 1
+            if self._in_flight[book_id] <= 0:
+                del self._in_flight[book_id]
+
+    def _take_book_slot(self, book_id:int):
+        if self._in_flight[book_id] >= self.book_max_in_flight:
+            metrics.increment("admission.borrow.rejected_book_in_flight")
+            raise HTTPException(
+                status_code=429,
+                detail="Too many borrow requests for this book are in progress.",
+                headers={"Retry-After": "1"}
+                )
+        self._in_flight[book_id] += 1
+
+    def _take_bucket(self, user_id:int, now:float) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_TRACKED_USERS:
+                self._prune(now)
+            bucket = self._buckets[user_id] = TokenBucket(self.user_burst, now)
+        else:
+            bucket.refill(self.user_rate, self.user_burst, now)
+        return bucket
+
+    def _prune(self, now:float):
+        for user_id, bucket in list(self._buckets.items()):
+            bucket.refill(self.user_rate, self.user_burst, now)
+            if bucket.tokens >= self.user_burst:
+                del self._buckets[user_id]
+
+class ConcurrencyLimiter:
+    # Awaited on the event loop, before the request takes a threadpool
+    # thread or a pooled connection. Waiting requests cost one future each
+    # instead of a blocked thread, and get their slot in arrival order.
+    # Metrics are reported under the given name.
+    def __init__(self, limit:int, max_waiting:int, name:str="db_concurrency"):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.name = name
+        self.active = 0
+        self._waiters = deque()
+        # release() may come from a worker thread or another event loop.
+        self._lock = threading.Lock()
+
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return
+            if len(self._waiters) >= self.max_waiting:
+                metrics.increment(f"{self.name}.rejected")
+                raise HTTPException(status_code=503, detail="Too many requests are waiting for the database.", headers={"Retry-After": "1"})
+            turn = asyncio.get_running_loop().create_future()
+            self._waiters.append(turn)
+        started = time.perf_counter()
+        try:
+            await turn
+        except asyncio.CancelledError:
+            # The client went away: give up the place in the queue, or the
+            # slot if it was handed over in the meantime. A turn cancelled
+            # before the hand-over ran is passed on by _hand_over instead.
+            with self._lock:
+                queued = turn in self._waiters
+                if queued:
+                    self._waiters.remove(turn)
+            if not queued and not turn.cancelled():
+                self.release()
+            raise
+        finally:
+            metrics.increment(f"{self.name}.wait_seconds", time.perf_counter() - started)
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self.active -= 1
+                return
+            # The slot passes straight to the next request.
+            turn = self._waiters.popleft()
+        turn.get_loop().call_soon_threadsafe(self._hand_over, turn)
+
+    def _hand_over(self, turn):
+        if turn.cancelled():
+            self.release()
+        else:
+            turn.set_result(None)
+
+async def db_concurrency_slot(request:Request):
+    limiter = getattr(request.app.state, "db_limiter", None)
+    if limiter is None:
+        yield
+        return
+    await limiter.acquire()
+    try:
+        yield
+    finally:
+        limiter.release()
+
+async def borrow_admission(request:Request, book_id:int, user_id:int):
+    admission = getattr(request.app.state, "borrow_admission", None)
+    if admission is None:
+        yield
+        return
+    # With coalescing, the batch leader takes the book's slot for the batch.
+    book_slot = getattr(request.app.state, "borrow_coalescer", None) is None
+    admission.acquire(user_id, book_id, book_slot)
+    try:
+        yield
+    finally:
+        if book_slot:
+            admission.release(book_id)
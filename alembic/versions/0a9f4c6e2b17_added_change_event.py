@@ -0,0 +1,44 @@
+"""added change event
+
+Revision ID: 0a9f4c6e2b17
+Revises: e3c71a5b9d08
+Create Date: 2026-10-19 18:20:37.904115
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from changes import NOTIFY_FUNCTION, NOTIFY_TRIGGER
+from migration_utils import is_postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a9f4c6e2b17'
+down_revision: Union[str, Sequence[str], None] = 'e3c71a5b9d08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('change_event',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('entity', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=True),
+    sa.Column('origin', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    if is_postgresql():
+        # The same DDL that create_all runs, defined in changes.py.
+        op.execute(NOTIFY_FUNCTION)
+        op.execute(NOTIFY_TRIGGER)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('change_event')
+    if is_postgresql():
+        op.execute("DROP FUNCTION IF EXISTS notify_change_event()")
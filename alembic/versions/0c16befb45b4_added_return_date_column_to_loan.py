@@ -1,33 +0,0 @@
-"""added return date column to loan
-
-Revision ID: 0c16befb45b4
-Revises: 9efccb6cd24c
-Create Date: 2026-02-04 16:29:25.967115
-
-"""
-from typing import Sequence, Union
-
-from alembic import op
-import sqlalchemy as sa
-import sqlmodel
-
-
-# revision identifiers, used by Alembic.
-revision: str = '0c16befb45b4'
-down_revision: Union[str, Sequence[str], None] = '9efccb6cd24c'
-branch_labels: Union[str, Sequence[str], None] = None
-depends_on: Union[str, Sequence[str], None] = None
-
-
-def upgrade() -> None:
-    """Upgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    op.add_column('loan', sa.Column('return_date', sa.DateTime(timezone=True), nullable=True))
-    # ### end Alembic commands ###
-
-
-def downgrade() -> None:
-    """Downgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    op.drop_column('loan', 'return_date')
-    # ### end Alembic commands ###
@@ -1,33 +0,0 @@
-"""tweaked validation code for available_copies in book
-
-Revision ID: 1a8f7e40051d
-Revises: 844bbf520268
-Create Date: 2026-02-06 17:05:35.741753
-
-"""
-from typing import Sequence, Union
-
-from alembic import op
-import sqlalchemy as sa
-import sqlmodel
-
-
-# revision identifiers, used by Alembic.
-revision: str = '1a8f7e40051d'
-down_revision: Union[str, Sequence[str], None] = '844bbf520268'
-branch_labels: Union[str, Sequence[str], None] = None
-depends_on: Union[str, Sequence[str], None] = None
-
-
-def upgrade() -> None:
-    """Upgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
-
-
-def downgrade() -> None:
-    """Downgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
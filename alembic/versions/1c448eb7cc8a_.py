@@ -1,33 +0,0 @@
-"""empty message
-
-Revision ID: 1c448eb7cc8a
-Revises: 35914f375fab
-Create Date: 2026-02-04 15:44:50.628660
-
-"""
-from typing import Sequence, Union
-
-from alembic import op
-import sqlalchemy as sa
-import sqlmodel
-
-
-# revision identifiers, used by Alembic.
-revision: str = '1c448eb7cc8a'
-down_revision: Union[str, Sequence[str], None] = '35914f375fab'
-branch_labels: Union[str, Sequence[str], None] = None
-depends_on: Union[str, Sequence[str], None] = None
-
-
-def upgrade() -> None:
-    """Upgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
-
-
-def downgrade() -> None:
-    """Downgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
@@ -0,0 +1,36 @@
+"""added job cursor
+
+Revision ID: 2f8d6a4c1e93
+Revises: 9e4b1f7c3a52
+Create Date: 2026-10-19 22:14:38.602517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2f8d6a4c1e93'
+down_revision: Union[str, Sequence[str], None] = '9e4b1f7c3a52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('job_cursor',
+    sa.Column('name', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    # Loans made so far were counted into book_cooccurrence by the borrows
+    # themselves; count-related starts after them.
+    op.execute("INSERT INTO job_cursor (name, position) SELECT 'book_cooccurrence', COALESCE(MAX(id), 0) FROM loan")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('job_cursor')
@@ -0,0 +1,37 @@
+"""added book cooccurrence
+
+Revision ID: 5d2b8e7c4f61
+Revises: 0a9f4c6e2b17
+Create Date: 2026-10-19 19:03:52.417630
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2b8e7c4f61'
+down_revision: Union[str, Sequence[str], None] = '0a9f4c6e2b17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('book_cooccurrence',
+    sa.Column('book_id', sa.Integer(), nullable=False),
+    sa.Column('related_book_id', sa.Integer(), nullable=False),
+    sa.Column('borrowers', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['book_id'], ['book.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['related_book_id'], ['book.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('book_id', 'related_book_id')
+    )
+    op.create_index('ix_book_cooccurrence_top', 'book_cooccurrence', ['book_id', 'borrowers', 'related_book_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_book_cooccurrence_top', table_name='book_cooccurrence')
+    op.drop_table('book_cooccurrence')
@@ -1,8 +1,8 @@
-"""Initial database setup
+"""squashed baseline
 
-Revision ID: 6ed8b02f5ea7
-Revises: 
-Create Date: 2026-02-02 18:58:44.314185
+Revision ID: 6c3e8b995729
+Revises:
+Create Date: 2026-10-19 15:02:36.184512
 
 """
 from typing import Sequence, Union
@@ -13,15 +13,21 @@ import sqlmodel
 
 
 # revision identifiers, used by Alembic.
-revision: str = '6ed8b02f5ea7'
+revision: str = '6c3e8b995729'
 down_revision: Union[str, Sequence[str], None] = None
 branch_labels: Union[str, Sequence[str], None] = None
 depends_on: Union[str, Sequence[str], None] = None
 
+# Replaces the revisions from 6ed8b02f5ea7 (initial database setup) up to and
+# including this one, and keeps this revision's id so that databases already
+# at 6c3e8b995729 or later upgrade as before. A database still on one of the
+# removed revisions has to be upgraded past 6c3e8b995729 with an older checkout
+# first. Those databases also keep the unused loanstatus ENUM type, which
+# fresh databases never create.
+
 
 def upgrade() -> None:
     """Upgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
     op.create_table('book',
     sa.Column('id', sa.Integer(), nullable=False),
     sa.Column('title', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
@@ -29,7 +35,7 @@ def upgrade() -> None:
     sa.Column('isbn', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
     sa.Column('publication_year', sa.Integer(), nullable=False),
     sa.Column('total_copies', sa.Integer(), nullable=False),
-    sa.Column('available_copies', sa.Integer(), nullable=False),
+    sa.Column('available_copies', sa.Integer(), nullable=True),
     sa.PrimaryKeyConstraint('id'),
     sa.UniqueConstraint('isbn')
     )
@@ -46,17 +52,16 @@ def upgrade() -> None:
     sa.Column('user_id', sa.Integer(), nullable=False),
     sa.Column('borrow_date', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
     sa.Column('due_date', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('status', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('return_date', sa.DateTime(), nullable=True),
     sa.ForeignKeyConstraint(['book_id'], ['book.id'], ),
     sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
     sa.PrimaryKeyConstraint('id')
     )
-    # ### end Alembic commands ###
 
 
 def downgrade() -> None:
     """Downgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
     op.drop_table('loan')
     op.drop_table('user')
     op.drop_table('book')
-    # ### end Alembic commands ###
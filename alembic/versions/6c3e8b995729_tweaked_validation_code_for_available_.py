@@ -1,39 +0,0 @@
-"""tweaked validation code for available_copies in book
-
-Revision ID: 6c3e8b995729
-Revises: 00f57bb11ac7
-Create Date: 2026-02-06 20:57:30.493580
-
-"""
-from typing import Sequence, Union
-
-from alembic import op
-import sqlalchemy as sa
-import sqlmodel
-from sqlalchemy.dialects import postgresql
-
-# revision identifiers, used by Alembic.
-revision: str = '6c3e8b995729'
-down_revision: Union[str, Sequence[str], None] = '00f57bb11ac7'
-branch_labels: Union[str, Sequence[str], None] = None
-depends_on: Union[str, Sequence[str], None] = None
-
-
-def upgrade() -> None:
-    """Upgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    op.alter_column('loan', 'return_date',
-               existing_type=postgresql.TIMESTAMP(timezone=True),
-               type_=sa.DateTime(),
-               existing_nullable=True)
-    # ### end Alembic commands ###
-
-
-def downgrade() -> None:
-    """Downgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    op.alter_column('loan', 'return_date',
-               existing_type=sa.DateTime(),
-               type_=postgresql.TIMESTAMP(timezone=True),
-               existing_nullable=True)
-    # ### end Alembic commands ###
@@ -0,0 +1,33 @@
+"""added loan book and user indexes
+
+Revision ID: 7f2a9c4d1b38
+Revises: d5e8f1a27b64
+Create Date: 2026-10-19 15:20:52.907331
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from migration_utils import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7f2a9c4d1b38'
+down_revision: Union[str, Sequence[str], None] = 'd5e8f1a27b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Built concurrently: loan is the largest table and takes writes on every borrow.
+    create_index_concurrently(op.f('ix_loan_book_id'), 'loan', ['book_id'])
+    create_index_concurrently(op.f('ix_loan_user_id'), 'loan', ['user_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    drop_index_concurrently(op.f('ix_loan_user_id'), 'loan')
+    drop_index_concurrently(op.f('ix_loan_book_id'), 'loan')
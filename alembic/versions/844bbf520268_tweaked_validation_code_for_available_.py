@@ -1,33 +0,0 @@
-"""tweaked validation code for available_copies in book
-
-Revision ID: 844bbf520268
-Revises: 902aa314c715
-Create Date: 2026-02-05 14:39:07.272345
-
-"""
-from typing import Sequence, Union
-
-from alembic import op
-import sqlalchemy as sa
-import sqlmodel
-
-
-# revision identifiers, used by Alembic.
-revision: str = '844bbf520268'
-down_revision: Union[str, Sequence[str], None] = '902aa314c715'
-branch_labels: Union[str, Sequence[str], None] = None
-depends_on: Union[str, Sequence[str], None] = None
-
-
-def upgrade() -> None:
-    """Upgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
-
-
-def downgrade() -> None:
-    """Downgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
@@ -1,33 +0,0 @@
-"""empty message
-
-Revision ID: 9441b9fe071d
-Revises: 6ed8b02f5ea7
-Create Date: 2026-02-03 18:38:02.797843
-
-"""
-from typing import Sequence, Union
-
-from alembic import op
-import sqlalchemy as sa
-import sqlmodel
-
-
-# revision identifiers, used by Alembic.
-revision: str = '9441b9fe071d'
-down_revision: Union[str, Sequence[str], None] = '6ed8b02f5ea7'
-branch_labels: Union[str, Sequence[str], None] = None
-depends_on: Union[str, Sequence[str], None] = None
-
-
-def upgrade() -> None:
-    """Upgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
-
-
-def downgrade() -> None:
-    """Downgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
@@ -0,0 +1,41 @@
+"""added loan id autoincrement
+
+Revision ID: 9e4b1f7c3a52
+Revises: c6e09b4a7d35
+Create Date: 2026-10-19 21:37:05.118342
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from migration_utils import is_postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4b1f7c3a52'
+down_revision: Union[str, Sequence[str], None] = 'c6e09b4a7d35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # PostgreSQL sequences never go back. SQLite hands out the highest rowid
+    # again once that loan is archived, and the archive keeps loan ids.
+    if not is_postgresql():
+        with op.batch_alter_table('loan', recreate='always', table_kwargs={'sqlite_autoincrement': True}):
+            pass
+        # Continue above every id already moved to the archive.
+        op.execute("DELETE FROM sqlite_sequence WHERE name = 'loan'")
+        op.execute(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT 'loan', COALESCE(MAX(id), 0) "
+            "FROM (SELECT id FROM loan UNION ALL SELECT id FROM loan_archive)"
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not is_postgresql():
+        with op.batch_alter_table('loan', recreate='always', table_kwargs={'sqlite_autoincrement': False}):
+            pass
@@ -0,0 +1,48 @@
+"""added loan_archive table
+
+Revision ID: a41c6e0d93f2
+Revises: 3b7d2c91e4a0
+Create Date: 2026-10-19 11:04:18.226901
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41c6e0d93f2'
+down_revision: Union[str, Sequence[str], None] = '3b7d2c91e4a0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('loan_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('book_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('borrow_date', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('due_date', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('return_date', sa.DateTime(), nullable=True),
+    sa.Column('status', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['book_id'], ['book.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_loan_archive_book_id'), 'loan_archive', ['book_id'], unique=False)
+    op.create_index(op.f('ix_loan_archive_user_id'), 'loan_archive', ['user_id'], unique=False)
+    # Holds keep pointing at loans after they move to loan_archive.
+    op.drop_constraint('hold_loan_id_fkey', 'hold', type_='foreignkey')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_foreign_key('hold_loan_id_fkey', 'hold', 'loan', ['loan_id'], ['id'])
+    op.drop_index(op.f('ix_loan_archive_user_id'), table_name='loan_archive')
+    op.drop_index(op.f('ix_loan_archive_book_id'), table_name='loan_archive')
+    op.drop_table('loan_archive')
@@ -0,0 +1,67 @@
+"""stored loan status as smallint
+
+Revision ID: b84e1d3f5a20
+Revises: 7f2a9c4d1b38
+Create Date: 2026-10-19 16:05:44.381920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from migration_utils import add_check_constraint, backfill_in_batches, create_index_concurrently, drop_index_concurrently, is_postgresql, set_not_null
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b84e1d3f5a20'
+down_revision: Union[str, Sequence[str], None] = '7f2a9c4d1b38'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Spelled out rather than imported from models, so this revision keeps
+# producing the same schema if the model changes later.
+TO_CODE = "CASE status WHEN 'borrowed' THEN 0 WHEN 'returned' THEN 1 WHEN 'overdue' THEN 2 END"
+TO_TEXT = "CASE status_text WHEN 0 THEN 'borrowed' WHEN 1 THEN 'returned' WHEN 2 THEN 'overdue' END"
+ACTIVE = sa.text("status <> 1")
+
+
+def convert_to_code(table: str) -> None:
+    op.add_column(table, sa.Column('status_code', sa.SmallInteger(), nullable=True))
+    # Committed batch by batch, outside the migration transaction.
+    backfill_in_batches(table, f"status_code = {TO_CODE}", condition="status_code IS NULL")
+    # Catch the rows written by the old code while the backfill ran.
+    op.execute(f'UPDATE "{table}" SET status_code = {TO_CODE} WHERE status_code IS NULL')
+    op.drop_column(table, 'status')
+    op.alter_column(table, 'status_code', new_column_name='status')
+    add_check_constraint(f'ck_{table}_status', table, 'status IN (0, 1, 2)')
+    set_not_null(table, 'status')
+
+
+def convert_to_text(table: str) -> None:
+    op.drop_constraint(f'ck_{table}_status', table, type_='check')
+    if is_postgresql():
+        # Left by set_not_null() in place of NOT NULL before PostgreSQL 12.
+        op.execute(f'ALTER TABLE "{table}" DROP CONSTRAINT IF EXISTS "ck_{table}_status_not_null"')
+    op.alter_column(table, 'status', new_column_name='status_text')
+    op.add_column(table, sa.Column('status', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    backfill_in_batches(table, f"status = {TO_TEXT}", condition="status IS NULL")
+    op.execute(f'UPDATE "{table}" SET status = {TO_TEXT} WHERE status IS NULL')
+    op.drop_column(table, 'status_text')
+    set_not_null(table, 'status')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    convert_to_code('loan')
+    convert_to_code('loan_archive')
+    create_index_concurrently('ix_loan_active_book_id', 'loan', ['book_id'], postgresql_where=ACTIVE)
+    create_index_concurrently('ix_loan_active_user_id', 'loan', ['user_id'], postgresql_where=ACTIVE)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    drop_index_concurrently('ix_loan_active_user_id', 'loan')
+    drop_index_concurrently('ix_loan_active_book_id', 'loan')
+    convert_to_text('loan_archive')
+    convert_to_text('loan')
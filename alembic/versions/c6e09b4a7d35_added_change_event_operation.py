@@ -0,0 +1,37 @@
+"""added change event operation
+
+Revision ID: c6e09b4a7d35
+Revises: 5d2b8e7c4f61
+Create Date: 2026-10-19 19:48:11.260973
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from migration_utils import is_postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c6e09b4a7d35'
+down_revision: Union[str, Sequence[str], None] = '5d2b8e7c4f61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # A constant default: PostgreSQL adds the column without rewriting the table.
+    op.add_column('change_event', sa.Column('operation', sqlmodel.sql.sqltypes.AutoString(), nullable=False, server_default='update'))
+    if not is_postgresql():
+        # SQLite reuses the highest rowid once it is deleted; AUTOINCREMENT
+        # keeps change ids increasing after old events are pruned.
+        with op.batch_alter_table('change_event', recreate='always', table_kwargs={'sqlite_autoincrement': True}):
+            pass
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('change_event') as batch_op:
+        batch_op.drop_column('operation')
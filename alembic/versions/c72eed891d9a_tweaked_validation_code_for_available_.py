@@ -1,33 +0,0 @@
-"""tweaked validation code for available_copies in book
-
-Revision ID: c72eed891d9a
-Revises: 0c16befb45b4
-Create Date: 2026-02-04 18:42:32.791034
-
-"""
-from typing import Sequence, Union
-
-from alembic import op
-import sqlalchemy as sa
-import sqlmodel
-
-
-# revision identifiers, used by Alembic.
-revision: str = 'c72eed891d9a'
-down_revision: Union[str, Sequence[str], None] = '0c16befb45b4'
-branch_labels: Union[str, Sequence[str], None] = None
-depends_on: Union[str, Sequence[str], None] = None
-
-
-def upgrade() -> None:
-    """Upgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
-
-
-def downgrade() -> None:
-    """Downgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
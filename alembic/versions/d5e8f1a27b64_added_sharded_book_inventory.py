@@ -0,0 +1,44 @@
+"""added sharded book inventory
+
+Revision ID: d5e8f1a27b64
+Revises: a41c6e0d93f2
+Create Date: 2026-10-19 13:41:07.618244
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5e8f1a27b64'
+down_revision: Union[str, Sequence[str], None] = 'a41c6e0d93f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('book', sa.Column('inventory_shards', sa.Integer(), server_default='0', nullable=False))
+    op.create_table('book_inventory_slot',
+    sa.Column('book_id', sa.Integer(), nullable=False),
+    sa.Column('slot', sa.Integer(), nullable=False),
+    sa.Column('available_copies', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['book_id'], ['book.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('book_id', 'slot')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Fold sharded stock back into book.available_copies before dropping the slots.
+    op.execute(
+        "UPDATE book SET available_copies = ("
+        "SELECT COALESCE(SUM(available_copies), 0) FROM book_inventory_slot "
+        "WHERE book_inventory_slot.book_id = book.id) "
+        "WHERE inventory_shards > 0"
+    )
+    op.drop_table('book_inventory_slot')
+    op.drop_column('book', 'inventory_shards')
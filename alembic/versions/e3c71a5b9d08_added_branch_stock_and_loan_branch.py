@@ -0,0 +1,41 @@
+"""added branch stock and loan branch
+
+Revision ID: e3c71a5b9d08
+Revises: b84e1d3f5a20
+Create Date: 2026-10-19 17:42:10.518304
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3c71a5b9d08'
+down_revision: Union[str, Sequence[str], None] = 'b84e1d3f5a20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('branch_stock',
+    sa.Column('book_id', sa.Integer(), nullable=False),
+    sa.Column('branch', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('total_copies', sa.Integer(), nullable=False),
+    sa.Column('available_copies', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['book_id'], ['book.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('book_id', 'branch')
+    )
+    # Nullable without a default, so neither column rewrites the table.
+    op.add_column('loan', sa.Column('branch', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    op.add_column('loan_archive', sa.Column('branch', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('loan_archive', 'branch')
+    op.drop_column('loan', 'branch')
+    op.drop_table('branch_stock')
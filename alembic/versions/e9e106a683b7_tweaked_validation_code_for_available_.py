@@ -1,33 +0,0 @@
-"""tweaked validation code for available_copies in book
-
-Revision ID: e9e106a683b7
-Revises: c72eed891d9a
-Create Date: 2026-02-04 19:00:57.667921
-
-"""
-from typing import Sequence, Union
-
-from alembic import op
-import sqlalchemy as sa
-import sqlmodel
-
-
-# revision identifiers, used by Alembic.
-revision: str = 'e9e106a683b7'
-down_revision: Union[str, Sequence[str], None] = 'c72eed891d9a'
-branch_labels: Union[str, Sequence[str], None] = None
-depends_on: Union[str, Sequence[str], None] = None
-
-
-def upgrade() -> None:
-    """Upgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
-
-
-def downgrade() -> None:
-    """Downgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
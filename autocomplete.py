@@ -0,0 +1,150 @@
+import heapq
+import threading
+from bisect import bisect_left, insort
+from changes import change_bus
+from metrics import metrics
+
+# Book ids returned with one suggestion; a prolific author would otherwise
+# send every one of their books with each keystroke.
+MAX_SUGGESTION_BOOKS = 20
+
+def normalize(text:str) -> str:
+    return " ".join(text.casefold().split())
+
+class PrefixIndex:
+    # Book titles and authors, normalized and kept sorted, so the entries
+    # starting with a prefix are one contiguous run found by bisect. Loaded
+    # in full on a background thread and then patched from the change bus:
+    # changed books are only noted, and read again by the next search.
+    def __init__(self):
+        self._keys = []
+        # (normalized text, field) -> (text as written, ids of its books)
+        self._entries = {}
+        self._book_keys = {}
+        self._lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._reload = True
+        self._stale = set()
+        self._load_all = None
+        self._building = False
+        # Books changed while a full load runs; its rows may predate them.
+        self._changed_while_building = set()
+
+    def start(self, load_all):
+        # load_all() returns (id, title, author) rows. Searches keep using
+        # the current index, empty at first, until a load completes.
+        self._load_all = load_all
+        self.reset()
+
+    def stop(self):
+        self._load_all = None
+
+    def invalidate(self, entity:str, entity_id:int | None):
+        if entity != "book":
+            return
+        with self._pending_lock:
+            if entity_id is None:
+                self._reload = True
+            else:
+                self._stale.add(entity_id)
+                if self._building:
+                    self._changed_while_building.add(entity_id)
+        if entity_id is None:
+            self._load_in_background()
+
+    def reset(self):
+        self.invalidate("book", None)
+
+    def rebuild(self, rows):
+        # Built aside, then swapped in, so searches never wait for a load.
+        fresh = PrefixIndex()
+        fresh._build(rows)
+        with self._lock:
+            self._keys, self._entries, self._book_keys = fresh._keys, fresh._entries, fresh._book_keys
+            with self._pending_lock:
+                self._stale |= self._changed_while_building
+                self._changed_while_building = set()
+        metrics.increment("autocomplete.rebuilds")
+
+    def refresh(self, load_books):
+        # load_books(ids) returns (id, title, author) rows; a book missing
+        # from them was deleted.
+        with self._lock:
+            with self._pending_lock:
+                stale, self._stale = self._stale, set()
+            if stale:
+                rows = load_books(list(stale))
+                for book_id in stale:
+                    self._remove(book_id)
+                for row in rows:
+                    self._add(*row)
+                metrics.increment("autocomplete.books_refreshed", len(stale))
+
+    def search(self, prefix:str, limit:int) -> list[tuple[str, str, list[int]]]:
+        prefix = normalize(prefix)
+        results = []
+        with self._lock:
+            position = bisect_left(self._keys, (prefix,))
+            while position < len(self._keys) and len(results) < limit:
+                key = self._keys[position]
+                if not key[0].startswith(prefix):
+                    break
+                text, book_ids = self._entries[key]
+                results.append((text, key[1], heapq.nsmallest(MAX_SUGGESTION_BOOKS, book_ids)))
+                position += 1
+        return results
+
+    def _load_in_background(self):
+        with self._pending_lock:
+            if self._building or self._load_all is None:
+                return
+            self._building = True
+        threading.Thread(target=self._load, name="autocomplete-load", daemon=True).start()
+
+    def _load(self):
+        try:
+            while True:
+                with self._pending_lock:
+                    load_all = self._load_all
+                    if not self._reload or load_all is None:
+                        self._building = False
+                        return
+                    self._reload = False
+                    self._changed_while_building = set()
+                self.rebuild(load_all())
+        except Exception:
+            metrics.increment("autocomplete.load_errors")
+            # Left for the next full invalidation to retry.
+            with self._pending_lock:
+                self._reload = True
+                self._building = False
+
+    def _build(self, rows):
+        self._entries, self._book_keys = {}, {}
+        for row in rows:
+            self._add(*row, keep_sorted=False)
+        self._keys = sorted(self._entries)
+
+    def _add(self, book_id:int, title:str, author:str, keep_sorted:bool=True):
+        keys = []
+        for field, text in (("title", title), ("author", author)):
+            key = (normalize(text), field)
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = (text, set())
+                if keep_sorted:
+                    insort(self._keys, key)
+            entry[1].add(book_id)
+            keys.append(key)
+        self._book_keys[book_id] = keys
+
+    def _remove(self, book_id:int):
+        for key in self._book_keys.pop(book_id, ()):
+            book_ids = self._entries[key][1]
+            book_ids.discard(book_id)
+            if not book_ids:
+                del self._entries[key]
+                del self._keys[bisect_left(self._keys, key)]
+
+book_suggestions = PrefixIndex()
+change_bus.subscribe(book_suggestions.invalidate)
@@ -0,0 +1,79 @@
+import threading
+import time
+from crud import borrow_books_batch_logic
+from metrics import metrics
+
+class PendingBorrow:
+    __slots__ = ("user_id", "done", "result", "error")
+
+    def __init__(self, user_id:int):
+        self.user_id = user_id
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class BorrowCoalescer:
+    # The first borrow of a book to arrive becomes the leader: it waits one
+    # window for other borrows of the same book to join, then runs them all
+    # as one transaction on its own session while the others wait for their
+    # individual results. With admission control, each batch takes one of
+    # the book's in-flight slots, held by the leader until the batch is done.
+    def __init__(
+            self,
+            window_seconds:float,
+            max_batch:int,
+            borrow_batch=borrow_books_batch_logic,
+            admission=None
+            ):
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self._borrow_batch = borrow_batch
+        self._admission = admission
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def borrow(self, session, book_id:int, user_id:int):
+        request = PendingBorrow(user_id)
+        with self._lock:
+            batch = self._pending.get(book_id)
+            leader = batch is None
+            if leader:
+                if self._admission is not None:
+                    self._admission.acquire_book(book_id)
+                batch = self._pending[book_id] = []
+            batch.append(request)
+            if len(batch) >= self.max_batch:
+                # Full: later arrivals start the next batch.
+                del self._pending[book_id]
+        if leader:
+            try:
+                self._lead(session, book_id, batch)
+            finally:
+                if self._admission is not None:
+                    self._admission.release(book_id)
+        else:
+            request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _lead(self, session, book_id:int, batch:list[PendingBorrow]):
+        time.sleep(self.window_seconds)
+        with self._lock:
+            if self._pending.get(book_id) is batch:
+                del self._pending[book_id]
+        metrics.increment("borrow_batch.batches")
+        metrics.increment("borrow_batch.requests", len(batch))
+        try:
+            results = self._borrow_batch(session, book_id, [request.user_id for request in batch])
+            for request, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    request.error = result
+                else:
+                    request.result = result
+        except Exception as error:
+            for request in batch:
+                request.error = error
+        finally:
+            for request in batch:
+                request.done.set()
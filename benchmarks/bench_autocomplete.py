@@ -0,0 +1,63 @@
+"""Search time of the in-memory autocomplete index in autocomplete.py on a
+synthetic catalog, next to the LIKE scan it replaces.
+
+    python benchmarks/bench_autocomplete.py --books 1000000 --searches 20000
+
+Titles and authors are random words. Prefixes are taken from random titles
+and cut to 1-6 characters, as typed into a search box. The LIKE scan runs a
+case-insensitive substring match over the same titles in Python, which is
+a lower bound for a table scan in the database.
+"""
+import argparse
+import random
+import string
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from autocomplete import PrefixIndex
+
+def word(rng):
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))).capitalize()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=1_000_000)
+    parser.add_argument("--searches", type=int, default=20_000)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    authors = [f"{word(rng)} {word(rng)}" for _ in range(max(args.books // 20, 1))]
+    rows = [(i, " ".join(word(rng) for _ in range(rng.randint(1, 5))), rng.choice(authors)) for i in range(1, args.books + 1)]
+
+    index = PrefixIndex()
+    started = time.perf_counter()
+    index.rebuild(rows)
+    print(f"built index over {args.books} books in {time.perf_counter() - started:.2f}s")
+
+    prefixes = [rng.choice(rows)[1][:rng.randint(1, 6)] for _ in range(args.searches)]
+    started = time.perf_counter()
+    for prefix in prefixes:
+        index.search(prefix, args.limit)
+    print(f"index search  {(time.perf_counter() - started) / args.searches * 1_000_000:10.1f} us/search")
+
+    titles = [title.casefold() for _, title, _ in rows]
+    scans = max(args.searches // 1000, 5)
+    started = time.perf_counter()
+    for prefix in prefixes[:scans]:
+        prefix = prefix.casefold()
+        [title for title in titles if prefix in title][:args.limit]
+    print(f"LIKE scan     {(time.perf_counter() - started) / scans * 1_000_000:10.1f} us/search")
+
+    started = time.perf_counter()
+    changed = rng.sample(range(1, args.books + 1), 1000)
+    for book_id in changed:
+        index.invalidate("book", book_id)
+    index.refresh(lambda book_ids: [(book_id, f"Renamed {book_id}", "Someone") for book_id in book_ids])
+    print(f"refreshed 1000 changed books in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+if __name__ == "__main__":
+    main()
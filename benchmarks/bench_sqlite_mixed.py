@@ -0,0 +1,110 @@
+"""Reads and writes per second on a SQLite file under mixed load, with the
+driver defaults versus the tuned embedded mode in database.py.
+
+    python benchmarks/bench_sqlite_mixed.py --readers 8 --writers 4 --seconds 5
+
+Every reader and writer runs in its own process. Readers fetch random books.
+Writers borrow a random book and return the loan straight away. In the tuned mode connections get the pragmas from
+SQLITE_PRAGMAS (WAL among them) and writes open with BEGIN IMMEDIATE; in the
+default mode every worker just opens a session. "locked" counts the
+operations that failed with "database is locked".
+"""
+import argparse
+import multiprocessing
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi import HTTPException
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, SQLModel, create_engine
+from config import Settings
+from crud import borrow_book_logic, get_book_logic, return_book_logic
+from database import configure_sqlite
+from models import Book, User
+
+def seed(engine, books, users):
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all([
+            Book(title=f"b{i}", author="a", isbn=f"isbn-{i}", publication_year=2000, total_copies=1000, available_copies=1000)
+            for i in range(books)
+            ])
+        session.add_all([User(name=f"u{i}", email=f"u{i}@example.com") for i in range(users)])
+        session.commit()
+
+def worker(role, url, tuned, args, deadline, results):
+    # Each worker is its own process, like the workers of a uvicorn server,
+    # so the GIL does not hide the database's locking.
+    engine = create_engine(url)
+    write_engine = engine
+    if tuned:
+        engine = configure_sqlite(engine, Settings().sqlite_pragmas)
+        write_engine = engine.execution_options(sqlite_write=True)
+    counts = {"reads": 0, "writes": 0, "locked": 0}
+
+    def write(write_op):
+        # One thread per process, so the app's in-process write queue would
+        # never have anyone to wait for.
+        with Session(write_engine, expire_on_commit=False) as session:
+            return write_op(session)
+
+    with Session(engine, expire_on_commit=False) as session:
+        while time.monotonic() < deadline:
+            try:
+                if role == "reader":
+                    get_book_logic(session, random.randint(1, args.books))
+                    session.rollback()
+                    counts["reads"] += 1
+                else:
+                    loan = write(lambda session: borrow_book_logic(session, random.randint(1, args.books), random.randint(1, args.users)))
+                    write(lambda session: return_book_logic(session, loan.id))
+                    counts["writes"] += 1
+            except OperationalError:
+                session.rollback()
+                counts["locked"] += 1
+            except HTTPException:
+                pass
+    engine.dispose()
+    results.put(counts)
+
+def run(url, tuned, args):
+    results = multiprocessing.Queue()
+    deadline = time.monotonic() + args.seconds
+    roles = ["reader"] * args.readers + ["writer"] * args.writers
+    processes = [multiprocessing.Process(target=worker, args=(role, url, tuned, args, deadline, results)) for role in roles]
+    for process in processes:
+        process.start()
+    totals = {"reads": 0, "writes": 0, "locked": 0}
+    for _ in processes:
+        for name, value in results.get().items():
+            totals[name] += value
+    for process in processes:
+        process.join()
+    return {"reads": totals["reads"] / args.seconds, "writes": totals["writes"] / args.seconds, "locked": totals["locked"]}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--books", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'mode':<10}{'reads/s':>10}{'writes/s':>10}{'locked':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ("default", "tuned"):
+            url = f"sqlite:///{Path(directory) / f'{mode}.db'}"
+            engine = create_engine(url)
+            seed(engine, args.books, args.users)
+            engine.dispose()
+            result = run(url, mode == "tuned", args)
+            print(f"{mode:<10}{result['reads']:>10.0f}{result['writes']:>10.0f}{result['locked']:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Python overhead per query for statements built on every call versus the
+prebuilt statements in crud.py.
+
+    python benchmarks/bench_statement_overhead.py --calls 20000
+
+Runs against an in-memory SQLite database holding a single book, so the time
+measured is almost all SQLAlchemy: building the construct, computing its
+cache key, compiling (only without the statement cache) and processing the
+result. "build only" leaves out execution entirely.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine, select
+from crud import LOCK_UNSHARDED_BOOK
+from database import compiled_cache_hit_rate, instrument_engine
+from metrics import metrics
+from models import Book
+
+def per_call(calls, run):
+    run()
+    started = time.perf_counter()
+    for _ in range(calls):
+        run()
+    return (time.perf_counter() - started) / calls * 1_000_000
+
+def make_engine(**options):
+    engine = instrument_engine(create_engine("sqlite://", poolclass=StaticPool, **options))
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        book = Book(title="bench", author="bench", isbn="bench", publication_year=2000, total_copies=1, available_copies=1)
+        session.add(book)
+        session.commit()
+        return engine, book.id
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=20_000)
+    args = parser.parse_args()
+
+    engine, book_id = make_engine()
+    uncached_engine, _ = make_engine(query_cache_size=0)
+
+    def build():
+        return select(Book).where(Book.id == book_id, Book.inventory_shards == 0).with_for_update()
+
+    with Session(engine) as session, Session(uncached_engine) as uncached:
+        cases = (
+            ("build only, rebuilt", lambda: build()._generate_cache_key()),
+            ("build only, prebuilt", lambda: LOCK_UNSHARDED_BOOK._generate_cache_key()),
+            ("no statement cache", lambda: uncached.exec(build()).first()),
+            ("rebuilt per call", lambda: session.exec(build()).first()),
+            ("prebuilt", lambda: session.exec(LOCK_UNSHARDED_BOOK, params={"book_id": book_id}).first()),
+            )
+        print(f"{'statement':<24}{'us/call':>10}")
+        for name, run in cases:
+            print(f"{name:<24}{per_call(args.calls, run):>10.1f}")
+    counters = metrics.snapshot()["counters"]
+    print(
+        f"compiled cache hits {counters.get('sql.compiled_cache.hits', 0)}, "
+        f"misses {counters.get('sql.compiled_cache.misses', 0)}, "
+        f"uncached {counters.get('sql.compiled_cache.uncached', 0)}, "
+        f"hit rate {compiled_cache_hit_rate()}"
+        )
+    engine.dispose()
+    uncached_engine.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import threading
+from collections import OrderedDict
+
+class CollectionVersions:
+    # Write paths bump the collections they change after commit; cached
+    # responses are keyed on the versions they were built from, so a bump
+    # makes older entries unreachable without having to find and evict them.
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def bump(self, *collections:str):
+        with self._lock:
+            for collection in collections:
+                self._versions[collection] = self._versions.get(collection, 0) + 1
+
+    def get(self, *collections:str) -> tuple[int, ...]:
+        return tuple(self._versions.get(collection, 0) for collection in collections)
+
+class ResponseCache:
+    def __init__(self, max_entries:int=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+# Each app gets its own ResponseCache, sized from its settings, in create_app.
+collection_versions = CollectionVersions()
@@ -0,0 +1,243 @@
+import threading
+import uuid
+from datetime import datetime, timezone, timedelta
+from select import select as wait_readable
+from sqlalchemy import DDL, DateTime, Engine, event
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.sql.expression import FunctionElement
+from sqlmodel import Session, select, insert, delete, func, bindparam
+from cache import collection_versions
+from metrics import metrics
+from models import ChangeEvent
+
+CHANNEL = "library_changes"
+# Written with every change event, so a process can tell its own changes
+# (already applied after commit) from those of other processes.
+NODE_ID = uuid.uuid4().hex[:12]
+ENTITY_COLLECTIONS = {"book": "books", "user": "users", "loan": "loans"}
+POLL_BATCH_SIZE = 1000
+
+class change_clock(FunctionElement):
+    # The database clock when the row is written. On PostgreSQL now() would
+    # be the start of the transaction, which can be long before its change
+    # ids are taken.
+    type = DateTime(timezone=True)
+    inherit_cache = True
+
+@compiles(change_clock)
+def _compile_change_clock(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+@compiles(change_clock, "postgresql")
+def _compile_change_clock_postgresql(element, compiler, **kw):
+    return "clock_timestamp()"
+
+class settled_before(FunctionElement):
+    # The database clock minus the given number of seconds, so the settle
+    # time of the change feed never depends on the API host's clock.
+    type = DateTime(timezone=True)
+    inherit_cache = True
+
+@compiles(settled_before)
+def _compile_settled_before(element, compiler, **kw):
+    return "datetime('now', '-' || %s || ' seconds')" % compiler.process(element.clauses, **kw)
+
+@compiles(settled_before, "postgresql")
+def _compile_settled_before_postgresql(element, compiler, **kw):
+    return "clock_timestamp() - make_interval(secs => %s)" % compiler.process(element.clauses, **kw)
+
+RECORD_CHANGES = insert(ChangeEvent).values(created_at=change_clock())
+CHANGES_SINCE = (
+    select(ChangeEvent)
+    .where(ChangeEvent.id > bindparam("since"))
+    .order_by(ChangeEvent.id)
+    .limit(bindparam("limit"))
+    )
+LAST_CHANGE = select(func.coalesce(func.max(ChangeEvent.id), 0))
+
+# On PostgreSQL every change_event row is also sent as a notification. Run
+# by create_all and by the migration that adds change_event. The
+# notification goes out when the writing transaction commits, so listeners
+# never see a change that was rolled back. Payload: id:entity:entity_id:origin.
+NOTIFY_FUNCTION = DDL(f"""
+CREATE OR REPLACE FUNCTION notify_change_event() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{CHANNEL}', NEW.id || ':' || NEW.entity || ':' || coalesce(NEW.entity_id::text, '') || ':' || NEW.origin);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+""")
+NOTIFY_TRIGGER = DDL(
+    "CREATE TRIGGER change_event_notify AFTER INSERT ON change_event "
+    "FOR EACH ROW EXECUTE FUNCTION notify_change_event()"
+    )
+event.listen(ChangeEvent.__table__, "after_create", NOTIFY_FUNCTION.execute_if(dialect="postgresql"))
+event.listen(ChangeEvent.__table__, "after_create", NOTIFY_TRIGGER.execute_if(dialect="postgresql"))
+
+class ChangeBus:
+    # Applies committed changes to this process's caches, whether they were
+    # made here or received from another process.
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        # callback(entity, entity_id) runs once per change; entity_id is
+        # None when the whole collection changed.
+        self._subscribers.append(callback)
+
+    def apply(self, changes:list[tuple[str, int | None]]):
+        collection_versions.bump(*{
+            ENTITY_COLLECTIONS[entity] for entity, _ in changes if entity in ENTITY_COLLECTIONS
+            })
+        for callback in self._subscribers:
+            for entity, entity_id in changes:
+                callback(entity, entity_id)
+
+    def apply_all(self):
+        # Used when changes may have been missed, e.g. after reconnecting.
+        self.apply([(entity, None) for entity in ENTITY_COLLECTIONS])
+
+change_bus = ChangeBus()
+
+def record_changes(session:Session, *changes):
+    # Marks model instances as changed in the current transaction, or rows
+    # that were not loaded as (entity, entity_id, operation). The
+    # change_event rows are written just before commit, once new rows have
+    # their ids.
+    session.info.setdefault("pending_changes", []).extend(changes)
+
+@event.listens_for(OrmSession, "after_flush")
+def _track_flushed_rows(session, flush_context):
+    # Whether an instance was inserted or deleted is only visible while it
+    # is flushed, which may come before or after record_changes.
+    flushed = session.info.setdefault("flushed_operations", {})
+    flushed.update((id(instance), "insert") for instance in session.new)
+    flushed.update((id(instance), "delete") for instance in session.deleted)
+
+@event.listens_for(OrmSession, "before_commit")
+def _write_change_events(session):
+    pending = session.info.pop("pending_changes", None)
+    if not pending:
+        return
+    session.flush()
+    flushed = session.info.get("flushed_operations", {})
+    changes = list(dict.fromkeys(
+        change if isinstance(change, tuple)
+        else (change.__tablename__, change.id, flushed.get(id(change), "update"))
+        for change in pending
+        ))
+    session.execute(RECORD_CHANGES, [
+        {"entity": entity, "entity_id": entity_id, "operation": operation, "origin": NODE_ID}
+        for entity, entity_id, operation in changes
+        ])
+    session.info["committed_changes"] = [(entity, entity_id) for entity, entity_id, _ in changes]
+
+@event.listens_for(OrmSession, "after_commit")
+def _apply_committed_changes(session):
+    session.info.pop("flushed_operations", None)
+    changes = session.info.pop("committed_changes", None)
+    if changes:
+        metrics.increment("changes.published", len(changes))
+        change_bus.apply(changes)
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_changes(session):
+    session.info.pop("flushed_operations", None)
+    session.info.pop("pending_changes", None)
+    session.info.pop("committed_changes", None)
+
+def parse_payload(payload:str):
+    change_id, entity, entity_id, origin = payload.split(":")
+    return int(change_id), entity, int(entity_id) if entity_id else None, origin
+
+class ChangeListener:
+    # Runs on a background thread in each API process. On PostgreSQL it waits
+    # on LISTEN and applies notifications as they arrive. On other databases
+    # it polls change_event for rows past the last id it has seen; SQLite
+    # has a single writer, so ids are committed in order.
+    def __init__(
+            self,
+            engine:Engine,
+            poll_interval:float=0.5,
+            bus:ChangeBus = change_bus
+            ):
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.bus = bus
+        self.last_id = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="change-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
+
+    def poll(self) -> int:
+        with Session(self.engine) as session:
+            if self.last_id is None:
+                # Changes from before the process started are already
+                # reflected in what it reads from the database.
+                self.last_id = session.exec(LAST_CHANGE).one()
+                return 0
+            rows = session.exec(CHANGES_SINCE, params={"since": self.last_id, "limit": POLL_BATCH_SIZE}).all()
+        if rows:
+            self.last_id = rows[-1].id
+        return self._deliver([(row.entity, row.entity_id) for row in rows if row.origin != NODE_ID])
+
+    def _deliver(self, changes:list[tuple[str, int | None]]) -> int:
+        if changes:
+            metrics.increment("changes.received", len(changes))
+            self.bus.apply(changes)
+        return len(changes)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.engine.dialect.name == "postgresql":
+                    self._listen()
+                else:
+                    self.poll()
+            except Exception:
+                metrics.increment("changes.listener_errors")
+            self._stop.wait(self.poll_interval)
+
+    def _listen(self):
+        # A dedicated connection, taken out of the pool so that the LISTEN
+        # and autocommit mode never leak into request sessions.
+        raw = self.engine.raw_connection()
+        raw.detach()
+        try:
+            connection = raw.driver_connection
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            # Notifications sent while no connection was listening are lost.
+            self.bus.apply_all()
+            while not self._stop.is_set():
+                if not wait_readable([connection], [], [], self.poll_interval)[0]:
+                    continue
+                connection.poll()
+                changes = []
+                while connection.notifies:
+                    change_id, entity, entity_id, origin = parse_payload(connection.notifies.pop(0).payload)
+                    self.last_id = max(self.last_id or 0, change_id)
+                    if origin != NODE_ID:
+                        changes.append((entity, entity_id))
+                self._deliver(changes)
+        finally:
+            raw.close()
+
+def prune_change_events(
+        session:Session,
+        older_than_hours:int
+        ):
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=older_than_hours)
+    deleted = session.exec(delete(ChangeEvent).where(ChangeEvent.created_at < cutoff)).rowcount
+    session.commit()
+    return {"deleted": deleted}
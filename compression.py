@@ -0,0 +1,111 @@
+import gzip
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+from cache import collection_versions
+from database import SharedReads
+from singleflight import single_flight
+from timeouts import ClientDisconnected
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def supported_encodings() -> list[str]:
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+def choose_encoding(accept_encoding:str) -> str | None:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    for encoding in supported_encodings():
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+def compress(body:bytes, encoding:str, level:int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=min(level, 11))
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+def serialize(schema, data) -> bytes:
+    adapter = TypeAdapter(schema)
+    return adapter.dump_json(adapter.validate_python(data, from_attributes=True))
+
+def lead(request:Request, produce):
+    # Runs produce() for a shared read. A query cancelled because this
+    # request's client disconnected comes out as ClientDisconnected, which
+    # the requests waiting on the same flight retry instead of sharing.
+    guard = getattr(request.state, "query_guard", None)
+
+    def run(*args):
+        try:
+            return produce(*args)
+        except Exception as error:
+            if guard is not None and guard.cancelled and not isinstance(error, ClientDisconnected):
+                raise ClientDisconnected() from error
+            raise
+
+    return run
+
+async def cached_list_response(
+        request:Request,
+        reads:SharedReads,
+        collections:tuple[str, ...],
+        schema,
+        produce
+        ):
+    # The versions are read before querying, so a write that lands while the
+    # page is being built bumps past this key instead of leaving it stale.
+    settings = request.app.state.settings
+    response_cache = request.app.state.response_cache
+    enabled = request.url.path in settings.compressed_routes
+    encoding = choose_encoding(request.headers.get("accept-encoding", "")) if enabled else None
+    key = (request.url.path, request.url.query, collection_versions.get(*collections), encoding)
+
+    def build(session):
+        body = serialize(schema, lead(request, produce)(session))
+        if encoding is not None and len(body) >= settings.compression_min_size:
+            cached = (compress(body, encoding, settings.compression_level), encoding)
+        else:
+            cached = (body, None)
+        response_cache.put(key, cached)
+        return cached
+
+    # Concurrent misses for the same page build it once.
+    body, encoding = response_cache.get(key) or await single_flight.do(key, lambda: reads.run(build))
+    headers = {"Vary": "Accept-Encoding"} if enabled else {}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def shared_response(
+        request:Request,
+        reads:SharedReads,
+        collections:tuple[str, ...],
+        schema,
+        produce
+        ):
+    # Identical requests that arrive while one is being served wait for it
+    # and get the same body instead of each querying and serializing. The
+    # versions in the key keep a request that arrives after a write from
+    # joining a read that started before it.
+    key = (request.url.path, request.url.query, collection_versions.get(*collections))
+    build = lambda session: serialize(schema, lead(request, produce)(session))
+    body = await single_flight.do(key, lambda: reads.run(build))
+    return Response(content=body, media_type="application/json")
+
+async def read_response(reads:SharedReads, schema, produce):
+    # For the reads on shared routes that are not themselves shared;
+    # serialized on the worker thread, while the session is still open.
+    body = await reads.run(lambda session: serialize(schema, produce(session)))
+    return Response(content=body, media_type="application/json")
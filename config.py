@@ -0,0 +1,98 @@
+from functools import lru_cache
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+class Settings(BaseSettings):
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+    sqlalchemy_database_url: str | None = None
+    sqlalchemy_echo: bool = False
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    # Requests that use the database run at most this many at once. The
+    # pool keeps one connection per slot (db_max_overflow still covers
+    # background work), 4 requests per slot may wait, and any more get a
+    # 503 at once. The threadpool is sized to match. 0 leaves db_pool_size
+    # and anyio's threadpool of 40 as they are.
+    db_concurrency: int = 0
+    # Request sessions abort a statement that runs longer than this (504),
+    # or that waits longer than the lock timeout for a row lock (503). On
+    # SQLite lock waits are bounded by the busy_timeout pragma instead. 0
+    # turns a limit off. Endpoints can have their own limits, e.g.
+    # {"GET /loans": {"statement": 15000}}.
+    db_statement_timeout_ms: int = 5000
+    db_lock_timeout_ms: int = 2000
+    db_endpoint_timeouts_ms: dict[str, dict[str, int]] = {}
+    # Connections opened by the lifespan hook before the first request.
+    db_prewarm_connections: int = 0
+    # Runs the list reads once at startup, so their compiled statements are
+    # cached before the first request.
+    db_prewarm_caches: bool = False
+    # Applied to every new SQLite connection.
+    sqlite_pragmas: dict[str, str] = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": "5000",
+        "cache_size": "-65536",
+        "temp_store": "MEMORY",
+        "mmap_size": "268435456",
+        }
+    # Write requests allowed to wait for the SQLite write slot before new
+    # ones are turned away with a 503.
+    sqlite_write_queue_size: int = 64
+    # Returned loans older than this are moved from loan to loan_archive.
+    loan_archive_after_days: int = 90
+    loan_archive_batch_size: int = 1000
+    # Batches one call of POST /admin/loans/archive moves at most; the rest
+    # is left for the next call.
+    loan_archive_max_batches: int = 10
+    # List pages are cached as (compressed) bytes until a write bumps the
+    # collection version; only these paths are compressed. Compression is
+    # done by the GET /books, /users and /loans handlers, not a middleware,
+    # so other paths listed here are ignored.
+    compressed_routes: list[str] = ["/books", "/users", "/loans"]
+    compression_min_size: int = 1024
+    compression_level: int = 6
+    response_cache_entries: int = 256
+    # Admission control on POST /books/{book_id}/borrow.
+    borrow_admission_enabled: bool = True
+    borrow_user_rate_per_second: float = 1.0
+    borrow_user_burst: int = 5
+    borrow_book_max_in_flight: int = 4
+    # Group commit: concurrent borrows of one book arriving within this
+    # window run as a single transaction. 0 turns coalescing off.
+    borrow_batch_window_ms: float = 0
+    borrow_batch_max_size: int = 64
+    # Library branches and the database each one lives in, e.g.
+    # {"north": "sqlite:///north.db", "south": ""}. An empty URL keeps the
+    # branch in the main database.
+    branch_databases: dict[str, str] = {}
+    # Threads used to read all branch databases at once.
+    branch_fan_out_workers: int = 8
+    # Each API process listens for changes committed by the others and
+    # invalidates its caches: LISTEN/NOTIFY on PostgreSQL, polling the
+    # change_event table elsewhere. Off by default; deployments that run
+    # more than one API process must turn it on.
+    change_listener_enabled: bool = False
+    change_poll_interval_ms: float = 500
+    change_event_retention_hours: int = 24
+    # manage.py count-related only counts loans borrowed at least this long
+    # ago, so a loan committed late is not skipped.
+    cooccurrence_settle_seconds: float = 60
+    cooccurrence_batch_size: int = 1000
+    # GET /changes waits this long for a missing change id to be committed
+    # before it skips it as rolled back.
+    change_feed_settle_ms: float = 5000
+    # GET /health/ready answers 503 once any of these limits is passed, so
+    # the load balancer stops sending traffic before requests time out.
+    health_probe_interval_ms: float = 1000
+    health_max_db_latency_ms: float = 250
+    health_max_checkout_wait_ms: float = 100
+    health_max_pool_usage: float = 0.9
+    health_max_in_flight: int = 200
+    # A probe still waiting for a connection or for SELECT 1 after this long
+    # counts as failed.
+    health_probe_timeout_ms: float = 1000
+
+@lru_cache
+def get_settings() -> Settings:
+    return Settings()
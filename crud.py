@@ -1,11 +1,188 @@
 from database import SessionLocal
-from models import Book, User, Loan
-from schemas import BookCreate, UserCreate, LoanCreate
+from notifications import availability_hub
+from autocomplete import book_suggestions
+from changes import record_changes, settled_before
+from models import Book, BookCooccurrence, BookInventorySlot, BranchStock, ChangeEvent, JobCursor, User, Loan, LoanArchive, LoanStatus, LoanStatusType, Hold
+from schemas import BookCreate, UserCreate, UserPublic, LoanCreate, LoanPublic, BranchStockPublic, CatalogEntry, RelatedBook, ChangePublic, ChangeFeed, BookSuggestion
 from fastapi import HTTPException, Query
-from sqlmodel import select
+from sqlmodel import Session, select, insert, update, delete, union, union_all, literal, func, case, bindparam, text, true
 from typing import Annotated
 from datetime import datetime, timezone, timedelta
+import heapq
+import random
+from collections import Counter, defaultdict
+from itertools import islice, takewhile
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import NoResultFound
+from sqlalchemy.orm import joinedload, selectinload
+
+MAX_BATCH_SIZE = 100
+
+# The status code is rendered inline rather than bound, so that the planner
+# can match the query to the partial active-loan indexes.
+LOAN_IS_ACTIVE = Loan.status != bindparam("returned_status", LoanStatus.RETURNED, type_=LoanStatusType(), literal_execute=True)
+
+# Statements on the hot paths are built once, with bound parameters for the
+# values that change per call. Their cache key is computed once per object,
+# so each call skips building the construct and goes straight to the
+# compiled SQL in the engine's statement cache.
+BOOKS_PAGE = select(Book).offset(bindparam("offset")).limit(bindparam("limit"))
+USERS_PAGE = select(User).offset(bindparam("offset")).limit(bindparam("limit"))
+LOANS_PAGE = select(Loan).order_by(Loan.id).offset(bindparam("offset")).limit(bindparam("limit"))
+USER_LOANS_PAGE = (
+    select(Loan)
+    .where(Loan.user_id == bindparam("user_id"))
+    .order_by(Loan.id)
+    .offset(bindparam("offset"))
+    .limit(bindparam("limit"))
+    )
+USER_BY_ID = select(User).where(User.id == bindparam("user_id"))
+LOCK_BOOK = select(Book).where(Book.id == bindparam("book_id")).with_for_update()
+LOCK_UNSHARDED_BOOK = select(Book).where(Book.id == bindparam("book_id"), Book.inventory_shards == 0).with_for_update()
+# Returns of a sharded book share-lock its row: they do not wait for each
+# other, but do wait for place_hold_logic, which locks it for update.
+SHARE_BOOK = select(Book).where(Book.id == bindparam("book_id")).with_for_update(read=True)
+# Takes a copy of an unsharded book and returns the updated row in the same
+# statement; no row means the book is missing, sharded or out of stock.
+TAKE_UNSHARDED_COPY = (
+    update(Book)
+    .where(Book.id == bindparam("book_id"), Book.inventory_shards == 0, Book.available_copies > 0)
+    .values(available_copies=Book.available_copies - 1)
+    .returning(Book)
+    .execution_options(populate_existing=True)
+    )
+LOCK_LOAN = (
+    select(Loan)
+    .options(joinedload(Loan.user, innerjoin=True))
+    .where(Loan.id == bindparam("loan_id"))
+    .with_for_update(of=Loan)
+    )
+LOCK_HOLD = select(Hold).where(Hold.id == bindparam("hold_id")).with_for_update()
+OLDEST_WAITING_HOLD = (
+    select(Hold)
+    .where(Hold.book_id == bindparam("book_id"), Hold.status == "waiting")
+    .order_by(Hold.created_at, Hold.id)
+    .limit(1)
+    )
+OLDEST_WAITING_HOLD_SKIP_LOCKED = OLDEST_WAITING_HOLD.with_for_update(skip_locked=True)
+LOCK_OLDEST_WAITING_HOLD = OLDEST_WAITING_HOLD.with_for_update()
+SLOT_STOCK = (
+    select(func.coalesce(func.sum(BookInventorySlot.available_copies), 0))
+    .where(BookInventorySlot.book_id == bindparam("book_id"))
+    )
+STOCKED_SLOT = (
+    select(BookInventorySlot)
+    .where(BookInventorySlot.book_id == bindparam("book_id"), BookInventorySlot.available_copies > 0)
+    .order_by(func.random())
+    .limit(1)
+    )
+STOCKED_SLOT_SKIP_LOCKED = STOCKED_SLOT.with_for_update(skip_locked=True)
+LOCK_STOCKED_SLOT = STOCKED_SLOT.with_for_update()
+INVENTORY_SLOTS_SKIP_LOCKED = (
+    select(BookInventorySlot)
+    .where(BookInventorySlot.book_id == bindparam("book_id"))
+    .with_for_update(skip_locked=True)
+    )
+LOCK_BRANCH_STOCK = (
+    select(BranchStock)
+    .where(BranchStock.book_id == bindparam("book_id"), BranchStock.branch == bindparam("branch"))
+    .with_for_update()
+    )
+TAKE_BRANCH_COPY = (
+    update(BranchStock)
+    .where(
+        BranchStock.book_id == bindparam("stock_book_id"),
+        BranchStock.branch == bindparam("stock_branch"),
+        BranchStock.available_copies > 0
+        )
+    .values(available_copies=BranchStock.available_copies - 1)
+    .returning(BranchStock)
+    .execution_options(populate_existing=True)
+    )
+PUT_BRANCH_COPY = (
+    update(BranchStock)
+    .where(
+        BranchStock.book_id == bindparam("stock_book_id"),
+        BranchStock.branch == bindparam("stock_branch"),
+        BranchStock.available_copies < BranchStock.total_copies
+        )
+    .values(available_copies=BranchStock.available_copies + 1)
+    .returning(BranchStock)
+    .execution_options(populate_existing=True)
+    )
+COOCCURRENCE_CURSOR = "book_cooccurrence"
+UNCOUNTED_LOANS = (
+    select(Loan.id, Loan.user_id, Loan.book_id, Loan.borrow_date)
+    .where(Loan.id > bindparam("after"))
+    .order_by(Loan.id)
+    .limit(bindparam("limit"))
+    )
+_users_loans = union_all(
+    select(Loan.id, Loan.user_id, Loan.book_id).where(Loan.user_id.in_(bindparam("user_ids", expanding=True))),
+    select(LoanArchive.id, LoanArchive.user_id, LoanArchive.book_id).where(LoanArchive.user_id.in_(bindparam("user_ids", expanding=True)))
+    ).subquery()
+# The loan that first paired each of these users with each of their books.
+FIRST_BORROWS = (
+    select(_users_loans.c.user_id, _users_loans.c.book_id, func.min(_users_loans.c.id))
+    .group_by(_users_loans.c.user_id, _users_loans.c.book_id)
+    )
+RELATED_BOOKS = (
+    select(Book, BookCooccurrence.borrowers)
+    .join(BookCooccurrence, BookCooccurrence.related_book_id == Book.id)
+    .where(BookCooccurrence.book_id == bindparam("book_id"))
+    .order_by(BookCooccurrence.borrowers.desc(), BookCooccurrence.related_book_id.desc())
+    .limit(bindparam("limit"))
+    )
+
+def cooccurrence_upsert(dialect_insert):
+    statement = dialect_insert(BookCooccurrence)
+    return statement.on_conflict_do_update(
+        index_elements=["book_id", "related_book_id"],
+        set_={"borrowers": BookCooccurrence.borrowers + statement.excluded.borrowers}
+        )
+
+COOCCURRENCE_UPSERTS = {
+    "postgresql": cooccurrence_upsert(postgresql.insert),
+    "sqlite": cooccurrence_upsert(sqlite.insert),
+    }
+OLDEST_CHANGE = select(func.min(ChangeEvent.id))
+CHANGE_FEED = (
+    select(ChangeEvent, (ChangeEvent.created_at <= settled_before(bindparam("settle_seconds"))).label("settled"))
+    .where(ChangeEvent.id > bindparam("since"))
+    .order_by(ChangeEvent.id)
+    .limit(bindparam("limit"))
+    )
+SUGGESTION_ROWS = select(Book.id, Book.title, Book.author)
+SUGGESTION_ROWS_BY_ID = SUGGESTION_ROWS.where(Book.id.in_(bindparam("book_ids", expanding=True)))
+BOOK_BY_ISBN = select(Book).where(Book.isbn == bindparam("isbn"))
+BRANCH_CATALOG = select(BranchStock).where(
+    BranchStock.book_id == bindparam("book_id"),
+    BranchStock.branch.in_(bindparam("branches", expanding=True))
+    )
+BRANCH_LOANS = select(Loan).options(selectinload(Loan.book), selectinload(Loan.user)).order_by(Loan.id)
+
+# Books and users are only written to the main database. A branch database
+# keeps a copy of the ones its loans reference, refreshed on every borrow.
+def branch_copy_upsert(dialect_insert, model):
+    statement = dialect_insert(model)
+    return statement.on_conflict_do_update(
+        index_elements=["id"],
+        set_={column.name: statement.excluded[column.name] for column in model.__table__.columns if not column.primary_key}
+        )
+
+BRANCH_COPY_UPSERTS = {
+    dialect: {model: branch_copy_upsert(dialect_insert, model) for model in (Book, User)}
+    for dialect, dialect_insert in (("postgresql", postgresql.insert), ("sqlite", sqlite.insert))
+    }
+# Loans of branches with their own database take their id from the loan
+# sequence of the main database, so an id names one loan across all of them.
+NEXT_LOAN_ID = {
+    "postgresql": [text("SELECT nextval(pg_get_serial_sequence('loan', 'id'))")],
+    "sqlite": [
+        text("INSERT INTO sqlite_sequence (name, seq) SELECT 'loan', 0 WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'loan')"),
+        text("UPDATE sqlite_sequence SET seq = seq + 1 WHERE name = 'loan' RETURNING seq")
+        ],
+    }
 
 def create_book_logic(
         session:SessionLocal, 
@@ -17,11 +194,12 @@ def create_book_logic(
         isbn=book_req.isbn,
         publication_year=book_req.publication_year,
         total_copies=book_req.total_copies,
-        available_copies=book_req.total_copies
+        available_copies=book_req.total_copies,
+        loans=[]
         )
     session.add(book)
+    record_changes(session, book)
     session.commit()
-    session.refresh(book)
     return book
 
 def get_book_logic(
@@ -38,9 +216,69 @@ def get_books_logic(
         offset:Annotated[int, Query(ge=0)]=0,
         limit:Annotated[int, Query(le=100)]=100,
         ):
-    books = session.exec(select(Book).offset(offset).limit(limit)).all()
+    books = session.exec(BOOKS_PAGE, params={"offset": offset, "limit": limit}).all()
     return books
 
+def parse_batch_keys(
+        raw:str,
+        cast=str
+        ):
+    try:
+        keys = [cast(key.strip()) for key in raw.split(",") if key.strip()]
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Batch keys must be a comma separated list.")
+    if not keys:
+        raise HTTPException(status_code=422, detail="At least one batch key is required.")
+    if len(keys) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=422, detail=f"At most {MAX_BATCH_SIZE} keys can be requested at once.")
+    return keys
+
+def get_batch(
+        session:SessionLocal,
+        model,
+        column,
+        keys:list,
+        *options
+        ):
+    # One IN query for the whole batch; results come back in request order
+    # with None marking keys that were not found.
+    rows = session.exec(select(model).where(column.in_(set(keys))).options(*options)).all()
+    found = {getattr(row, column.key): row for row in rows}
+    return [found.get(key) for key in keys]
+
+def load_book_suggestions(engine):
+    # The whole catalog, read outside any request and its statement timeout.
+    with Session(engine) as session:
+        return session.exec(SUGGESTION_ROWS).all()
+
+def warm_caches(engine):
+    # The first page of each list, read once and thrown away: the compiled
+    # statements stay in the engine's cache, the pages in the database's.
+    with Session(engine) as session:
+        get_books_logic(session)
+        get_users_logic(session)
+        get_loans_logic(session)
+
+def autocomplete_books_logic(
+        session:SessionLocal,
+        prefix:str,
+        limit:int=10
+        ):
+    book_suggestions.refresh(lambda book_ids: session.exec(SUGGESTION_ROWS_BY_ID, params={"book_ids": book_ids}).all())
+    return [
+        BookSuggestion(text=text, field=field, book_ids=book_ids)
+        for text, field, book_ids in book_suggestions.search(prefix, limit)
+        ]
+
+def get_books_batch_logic(
+        session:SessionLocal,
+        ids:list[int] | None=None,
+        isbns:list[str] | None=None
+        ):
+    if ids is not None:
+        return get_batch(session, Book, Book.id, ids, selectinload(Book.loans))
+    return get_batch(session, Book, Book.isbn, isbns, selectinload(Book.loans))
+
 def update_book_logic(
         session:SessionLocal,
         book_id:int,
@@ -50,11 +288,16 @@ def update_book_logic(
     if not book_pre:
         raise HTTPException(status_code=404, detail="Book not found.")
     book_data = book_req.model_dump(exclude_unset=True)
-    if book_pre.available_copies > book_data["total_copies"]:
+    if book_pre.inventory_shards:
+        available = lock_inventory_slots(session, book_pre)
+        if available > book_data["total_copies"]:
+            distribute_inventory(session, book_pre, book_data["total_copies"], book_pre.inventory_shards)
+    elif book_pre.available_copies > book_data["total_copies"]:
         book_data["available_copies"] = book_data["total_copies"]
     book_pre.sqlmodel_update(book_data)
+    record_changes(session, book_pre)
     session.commit()
-    session.refresh(book_pre)
+    availability_hub.publish(book_pre.id, "updated", get_available_copies(session, book_pre), book_pre.total_copies)
     return book_pre
 
 def delete_book_logic(
@@ -65,7 +308,9 @@ def delete_book_logic(
     if not book_del:
         raise HTTPException(status_code=404, detail="Book not found.")
     session.delete(book_del)
+    record_changes(session, book_del)
     session.commit()
+    availability_hub.publish(book_id, "deleted")
     return {"message": "Book deleted successfully."}
 
 def create_user_logic(
@@ -73,33 +318,58 @@ def create_user_logic(
         user_req:UserCreate
         ):
     user = User.model_validate(user_req)
+    user.loans = []
     session.add(user)
+    record_changes(session, user)
     session.commit()
-    session.refresh(user)
     return user
 
 def get_user_logic(
         session:SessionLocal,
-        user_id:int
+        user_id:int,
+        branch_router=None
         ):
     user = session.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User does not exist.")
-    return user
+    branch_loans = find_branch_loans(branch_router, Loan.user_id == user_id)
+    if not branch_loans:
+        return user
+    return UserPublic.model_validate({
+        "id": user.id,
+        "name": user.name,
+        "email": user.email,
+        "loans": sorted([*user.loans, *branch_loans], key=lambda loan: loan.id)
+        })
 
 def get_users_logic(
         session:SessionLocal,
         offset:Annotated[int, Query(ge=0)]=0,
         limit:Annotated[int, Query(le=100)]=100,
         ):
-    users = session.exec(select(User).offset(offset).limit(limit)).all()
+    users = session.exec(USERS_PAGE, params={"offset": offset, "limit": limit}).all()
     return users
 
+def get_users_batch_logic(
+        session:SessionLocal,
+        ids:list[int] | None=None,
+        emails:list[str] | None=None
+        ):
+    if ids is not None:
+        return get_batch(session, User, User.id, ids, selectinload(User.loans))
+    return get_batch(session, User, User.email, emails, selectinload(User.loans))
+
 def get_loan_logic(
         session:SessionLocal,
-        loan_id:int
+        loan_id:int,
+        include_archived:bool=False,
+        branch_router=None
         ):
     loan = session.get(Loan, loan_id)
+    if not loan and include_archived:
+        loan = session.get(LoanArchive, loan_id)
+    if not loan:
+        loan = next(iter(find_branch_loans(branch_router, Loan.id == loan_id)), None)
     if not loan:
         raise HTTPException(status_code=404, detail="Loan does not exist.")
     return loan
@@ -108,70 +378,854 @@ def get_loans_logic(
         session:SessionLocal,
         offset:Annotated[int, Query(ge=0)]=0,
         limit:Annotated[int, Query(le=100)]=100,
+        include_archived:bool=False,
+        branch_router=None
+        ):
+    def page(offset, limit):
+        if not include_archived:
+            return session.exec(LOANS_PAGE, params={"offset": offset, "limit": limit}).all()
+        return get_loan_history(session, None, offset, limit)
+    return with_branch_loans(branch_router, page, true(), offset, limit)
+
+def get_loans_batch_logic(
+        session:SessionLocal,
+        ids:list[int],
+        include_archived:bool=False,
+        branch_router=None
         ):
-    loans = session.exec(select(Loan).offset(offset).limit(limit)).all()
+    loans = get_batch(session, Loan, Loan.id, ids, selectinload(Loan.book), selectinload(Loan.user))
+    missing = [loan_id for loan_id, loan in zip(ids, loans) if loan is None]
+    if include_archived and missing:
+        archived = get_batch(session, LoanArchive, LoanArchive.id, missing, selectinload(LoanArchive.book), selectinload(LoanArchive.user))
+        found = dict(zip(missing, archived))
+        loans = [loan if loan is not None else found[loan_id] for loan_id, loan in zip(ids, loans)]
+        missing = [loan_id for loan_id, loan in zip(ids, loans) if loan is None]
+    if missing:
+        found = {loan.id: loan for loan in find_branch_loans(branch_router, Loan.id.in_(missing))}
+        loans = [loan if loan is not None else found.get(loan_id) for loan_id, loan in zip(ids, loans)]
     return loans
 
+def get_user_loans_logic(
+        session:SessionLocal,
+        user_id:int,
+        offset:Annotated[int, Query(ge=0)]=0,
+        limit:Annotated[int, Query(le=100)]=100,
+        include_archived:bool=False,
+        branch_router=None
+        ):
+    if not session.get(User, user_id):
+        raise HTTPException(status_code=404, detail="User does not exist.")
+    def page(offset, limit):
+        if not include_archived:
+            return session.exec(USER_LOANS_PAGE, params={"user_id": user_id, "offset": offset, "limit": limit}).all()
+        return get_loan_history(session, user_id, offset, limit)
+    return with_branch_loans(branch_router, page, Loan.user_id == user_id, offset, limit)
+
+def find_branch_loans(
+        branch_router,
+        condition,
+        limit:int | None=None
+        ):
+    # Loans of the branches with their own database, read from all of those
+    # databases at once and ordered by id.
+    if branch_router is None:
+        return []
+    def read(session, branches):
+        return session.exec(BRANCH_LOANS.where(Loan.branch.in_(branches), condition).limit(limit)).all()
+    return sorted(branch_router.fan_out(read, branch_router.remote_branches()), key=lambda loan: loan.id)
+
+def with_branch_loans(
+        branch_router,
+        page,
+        condition,
+        offset:int,
+        limit:int
+        ):
+    # page(offset, limit) reads the main database in id order. With branch
+    # databases, the first offset + limit loans of every database are merged
+    # and the page is cut from that.
+    if branch_router is None or not branch_router.remote_branches():
+        return page(offset, limit)
+    merged = heapq.merge(
+        page(0, offset + limit),
+        find_branch_loans(branch_router, condition, offset + limit),
+        key=lambda loan: loan.id
+        )
+    return list(islice(merged, offset, offset + limit))
+
+def get_loan_history(
+        session:SessionLocal,
+        user_id:int | None,
+        offset:int,
+        limit:int
+        ):
+    # Page over the ids of both tables first, then load each side with one query.
+    live = select(Loan.id, literal(False).label("archived"))
+    archived = select(LoanArchive.id, literal(True).label("archived"))
+    if user_id is not None:
+        live = live.where(Loan.user_id == user_id)
+        archived = archived.where(LoanArchive.user_id == user_id)
+    history = union_all(live, archived).subquery()
+    page = [
+        (loan_id, bool(is_archived)) for loan_id, is_archived in session.exec(
+            select(history.c.id, history.c.archived).order_by(history.c.id).offset(offset).limit(limit)
+            )
+        ]
+    live_ids = [loan_id for loan_id, is_archived in page if not is_archived]
+    archived_ids = [loan_id for loan_id, is_archived in page if is_archived]
+    loans = {}
+    if live_ids:
+        loans.update({(loan.id, False): loan for loan in session.exec(select(Loan).where(Loan.id.in_(live_ids)))})
+    if archived_ids:
+        loans.update({(loan.id, True): loan for loan in session.exec(select(LoanArchive).where(LoanArchive.id.in_(archived_ids)))})
+    return [loans[key] for key in page if key in loans]
+
+def archive_loans_logic(
+        session:SessionLocal,
+        older_than_days:int,
+        batch_size:int=1000,
+        max_batches:int | None=None
+        ):
+    # Moves returned loans in small transactions so the loan table is never
+    # locked for long while borrows and returns keep running.
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    columns = ["id", "book_id", "user_id", "borrow_date", "due_date", "return_date", "status", "branch"]
+    archived = 0
+    batches = 0
+    has_more = False
+    while True:
+        loan_ids = session.exec(
+            select(Loan.id)
+            .where(Loan.status == LoanStatus.RETURNED, Loan.return_date < cutoff)
+            .order_by(Loan.id)
+            .limit(batch_size)
+            ).all()
+        if not loan_ids:
+            break
+        session.exec(
+            insert(LoanArchive).from_select(
+                columns,
+                select(*[getattr(Loan, column) for column in columns]).where(Loan.id.in_(loan_ids))
+                )
+            )
+        session.exec(delete(Loan).where(Loan.id.in_(loan_ids)))
+        record_changes(session, *[("loan", loan_id, "archive") for loan_id in loan_ids])
+        session.commit()
+        archived += len(loan_ids)
+        batches += 1
+        if len(loan_ids) < batch_size:
+            break
+        if max_batches is not None and batches >= max_batches:
+            has_more = True
+            break
+    return {"archived": archived, "batches": batches, "has_more": has_more}
+
 def borrow_book_logic(
         session:SessionLocal,
         book_id:int,
         user_id:int
         ):
     with session.begin():
-        try:
-            book = session.exec(select(Book).where(Book.id == book_id).with_for_update()).one()
-        except NoResultFound:
-            raise HTTPException(status_code=404, detail="Book not found.")
-        if book.available_copies == 0:
-            raise HTTPException(status_code=412, detail="This book has no available copies.")
-        user = session.exec(select(User).where(User.id == user_id)).one()
+        # Only unsharded books are locked here, by the UPDATE itself; a sharded
+        # book's row is never locked on the borrow path, its stock lives in
+        # the inventory slots.
+        book = session.exec(TAKE_UNSHARDED_COPY, params={"book_id": book_id}).scalar()
+        if not book:
+            book = session.get(Book, book_id)
+            if not book:
+                raise HTTPException(status_code=404, detail="Book not found.")
+            if not book.inventory_shards:
+                raise HTTPException(status_code=412, detail="This book has no available copies.")
+            slot = take_inventory_slot(session, book_id)
+            if not slot:
+                raise HTTPException(status_code=412, detail="This book has no available copies.")
+            slot.available_copies -= 1
+            session.add(slot)
+        user = session.exec(USER_BY_ID, params={"user_id": user_id}).first()
         if not user:
             raise HTTPException(status_code=404, detail="User does not exist.")
-        book.available_copies -= 1
         
         loan_creating = LoanCreate(
             user_id=user_id,
             book_id=book_id
             )
         
+        now = datetime.now(timezone.utc)
         loan = Loan(
             book_id=loan_creating.book_id,
             user_id=loan_creating.user_id,
-            borrow_date=datetime.now(timezone.utc),
-            due_date=datetime.now(timezone.utc)+timedelta(days=14),
+            borrow_date=now,
+            due_date=now+timedelta(days=14),
             return_date=None
             )
-        session.add(book)
+        # Set both sides so the response is built without loading them again.
+        loan.book = book
+        loan.user = user
         session.add(loan)
+        record_changes(session, book, loan)
     
-    session.refresh(book)
-    session.refresh(loan)
+    availability_hub.publish(book.id, "borrowed", get_available_copies(session, book), book.total_copies)
     return loan
         
+def borrow_books_batch_logic(
+        session:SessionLocal,
+        book_id:int,
+        user_ids:list[int]
+        ):
+    # Serves a batch of concurrent borrows of one book with one lock, one
+    # multi-row loan INSERT and one counter update. Returns a LoanPublic or
+    # an HTTPException for each user id, in order.
+    results = []
+    with session.begin():
+        book = session.exec(LOCK_UNSHARDED_BOOK, params={"book_id": book_id}).first()
+        if not book:
+            book = session.get(Book, book_id)
+            if not book:
+                raise HTTPException(status_code=404, detail="Book not found.")
+        users = {user.id: user for user in session.exec(select(User).where(User.id.in_(set(user_ids))))}
+        available = None if book.inventory_shards else book.available_copies
+        now = datetime.now(timezone.utc)
+        loans = []
+        for user_id in user_ids:
+            if user_id not in users:
+                results.append(HTTPException(status_code=404, detail="User does not exist."))
+                continue
+            if book.inventory_shards:
+                slot = take_inventory_slot(session, book_id)
+                if not slot:
+                    results.append(HTTPException(status_code=412, detail="This book has no available copies."))
+                    continue
+                slot.available_copies -= 1
+                session.add(slot)
+            elif available == 0:
+                results.append(HTTPException(status_code=412, detail="This book has no available copies."))
+                continue
+            else:
+                available -= 1
+            loan = Loan(
+                book_id=book_id,
+                user_id=user_id,
+                borrow_date=now,
+                due_date=now+timedelta(days=14),
+                return_date=None
+                )
+            loan.book = book
+            loan.user = users[user_id]
+            loans.append(loan)
+            results.append(loan)
+        if not book.inventory_shards:
+            book.available_copies = available
+        session.add_all(loans)
+        session.flush()
+        # Serialize while the rows are still loaded; the results are handed
+        # to other request threads that must not touch this session.
+        results = [
+            result if isinstance(result, HTTPException) else LoanPublic.model_validate(result)
+            for result in results
+            ]
+        stock = get_available_copies(session, book)
+        total_copies = book.total_copies
+        if loans:
+            record_changes(session, book, *loans)
+
+    if loans:
+        availability_hub.publish(book_id, "borrowed", stock, total_copies)
+    return results
+
 def return_book_logic(
         session:SessionLocal,
         loan_id:int,
         ):
     with session.begin():
         try:
-            loan = session.exec(select(Loan).where(Loan.id == loan_id).with_for_update()).one()
+            loan = session.exec(LOCK_LOAN, params={"loan_id": loan_id}).one()
         except NoResultFound:
             raise HTTPException(status_code=404, detail="No loan with this ID.")
-        if loan.status == "returned":
+        # Branch loans are returned to their branch, see return_branch_loan_logic.
+        if loan.branch is not None:
+            raise HTTPException(status_code=404, detail="No loan with this ID.")
+        if loan.status == LoanStatus.RETURNED:
             raise HTTPException(status_code=412, detail="This loan has already been cleared.")
-        try:
-            book = session.exec(select(Book).where(Book.id == loan.book_id).with_for_update()).one()
-        except NoResultFound:
+        book = session.exec(
+            LOCK_UNSHARDED_BOOK, params={"book_id": loan.book_id}
+            ).first() or session.exec(SHARE_BOOK, params={"book_id": loan.book_id}).first()
+        if not book:
             raise HTTPException(status_code=404, detail="This loan has no valid book associated with it. Please check the database.")
-        if book.available_copies == book.total_copies:
+        if get_available_copies(session, book) == book.total_copies:
             raise HTTPException(status_code=412, detail="Invalid return as all copies of this book are in the library.")
-        book.available_copies += 1
-        loan.status = "returned"
+        loan.book = book
+        loan.status = LoanStatus.RETURNED
         loan.return_date = datetime.now(timezone.utc)
+        # The returned copy goes straight to the oldest waiting hold, if any,
+        # so it never becomes visible to polling borrowers.
+        hold = allocate_to_oldest_hold(session, book)
+        if hold:
+            record_changes(session, ("loan", hold.loan_id, "insert"))
+        elif book.inventory_shards:
+            put_inventory_slot(session, book)
+        else:
+            book.available_copies += 1
 
         session.add(book)
         session.add(loan)
+        record_changes(session, book, loan)
     
-    session.refresh(book)
-    session.refresh(loan)
-    return loan
\ No newline at end of file
+    availability_hub.publish(book.id, "returned", get_available_copies(session, book), book.total_copies)
+    return loan
+
+def next_loan_id(session:SessionLocal) -> int:
+    *prepare, allocate = NEXT_LOAN_ID[session.get_bind().dialect.name]
+    for statement in prepare:
+        session.execute(statement)
+    return session.execute(allocate).scalar_one()
+
+def record_main_changes(main_session:SessionLocal, *changes):
+    # Writes to a branch with a database of its own are recorded in the main
+    # database, so the change feed and the listeners see them. This runs
+    # after the branch transaction commits: a crash in between loses the
+    # change event, never the write.
+    with main_session.begin():
+        record_changes(main_session, *changes)
+
+def copy_to_branch(session:SessionLocal, *rows):
+    upserts = BRANCH_COPY_UPSERTS[session.get_bind().dialect.name]
+    for row in rows:
+        session.execute(upserts[type(row)], {column.name: getattr(row, column.name) for column in row.__table__.columns})
+
+def set_branch_stock_logic(
+        session:SessionLocal,
+        book_id:int,
+        branch:str,
+        total_copies:int,
+        main_session:SessionLocal | None=None
+        ):
+    # main_session is passed when the branch has its own database.
+    if main_session is not None:
+        with main_session.begin():
+            book = main_session.get(Book, book_id)
+        if not book:
+            raise HTTPException(status_code=404, detail="Book not found.")
+    with session.begin():
+        if main_session is not None:
+            copy_to_branch(session, book)
+        elif not session.get(Book, book_id):
+            raise HTTPException(status_code=404, detail="Book not found.")
+        stock = session.exec(LOCK_BRANCH_STOCK, params={"book_id": book_id, "branch": branch}).first()
+        if not stock:
+            stock = BranchStock(book_id=book_id, branch=branch)
+        on_loan = stock.total_copies - stock.available_copies
+        if total_copies < on_loan:
+            raise HTTPException(status_code=412, detail="Total copies cannot be lower than the copies on loan.")
+        stock.total_copies = total_copies
+        stock.available_copies = total_copies - on_loan
+        session.add(stock)
+    return stock
+
+def borrow_from_branch_logic(
+        session:SessionLocal,
+        branch:str,
+        book_id:int,
+        user_id:int,
+        main_session:SessionLocal | None=None
+        ):
+    # main_session is passed when the branch has its own database: the book
+    # and user are looked up there and copied over, and the loan id comes
+    # from there.
+    loan_id = None
+    if main_session is not None:
+        with main_session.begin():
+            book = main_session.get(Book, book_id)
+            if not book:
+                raise HTTPException(status_code=404, detail="Book not found.")
+            user = main_session.exec(USER_BY_ID, params={"user_id": user_id}).first()
+            if not user:
+                raise HTTPException(status_code=404, detail="User does not exist.")
+            loan_id = next_loan_id(main_session)
+    with session.begin():
+        if main_session is not None:
+            copy_to_branch(session, book, user)
+        stock = session.exec(TAKE_BRANCH_COPY, params={"stock_book_id": book_id, "stock_branch": branch}).first()
+        if not stock:
+            if not session.get(Book, book_id):
+                raise HTTPException(status_code=404, detail="Book not found.")
+            if not session.get(BranchStock, (book_id, branch)):
+                raise HTTPException(status_code=404, detail="This branch does not stock this book.")
+            raise HTTPException(status_code=412, detail="This book has no available copies.")
+        user = session.exec(USER_BY_ID, params={"user_id": user_id}).first()
+        if not user:
+            raise HTTPException(status_code=404, detail="User does not exist.")
+        now = datetime.now(timezone.utc)
+        loan = Loan(
+            id=loan_id,
+            book_id=book_id,
+            user_id=user_id,
+            borrow_date=now,
+            due_date=now+timedelta(days=14),
+            return_date=None,
+            branch=branch
+            )
+        loan.book = session.get(Book, book_id)
+        loan.user = user
+        session.add(loan)
+        if main_session is None:
+            record_changes(session, loan)
+    if main_session is not None:
+        record_main_changes(main_session, ("loan", loan.id, "insert"))
+
+    return loan
+
+def return_branch_loan_logic(
+        session:SessionLocal,
+        branch:str,
+        loan_id:int,
+        main_session:SessionLocal | None=None
+        ):
+    # main_session is passed when the branch has its own database.
+    with session.begin():
+        try:
+            loan = session.exec(LOCK_LOAN, params={"loan_id": loan_id}).one()
+        except NoResultFound:
+            raise HTTPException(status_code=404, detail="No loan with this ID.")
+        if loan.branch != branch:
+            raise HTTPException(status_code=404, detail="No loan with this ID.")
+        if loan.status == LoanStatus.RETURNED:
+            raise HTTPException(status_code=412, detail="This loan has already been cleared.")
+        stock = session.exec(PUT_BRANCH_COPY, params={"stock_book_id": loan.book_id, "stock_branch": branch}).first()
+        if not stock:
+            raise HTTPException(status_code=412, detail="Invalid return as all copies of this book are in the branch.")
+        loan.book = session.get(Book, loan.book_id)
+        loan.status = LoanStatus.RETURNED
+        loan.return_date = datetime.now(timezone.utc)
+        session.add(loan)
+        if main_session is None:
+            record_changes(session, loan)
+    if main_session is not None:
+        record_main_changes(main_session, ("loan", loan.id, "update"))
+
+    return loan
+
+def branch_catalog_rows(
+        session:SessionLocal,
+        book_id:int,
+        branches:list[str]
+        ):
+    return session.exec(BRANCH_CATALOG, params={"book_id": book_id, "branches": branches}).all()
+
+def get_catalog_logic(
+        session:SessionLocal,
+        branch_router,
+        isbn:str
+        ):
+    # The book's details come from the main database; the stock of every
+    # branch database is read at once.
+    book = session.exec(BOOK_BY_ISBN, params={"isbn": isbn}).first()
+    if not book:
+        raise HTTPException(status_code=404, detail="Book not found.")
+    rows = branch_router.fan_out(lambda session, branches: branch_catalog_rows(session, book.id, branches))
+    if not rows:
+        raise HTTPException(status_code=404, detail="Book not found in any branch.")
+    rows.sort(key=lambda row: row.branch)
+    return CatalogEntry(
+        isbn=book.isbn,
+        title=book.title,
+        author=book.author,
+        publication_year=book.publication_year,
+        total_copies=sum(row.total_copies for row in rows),
+        available_copies=sum(row.available_copies for row in rows),
+        branches=[
+            BranchStockPublic(
+                book_id=row.book_id,
+                branch=row.branch,
+                total_copies=row.total_copies,
+                available_copies=row.available_copies
+                )
+            for row in rows
+            ]
+        )
+
+def allocate_to_oldest_hold(
+        session:SessionLocal,
+        book:Book
+        ):
+    # Must be called inside the caller's transaction with the book row locked,
+    # which serializes allocation against place_hold_logic and other returns.
+    # Sharded books are only share-locked: that still orders them against
+    # place_hold_logic, and concurrent returns skip each other's hold.
+    statement = OLDEST_WAITING_HOLD_SKIP_LOCKED if book.inventory_shards else LOCK_OLDEST_WAITING_HOLD
+    hold = session.exec(statement, params={"book_id": book.id}).first()
+    if not hold:
+        return None
+    now = datetime.now(timezone.utc)
+    loan = Loan(
+        book_id=book.id,
+        user_id=hold.user_id,
+        borrow_date=now,
+        due_date=now+timedelta(days=14),
+        return_date=None
+        )
+    session.add(loan)
+    session.flush()
+    hold.status = "fulfilled"
+    hold.loan_id = loan.id
+    hold.fulfilled_at = now
+    session.add(hold)
+    return hold
+
+def place_hold_logic(
+        session:SessionLocal,
+        book_id:int,
+        user_id:int
+        ):
+    with session.begin():
+        try:
+            book = session.exec(LOCK_BOOK, params={"book_id": book_id}).one()
+        except NoResultFound:
+            raise HTTPException(status_code=404, detail="Book not found.")
+        if not session.get(User, user_id):
+            raise HTTPException(status_code=404, detail="User does not exist.")
+        if get_available_copies(session, book) > 0:
+            raise HTTPException(status_code=412, detail="This book has available copies and can be borrowed directly.")
+        existing = session.exec(
+            select(Hold).where(
+                Hold.book_id == book_id,
+                Hold.user_id == user_id,
+                Hold.status == "waiting"
+                )
+            ).first()
+        if existing:
+            raise HTTPException(status_code=412, detail="This user already has a hold on this book.")
+        hold = Hold(
+            book_id=book_id,
+            user_id=user_id,
+            created_at=datetime.now(timezone.utc)
+            )
+        session.add(hold)
+
+    return hold
+
+def get_hold_logic(
+        session:SessionLocal,
+        hold_id:int
+        ):
+    hold = session.get(Hold, hold_id)
+    if not hold:
+        raise HTTPException(status_code=404, detail="Hold does not exist.")
+    return hold
+
+def get_book_holds_logic(
+        session:SessionLocal,
+        book_id:int
+        ):
+    if not session.get(Book, book_id):
+        raise HTTPException(status_code=404, detail="Book not found.")
+    holds = session.exec(
+        select(Hold)
+        .where(Hold.book_id == book_id, Hold.status == "waiting")
+        .order_by(Hold.created_at, Hold.id)
+        ).all()
+    return holds
+
+def cancel_hold_logic(
+        session:SessionLocal,
+        hold_id:int
+        ):
+    with session.begin():
+        try:
+            hold = session.exec(LOCK_HOLD, params={"hold_id": hold_id}).one()
+        except NoResultFound:
+            raise HTTPException(status_code=404, detail="Hold does not exist.")
+        if hold.status != "waiting":
+            raise HTTPException(status_code=412, detail="Only waiting holds can be cancelled.")
+        hold.status = "cancelled"
+        session.add(hold)
+
+    return hold
+
+def get_available_copies(
+        session:SessionLocal,
+        book:Book
+        ):
+    if not book.inventory_shards:
+        return book.available_copies
+    return session.exec(SLOT_STOCK, params={"book_id": book.id}).one()
+
+def take_inventory_slot(
+        session:SessionLocal,
+        book_id:int
+        ):
+    # A random slot with stock, skipping slots that other borrowers have
+    # locked; only when every stocked slot is busy do we wait for one.
+    slot = session.exec(STOCKED_SLOT_SKIP_LOCKED, params={"book_id": book_id}).first()
+    if not slot:
+        slot = session.exec(LOCK_STOCKED_SLOT, params={"book_id": book_id}).first()
+    return slot
+
+def put_inventory_slot(
+        session:SessionLocal,
+        book:Book
+        ):
+    session.exec(
+        update(BookInventorySlot)
+        .where(
+            BookInventorySlot.book_id == book.id,
+            BookInventorySlot.slot == random.randrange(book.inventory_shards)
+            )
+        .values(available_copies=BookInventorySlot.available_copies + 1)
+        )
+
+def lock_inventory_slots(
+        session:SessionLocal,
+        book:Book
+        ):
+    slots = session.exec(
+        select(BookInventorySlot).where(BookInventorySlot.book_id == book.id).with_for_update()
+        ).all()
+    return sum(slot.available_copies for slot in slots)
+
+def distribute_inventory(
+        session:SessionLocal,
+        book:Book,
+        copies:int,
+        shards:int
+        ):
+    session.exec(delete(BookInventorySlot).where(BookInventorySlot.book_id == book.id))
+    session.expire(book, ["inventory"])
+    for slot in range(shards):
+        session.add(BookInventorySlot(
+            book_id=book.id,
+            slot=slot,
+            available_copies=copies // shards + (1 if slot < copies % shards else 0)
+            ))
+    book.available_copies = None if shards else copies
+    book.inventory_shards = shards
+    session.add(book)
+
+def shard_book_inventory_logic(
+        session:SessionLocal,
+        book_id:int,
+        shards:int
+        ):
+    with session.begin():
+        try:
+            book = session.exec(LOCK_BOOK, params={"book_id": book_id}).one()
+        except NoResultFound:
+            raise HTTPException(status_code=404, detail="Book not found.")
+        if book.inventory_shards:
+            copies = lock_inventory_slots(session, book)
+        else:
+            copies = book.available_copies
+        distribute_inventory(session, book, copies, shards)
+        record_changes(session, book)
+
+    return book
+
+def inventory_mismatches_query():
+    # One pass over the catalog: the stock each book reports against the
+    # stock implied by its active loans.
+    active = (
+        select(Loan.book_id, func.count().label("active_loans"))
+        .where(LOAN_IS_ACTIVE, Loan.branch.is_(None))
+        .group_by(Loan.book_id)
+        .subquery()
+        )
+    slots = (
+        select(BookInventorySlot.book_id, func.sum(BookInventorySlot.available_copies).label("slotted"))
+        .group_by(BookInventorySlot.book_id)
+        .subquery()
+        )
+    active_loans = func.coalesce(active.c.active_loans, 0)
+    available = case(
+        (Book.inventory_shards > 0, func.coalesce(slots.c.slotted, 0)),
+        else_=func.coalesce(Book.available_copies, 0)
+        )
+    expected = case(
+        (Book.total_copies - active_loans < 0, 0),
+        else_=Book.total_copies - active_loans
+        )
+    return (
+        select(
+            Book.id,
+            Book.total_copies,
+            active_loans.label("active_loans"),
+            available.label("available_copies"),
+            expected.label("expected_copies")
+            )
+        .outerjoin(active, active.c.book_id == Book.id)
+        .outerjoin(slots, slots.c.book_id == Book.id)
+        .where(available != expected)
+        .order_by(Book.id)
+        )
+
+def repair_book_inventory(
+        session:SessionLocal,
+        book_id:int
+        ):
+    # Skip books that a borrow or return has locked right now; they are
+    # reported back and picked up by the next run. Borrows of a sharded
+    # book lock one of its slots rather than the book row.
+    book = session.exec(select(Book).where(Book.id == book_id).with_for_update(skip_locked=True)).first()
+    if not book:
+        return False
+    if book.inventory_shards:
+        slots = session.exec(INVENTORY_SLOTS_SKIP_LOCKED, params={"book_id": book_id}).all()
+        if len(slots) < book.inventory_shards:
+            return False
+    active_loans = session.exec(
+        select(func.count()).select_from(Loan).where(Loan.book_id == book_id, LOAN_IS_ACTIVE, Loan.branch.is_(None))
+        ).one()
+    expected = max(book.total_copies - active_loans, 0)
+    # Copies that were missing from the count go to waiting holds first,
+    # as a return would have done with them.
+    loans = []
+    while expected > 0:
+        hold = allocate_to_oldest_hold(session, book)
+        if not hold:
+            break
+        loans.append(("loan", hold.loan_id, "insert"))
+        expected -= 1
+    if book.inventory_shards:
+        distribute_inventory(session, book, expected, book.inventory_shards)
+    else:
+        book.available_copies = expected
+        session.add(book)
+    record_changes(session, book, *loans)
+    return True
+
+def reconcile_inventory_logic(
+        session:SessionLocal,
+        repair:bool=False,
+        batch_size:int=500
+        ):
+    mismatches = [row._asdict() for row in session.exec(inventory_mismatches_query())]
+    session.commit()
+    result = {"mismatches": mismatches, "repaired": 0, "skipped": []}
+    if not repair:
+        return result
+    book_ids = [mismatch["id"] for mismatch in mismatches]
+    for start in range(0, len(book_ids), batch_size):
+        batch = book_ids[start:start + batch_size]
+        for book_id in batch:
+            if repair_book_inventory(session, book_id):
+                result["repaired"] += 1
+            else:
+                result["skipped"].append(book_id)
+        session.commit()
+    return result
+
+def get_related_books_logic(
+        session:SessionLocal,
+        book_id:int,
+        limit:int=10
+        ):
+    related = session.exec(RELATED_BOOKS, params={"book_id": book_id, "limit": limit}).all()
+    if not related and not session.get(Book, book_id):
+        raise HTTPException(status_code=404, detail="Book not found.")
+    return [RelatedBook(book=book, borrowers=borrowers) for book, borrowers in related]
+
+def count_cooccurrences_logic(
+        session:SessionLocal,
+        batch_size:int=1000,
+        max_batches:int | None=None,
+        settle_seconds:float=60
+        ):
+    # Counts the loans made since the last run, outside the borrow path. A
+    # user's first borrow of a book pairs it with every book they had
+    # borrowed before, so each pair is counted once, by the later of the two
+    # first borrows. Loans that are still settling are left for the next
+    # run: on PostgreSQL one can commit after a higher id is visible.
+    counted = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with session.begin():
+            cursor = session.get(JobCursor, COOCCURRENCE_CURSOR, with_for_update=True) or JobCursor(name=COOCCURRENCE_CURSOR)
+            cutoff = datetime.now(timezone.utc) - timedelta(seconds=settle_seconds)
+            loans = list(takewhile(
+                lambda loan: (loan.borrow_date if loan.borrow_date.tzinfo else loan.borrow_date.replace(tzinfo=timezone.utc)) <= cutoff,
+                session.exec(UNCOUNTED_LOANS, params={"after": cursor.position, "limit": batch_size}).all()
+                ))
+            if not loans:
+                break
+            first_borrows = defaultdict(dict)
+            for user_id, book_id, first_id in session.exec(FIRST_BORROWS, params={"user_ids": list({loan.user_id for loan in loans})}):
+                first_borrows[user_id][book_id] = first_id
+            counts = Counter()
+            for loan in loans:
+                books = first_borrows[loan.user_id]
+                if books[loan.book_id] != loan.id:
+                    continue
+                for other_id, first_id in books.items():
+                    if first_id < loan.id:
+                        counts[(loan.book_id, other_id)] += 1
+                        counts[(other_id, loan.book_id)] += 1
+            if counts:
+                # In key order, so runs that overlap lock the rows in the same order.
+                session.exec(
+                    COOCCURRENCE_UPSERTS[session.get_bind().dialect.name],
+                    params=[{"book_id": a, "related_book_id": b, "borrowers": n} for (a, b), n in sorted(counts.items())]
+                    )
+            cursor.position = loans[-1].id
+            session.add(cursor)
+        counted += len(loans)
+        batches += 1
+        if len(loans) < batch_size:
+            break
+    return {"counted": counted, "batches": batches}
+
+def rebuild_cooccurrence_logic(session:SessionLocal):
+    # Recounts every pair from the whole loan history in one aggregate
+    # query, for the first fill and to correct drift.
+    borrowed = union(
+        select(Loan.user_id, Loan.book_id),
+        select(LoanArchive.user_id, LoanArchive.book_id)
+        ).cte("borrowed")
+    other = borrowed.alias("other")
+    pairs = (
+        select(borrowed.c.book_id, other.c.book_id, func.count())
+        .join(other, (other.c.user_id == borrowed.c.user_id) & (other.c.book_id != borrowed.c.book_id))
+        .group_by(borrowed.c.book_id, other.c.book_id)
+        )
+    with session.begin():
+        session.exec(delete(BookCooccurrence))
+        session.exec(insert(BookCooccurrence).from_select(["book_id", "related_book_id", "borrowers"], pairs))
+        count = session.exec(select(func.count()).select_from(BookCooccurrence)).one()
+        # count-related carries on from the loans counted here.
+        cursor = session.get(JobCursor, COOCCURRENCE_CURSOR) or JobCursor(name=COOCCURRENCE_CURSOR)
+        cursor.position = session.exec(select(func.coalesce(func.max(Loan.id), 0))).one()
+        session.add(cursor)
+    return {"pairs": count}
+
+def get_changes_logic(
+        session:SessionLocal,
+        since:int=0,
+        limit:int=100,
+        settle_seconds:float=5.0
+        ):
+    oldest = session.exec(OLDEST_CHANGE).one()
+    if since and oldest is not None and since < oldest - 1:
+        raise HTTPException(status_code=410, detail="This cursor is older than the retained changes.")
+    rows = session.exec(
+        CHANGE_FEED,
+        params={"since": since, "limit": limit + 1, "settle_seconds": settle_seconds}
+        ).all()
+    # Ids are taken just before commit, so on PostgreSQL a transaction can
+    # commit a lower id after a higher one is already visible. The page ends
+    # at the first missing id, unless the change after it was written longer
+    # than the settle time ago by the database clock: then the missing one
+    # was rolled back.
+    changes = []
+    for row, settled in rows[:limit]:
+        changed_at = row.created_at if row.created_at.tzinfo else row.created_at.replace(tzinfo=timezone.utc)
+        if row.id != (changes[-1].version if changes else since) + 1 and not settled:
+            break
+        changes.append(ChangePublic(
+            version=row.id,
+            entity=row.entity,
+            entity_id=row.entity_id,
+            operation=row.operation,
+            changed_at=changed_at
+            ))
+    return ChangeFeed(
+        changes=changes,
+        next=changes[-1].version if changes else since,
+        has_more=len(rows) > len(changes)
+        )
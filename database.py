@@ -1,16 +1,229 @@
-import os
-from dotenv import load_dotenv
+import threading
+from contextlib import asynccontextmanager
 from sqlmodel import create_engine, Session
-from fastapi import Depends
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
+from fastapi import Depends, Request
+from starlette.concurrency import run_in_threadpool
 from typing import Annotated
+from admission import ConcurrencyLimiter, db_concurrency_slot
+from config import Settings, get_settings
+from metrics import metrics
+from timeouts import QueryGuard, cancel_on_disconnect, configure_timeouts, guard_session, timeouts_for
 
-load_dotenv()
+# Engines are created on first use rather than at import, so importing the
+# app (tests, CLI tools, cold starts) does not need a reachable database.
+_engines: dict[str, Engine] = {}
+_write_engines: dict[str, Engine] = {}
+_write_queues: dict[str, ConcurrencyLimiter] = {}
+# Held while an engine is made, so concurrent first requests build one
+# engine per URL instead of racing and leaking the extra pools.
+_engines_lock = threading.Lock()
 
-db_url = os.getenv('SQLALCHEMY_DATABASE_URL')
-engine = create_engine(db_url, echo=True)
+def record_compiled_cache(connection, cursor, statement, parameters, context, executemany):
+    # Raw driver SQL is never compiled, so it is left out of the hit rate.
+    if context.compiled is None:
+        return
+    if context.cache_hit == CACHE_HIT:
+        metrics.increment("sql.compiled_cache.hits")
+    elif context.cache_hit == CACHE_MISS:
+        metrics.increment("sql.compiled_cache.misses")
+    else:
+        metrics.increment("sql.compiled_cache.uncached")
 
-def get_session():
-    with Session(engine) as session:
+def compiled_cache_hit_rate():
+    hits = metrics.get("sql.compiled_cache.hits")
+    misses = metrics.get("sql.compiled_cache.misses")
+    return round(hits / (hits + misses), 4) if hits + misses else None
+
+def instrument_engine(engine:Engine) -> Engine:
+    event.listen(engine, "after_cursor_execute", record_compiled_cache)
+    return engine
+
+def configure_sqlite(engine:Engine, pragmas:dict[str, str]) -> Engine:
+    @event.listens_for(engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        # Leave BEGIN to the handler below instead of the driver, which
+        # otherwise opens transactions on its own.
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def begin(connection):
+        # Writes take the write lock up front. A deferred transaction that
+        # reads first can fail with "database is locked" when it tries to
+        # write after another writer has committed.
+        if connection.get_execution_options().get("sqlite_write"):
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+        else:
+            connection.exec_driver_sql("BEGIN")
+
+    return engine
+
+def is_sqlite(settings:Settings) -> bool:
+    return (settings.sqlalchemy_database_url or "").startswith("sqlite")
+
+def make_engine(settings:Settings, url:str | None = None) -> Engine:
+    db_url = url or settings.sqlalchemy_database_url
+    if not db_url:
+        raise RuntimeError("SQLALCHEMY_DATABASE_URL is not set.")
+    options = {}
+    if not db_url.startswith("sqlite"):
+        options["pool_size"] = settings.db_concurrency or settings.db_pool_size
+        options["max_overflow"] = settings.db_max_overflow
+    engine = instrument_engine(create_engine(db_url, echo=settings.sqlalchemy_echo, **options))
+    if db_url.startswith("sqlite"):
+        configure_sqlite(engine, settings.sqlite_pragmas)
+    return configure_timeouts(engine)
+
+def get_engine(settings:Settings | None = None, url:str | None = None) -> Engine:
+    # One engine per database URL; branch databases share the pool settings.
+    settings = settings or get_settings()
+    url = url or settings.sqlalchemy_database_url
+    engine = _engines.get(url)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(url)
+            if engine is None:
+                engine = _engines[url] = make_engine(settings, url)
+    return engine
+
+def get_write_queue(settings:Settings | None = None, url:str | None = None) -> ConcurrencyLimiter:
+    # SQLite allows one writing transaction at a time. Write requests take
+    # the single write slot in arrival order instead of racing for the file
+    # lock, while reads go on concurrently under WAL. They wait on the event
+    # loop, so queued writes never tie up the threadpool that reads need.
+    # One queue per database file, branch databases included.
+    settings = settings or get_settings()
+    url = url or settings.sqlalchemy_database_url
+    queue = _write_queues.get(url)
+    if queue is None:
+        queue = _write_queues.setdefault(
+            url,
+            ConcurrencyLimiter(1, settings.sqlite_write_queue_size, "sqlite.write_queue")
+            )
+    return queue
+
+def get_write_engine(settings:Settings | None = None, url:str | None = None) -> Engine:
+    settings = settings or get_settings()
+    url = url or settings.sqlalchemy_database_url
+    engine = get_engine(settings, url)
+    if engine.dialect.name != "sqlite":
+        return engine
+    write_engine = _write_engines.get(url)
+    if write_engine is None:
+        write_engine = _write_engines.setdefault(url, engine.execution_options(sqlite_write=True))
+    return write_engine
+
+def prewarm_pool(engine:Engine, connections:int):
+    # Check out several connections at once so the pool really opens them.
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(engine.connect())
+    finally:
+        for connection in opened:
+            connection.close()
+
+def dispose_engines():
+    for engine in _engines.values():
+        engine.dispose()
+    _engines.clear()
+    _write_engines.clear()
+    _write_queues.clear()
+
+def get_session(
+        request:Request,
+        _slot:Annotated[None, Depends(db_concurrency_slot)],
+        guard:Annotated[QueryGuard, Depends(cancel_on_disconnect)]
+        ):
+    settings = getattr(request.app.state, "settings", None) or get_settings()
+    # Nothing is read again after commit: write paths return objects whose
+    # state they already hold, and the session ends with the request.
+    with Session(get_engine(settings), expire_on_commit=False) as session:
+        guard_session(session, guard, *timeouts_for(settings, request))
+        yield session
+
+@asynccontextmanager
+async def sqlite_write_slots(settings:Settings, *urls:str):
+    # Takes the write slot of each SQLite database in urls, in the order
+    # given and each once. Callers list the main database first, so two
+    # requests never hold one slot each while waiting for the other's.
+    taken = []
+    try:
+        for url in dict.fromkeys(urls):
+            if get_engine(settings, url).dialect.name == "sqlite":
+                queue = get_write_queue(settings, url)
+                await queue.acquire()
+                taken.append(queue)
+        yield
+    finally:
+        for queue in reversed(taken):
+            queue.release()
+
+async def sqlite_write_slot(request:Request):
+    settings = getattr(request.app.state, "settings", None) or get_settings()
+    async with sqlite_write_slots(settings, settings.sqlalchemy_database_url):
+        yield
+
+def open_write_session(request:Request, guard:QueryGuard, url:str | None = None) -> Session:
+    # On SQLite the transaction opens with BEGIN IMMEDIATE; the caller must
+    # hold the database's write slot.
+    settings = getattr(request.app.state, "settings", None) or get_settings()
+    session = Session(get_write_engine(settings, url), expire_on_commit=False)
+    guard_session(session, guard, *timeouts_for(settings, request))
+    return session
+
+def get_write_session(
+        request:Request,
+        _slot:Annotated[None, Depends(db_concurrency_slot)],
+        _write_slot:Annotated[None, Depends(sqlite_write_slot)],
+        guard:Annotated[QueryGuard, Depends(cancel_on_disconnect)]
+        ):
+    # For routes that write. On SQLite they hold the write slot and open
+    # their transaction with BEGIN IMMEDIATE; on other databases this is the
+    # same as get_session.
+    with open_write_session(request, guard) as session:
         yield session
 
-SessionLocal = Annotated[Session, Depends(get_session)]
\ No newline at end of file
+class SharedReads:
+    # For reads that other requests may join. Nothing is taken up front:
+    # only the request that runs the query waits for a concurrency slot and
+    # a worker thread, so those that wait on its result hold neither.
+    def __init__(self, request:Request, guard:QueryGuard | None, open_session=None):
+        self.request = request
+        self.guard = guard
+        # Returns a context manager around the session; tests pass their own.
+        self.open_session = open_session or self._open_session
+
+    async def run(self, produce):
+        # Returns produce(session), run on a worker thread.
+        limiter = getattr(self.request.app.state, "db_limiter", None)
+        if limiter is not None:
+            await limiter.acquire()
+        try:
+            return await run_in_threadpool(self._run, produce)
+        finally:
+            if limiter is not None:
+                limiter.release()
+
+    def _run(self, produce):
+        with self.open_session() as session:
+            return produce(session)
+
+    def _open_session(self) -> Session:
+        settings = getattr(self.request.app.state, "settings", None) or get_settings()
+        session = Session(get_engine(settings), expire_on_commit=False)
+        guard_session(session, self.guard, *timeouts_for(settings, self.request))
+        return session
+
+async def get_shared_reads(request:Request, guard:Annotated[QueryGuard, Depends(cancel_on_disconnect)]) -> SharedReads:
+    return SharedReads(request, guard)
+
+SessionLocal = Annotated[Session, Depends(get_session)]
+SharedReadsDep = Annotated[SharedReads, Depends(get_shared_reads)]
+WriteSession = Annotated[Session, Depends(get_write_session)]
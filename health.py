@@ -0,0 +1,127 @@
+import threading
+import time
+from concurrent.futures import Future
+from sqlalchemy.engine import Engine
+from config import Settings
+
+class HealthMonitor:
+    # Readiness is judged from numbers that are cheap to read on every
+    # check: requests in flight, pool usage, and a database probe that runs
+    # at most once per HEALTH_PROBE_INTERVAL_MS on the monitor's own thread
+    # and is cached in between.
+    def __init__(self, settings:Settings):
+        self.settings = settings
+        self.in_flight = 0
+        self.last_probe = None
+        self._probe_lock = threading.Lock()
+        self._running = None
+        self._running_since = None
+
+    def pool_usage(self, engine:Engine) -> float | None:
+        # Only QueuePool has a fixed capacity; the SQLite memory pools do not.
+        pool = engine.pool
+        if not hasattr(pool, "checkedout") or not hasattr(pool, "size"):
+            return None
+        capacity = pool.size() + max(getattr(pool, "_max_overflow", 0), 0)
+        return round(pool.checkedout() / capacity, 4) if capacity else None
+
+    def probe_is_stale(self) -> bool:
+        probe = self.last_probe
+        return probe is None or time.monotonic() - probe["at"] >= self.settings.health_probe_interval_ms / 1000
+
+    def probe_is_overdue(self) -> bool:
+        since = self._running_since
+        return since is not None and time.monotonic() - since >= self.settings.health_probe_timeout_ms / 1000
+
+    def refresh(self, engine:Engine) -> Future:
+        # Starts a probe unless one is already running, whose future is
+        # returned instead. Request threads are never used for it, and the
+        # daemon thread lets the process exit past a probe stuck on checkout.
+        with self._probe_lock:
+            if self._running is None:
+                self._running_since = time.monotonic()
+                self._running = Future()
+                threading.Thread(target=self._run_probe, args=(engine, self._running), name="health-probe", daemon=True).start()
+            return self._running
+
+    def _run_probe(self, engine:Engine, running:Future):
+        probe = self.probe(engine)
+        with self._probe_lock:
+            self._running = None
+            self._running_since = None
+        running.set_result(probe)
+
+    def probe(self, engine:Engine) -> dict:
+        # Times a pool checkout and a SELECT 1.
+        started = time.perf_counter()
+        try:
+            with engine.connect() as connection:
+                checked_out = time.perf_counter()
+                connection.exec_driver_sql("SELECT 1")
+                finished = time.perf_counter()
+            probe = {
+                "checkout_wait_ms": round((checked_out - started) * 1000, 3),
+                "db_latency_ms": round((finished - checked_out) * 1000, 3),
+                "error": None
+                }
+        except Exception as error:
+            probe = {"checkout_wait_ms": None, "db_latency_ms": None, "error": type(error).__name__}
+        probe["at"] = time.monotonic()
+        self.last_probe = probe
+        return probe
+
+    def overload_reasons(self, engine:Engine) -> list[str]:
+        # Free to check, so they are checked before anything else.
+        settings = self.settings
+        usage = self.pool_usage(engine)
+        reasons = []
+        if usage is not None and usage >= settings.health_max_pool_usage:
+            reasons.append("Connection pool is saturated.")
+        if self.in_flight > settings.health_max_in_flight:
+            reasons.append("Too many requests in flight.")
+        return reasons
+
+    def readiness(self, engine:Engine) -> tuple[bool, dict]:
+        settings = self.settings
+        usage = self.pool_usage(engine)
+        probe = self.last_probe or {}
+        reasons = self.overload_reasons(engine)
+        if not reasons:
+            # A probe stuck on checkout or on the database counts as failed
+            # long before the pool timeout would end it.
+            if self.probe_is_overdue():
+                reasons.append("Database probe timed out.")
+            elif not probe:
+                reasons.append("Database has not been probed yet.")
+            if probe.get("error"):
+                reasons.append("Database is unreachable.")
+            if (probe.get("db_latency_ms") or 0) > settings.health_max_db_latency_ms:
+                reasons.append("Database round trip is too slow.")
+            if (probe.get("checkout_wait_ms") or 0) > settings.health_max_checkout_wait_ms:
+                reasons.append("Connection checkout is too slow.")
+        report = {
+            "status": "unavailable" if reasons else "ready",
+            "reasons": reasons,
+            "db_latency_ms": probe.get("db_latency_ms"),
+            "checkout_wait_ms": probe.get("checkout_wait_ms"),
+            "pool_usage": usage,
+            "in_flight": self.in_flight,
+            }
+        return not reasons, report
+
+class InFlightMiddleware:
+    # Counts HTTP requests being served, health checks excluded. Runs on the
+    # event loop only, so the counter needs no lock.
+    def __init__(self, app, monitor:HealthMonitor):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith("/health/"):
+            await self.app(scope, receive, send)
+            return
+        self.monitor.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.monitor.in_flight -= 1
@@ -1,54 +1,345 @@
-from fastapi import FastAPI
-from crud import *
-from database import SessionLocal
-from schemas import BookPublic, UserPublic, LoanPublic
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Request, WebSocket
+from fastapi.responses import JSONResponse
+from typing import Annotated
+from sqlalchemy.exc import OperationalError
+from anyio import to_thread
+from starlette.concurrency import run_in_threadpool
+from config import Settings, get_settings
+from crud import (
+    create_book_logic, get_book_logic, get_books_logic, update_book_logic, delete_book_logic,
+    create_user_logic, get_user_logic, get_users_logic,
+    parse_batch_keys, get_books_batch_logic, get_users_batch_logic, get_loans_batch_logic,
+    get_loan_logic, get_loans_logic, get_user_loans_logic, archive_loans_logic,
+    borrow_book_logic, return_book_logic, get_related_books_logic,
+    place_hold_logic, get_hold_logic, get_book_holds_logic, cancel_hold_logic,
+    shard_book_inventory_logic, reconcile_inventory_logic,
+    set_branch_stock_logic, borrow_from_branch_logic, return_branch_loan_logic, get_catalog_logic,
+    get_changes_logic, autocomplete_books_logic, load_book_suggestions, warm_caches,
+    )
+from admission import BorrowAdmission, ConcurrencyLimiter, QUEUE_PER_SLOT, SPARE_THREADS, borrow_admission
+from batching import BorrowCoalescer
+from autocomplete import book_suggestions
+from cache import ResponseCache
+from changes import ChangeListener
+from compression import cached_list_response, read_response, shared_response
+from health import HealthMonitor, InFlightMiddleware
+from timeouts import ClientDisconnected, client_disconnected_handler, database_timeout_handler
+from database import SessionLocal, SharedReadsDep, WriteSession, get_engine, is_sqlite, prewarm_pool, compiled_cache_hit_rate
+from metrics import metrics
+from notifications import availability_socket_logic
+from schemas import BookCreate, UserCreate, BookPublic, UserPublic, LoanPublic, HoldPublic, RelatedBook, ChangeFeed, BookSuggestion, BranchStockPublic, CatalogEntry
+from sharding import BranchRouter, BranchRouterDep, BranchSessions
 
-app = FastAPI()
+router = APIRouter()
 
-@app.get("/books", response_model=list[BookPublic])
-def get_books(session:SessionLocal):
-    return get_books_logic(session)
+# Passing ids (or isbn/email) switches the list endpoints to batch lookups:
+# results follow the request order and missing entries are null.
+@router.get("/books", response_model=list[BookPublic | None])
+async def get_books(request:Request, reads:SharedReadsDep, ids:str | None=None, isbn:str | None=None):
+    if ids is not None and isbn is not None:
+        raise HTTPException(status_code=422, detail="Use either ids or isbn, not both.")
+    if ids is not None:
+        keys = parse_batch_keys(ids, int)
+        return await read_response(reads, list[BookPublic | None], lambda session: get_books_batch_logic(session, ids=keys))
+    if isbn is not None:
+        keys = parse_batch_keys(isbn)
+        return await read_response(reads, list[BookPublic | None], lambda session: get_books_batch_logic(session, isbns=keys))
+    return await cached_list_response(request, reads, ("books", "loans"), list[BookPublic], get_books_logic)
 
-@app.get("/books/{book_id}", response_model=BookPublic)
-def get_book(session:SessionLocal, book_id:int):
-    return get_book_logic(session, book_id)
+# Declared before /books/{book_id}, which would otherwise take the path.
+@router.get("/books/autocomplete", response_model=list[BookSuggestion])
+def autocomplete_books(
+        session:SessionLocal,
+        prefix:Annotated[str, Query(min_length=1, max_length=100)],
+        limit:Annotated[int, Query(ge=1, le=50)]=10
+        ):
+    return autocomplete_books_logic(session, prefix, limit)
 
-@app.post("/books", response_model=BookPublic)
-def create_book(session:SessionLocal, book:BookCreate):
+@router.get("/books/{book_id}", response_model=BookPublic)
+async def get_book(request:Request, reads:SharedReadsDep, book_id:int):
+    return await shared_response(request, reads, ("books", "loans"), BookPublic, lambda session: get_book_logic(session, book_id))
+
+@router.post("/books", response_model=BookPublic)
+def create_book(session:WriteSession, book:BookCreate):
     return create_book_logic(session, book)
 
-@app.put("/books/{book_id}", response_model=BookPublic)
-def update_book(session:SessionLocal, book:BookCreate, book_id:int):
+@router.put("/books/{book_id}", response_model=BookPublic)
+def update_book(session:WriteSession, book:BookCreate, book_id:int):
     return update_book_logic(session, book_id, book)
 
-@app.delete("/books/{book_id}", response_model=dict)
-def delete(session:SessionLocal, book_id:int):
+@router.delete("/books/{book_id}", response_model=dict)
+def delete(session:WriteSession, book_id:int):
     return delete_book_logic(session, book_id)
 
-@app.post("/books/{book_id}/borrow", response_model=LoanPublic)
-def borrow_book(session:SessionLocal, book_id:int, user_id:int):
+@router.post("/books/{book_id}/borrow", response_model=LoanPublic, dependencies=[Depends(borrow_admission)])
+def borrow_book(request:Request, session:WriteSession, book_id:int, user_id:int):
+    coalescer = getattr(request.app.state, "borrow_coalescer", None)
+    if coalescer is not None:
+        return coalescer.borrow(session, book_id, user_id)
     return borrow_book_logic(session, book_id, user_id)
 
-@app.get("/users", response_model=list[UserPublic])
-def get_users(session:SessionLocal):
-    return get_users_logic(session)
+@router.post("/books/{book_id}/hold", response_model=HoldPublic)
+def place_hold(session:WriteSession, book_id:int, user_id:int):
+    return place_hold_logic(session, book_id, user_id)
+
+@router.get("/books/{book_id}/holds", response_model=list[HoldPublic])
+def get_book_holds(session:SessionLocal, book_id:int):
+    return get_book_holds_logic(session, book_id)
+
+# "Patrons who borrowed this also borrowed", most shared borrowers first.
+@router.get("/books/{book_id}/related", response_model=list[RelatedBook])
+async def get_related_books(request:Request, reads:SharedReadsDep, book_id:int, limit:Annotated[int, Query(ge=1, le=50)]=10):
+    return await shared_response(
+        request,
+        reads,
+        ("books", "loans"),
+        list[RelatedBook],
+        lambda session: get_related_books_logic(session, book_id, limit)
+        )
+
+@router.get("/users", response_model=list[UserPublic | None])
+async def get_users(request:Request, reads:SharedReadsDep, ids:str | None=None, email:str | None=None):
+    if ids is not None and email is not None:
+        raise HTTPException(status_code=422, detail="Use either ids or email, not both.")
+    if ids is not None:
+        keys = parse_batch_keys(ids, int)
+        return await read_response(reads, list[UserPublic | None], lambda session: get_users_batch_logic(session, ids=keys))
+    if email is not None:
+        keys = parse_batch_keys(email)
+        return await read_response(reads, list[UserPublic | None], lambda session: get_users_batch_logic(session, emails=keys))
+    return await cached_list_response(request, reads, ("users", "loans"), list[UserPublic], get_users_logic)
 
-@app.get("/users/{user_id}", response_model=UserPublic)
-def get_user(session:SessionLocal, user_id:int):
-    return get_user_logic(session, user_id)
+@router.get("/users/{user_id}", response_model=UserPublic)
+async def get_user(request:Request, reads:SharedReadsDep, branch_router:BranchRouterDep, user_id:int):
+    return await shared_response(
+        request,
+        reads,
+        ("users", "loans"),
+        UserPublic,
+        lambda session: get_user_logic(session, user_id, branch_router)
+        )
 
-@app.post("/users", response_model=UserPublic)
-def create_user(session:SessionLocal, user:UserCreate):
+@router.post("/users", response_model=UserPublic)
+def create_user(session:WriteSession, user:UserCreate):
     return create_user_logic(session, user)
 
-@app.get("/loans", response_model=list[LoanPublic])
-def get_loans(session:SessionLocal):
-    return get_loans_logic(session)
+@router.get("/users/{user_id}/loans", response_model=list[LoanPublic])
+def get_user_loans(session:SessionLocal, branch_router:BranchRouterDep, user_id:int, include_archived:bool=False):
+    return get_user_loans_logic(session, user_id, include_archived=include_archived, branch_router=branch_router)
+
+@router.get("/loans", response_model=list[LoanPublic | None])
+async def get_loans(
+        request:Request,
+        reads:SharedReadsDep,
+        branch_router:BranchRouterDep,
+        include_archived:bool=False,
+        ids:str | None=None
+        ):
+    if ids is not None:
+        keys = parse_batch_keys(ids, int)
+        return await read_response(
+            reads,
+            list[LoanPublic | None],
+            lambda session: get_loans_batch_logic(session, keys, include_archived, branch_router)
+            )
+    return await cached_list_response(
+        request,
+        reads,
+        ("loans", "books", "users"),
+        list[LoanPublic],
+        lambda session: get_loans_logic(session, include_archived=include_archived, branch_router=branch_router)
+        )
+
+@router.get("/loans/{loan_id}", response_model=LoanPublic)
+async def get_loan(
+        request:Request,
+        reads:SharedReadsDep,
+        branch_router:BranchRouterDep,
+        loan_id:int,
+        include_archived:bool=False
+        ):
+    return await shared_response(
+        request,
+        reads,
+        ("loans", "books", "users"),
+        LoanPublic,
+        lambda session: get_loan_logic(session, loan_id, include_archived, branch_router)
+        )
+
+@router.post("/loans/{loan_id}/return", response_model=LoanPublic)
+def return_book(session:WriteSession, loan_id:int):
+    return return_book_logic(session, loan_id)
+
+# Every insert, update and delete of books, users and loans after the
+# cursor, oldest first. Pass the returned next value as since to continue.
+@router.get("/changes", response_model=ChangeFeed)
+def get_changes(
+        request:Request,
+        session:SessionLocal,
+        since:Annotated[int, Query(ge=0)]=0,
+        limit:Annotated[int, Query(ge=1, le=1000)]=100
+        ):
+    settle_seconds = request.app.state.settings.change_feed_settle_ms / 1000
+    return get_changes_logic(session, since, limit, settle_seconds)
+
+@router.get("/holds/{hold_id}", response_model=HoldPublic)
+def get_hold(session:SessionLocal, hold_id:int):
+    return get_hold_logic(session, hold_id)
+
+@router.post("/holds/{hold_id}/cancel", response_model=HoldPublic)
+def cancel_hold(session:WriteSession, hold_id:int):
+    return cancel_hold_logic(session, hold_id)
+
+@router.get("/branches", response_model=list[str])
+def get_branches(branch_router:BranchRouterDep):
+    return branch_router.branches()
+
+@router.post("/branches/{branch}/books/{book_id}/borrow", response_model=LoanPublic)
+def borrow_from_branch(sessions:BranchSessions, branch:str, book_id:int, user_id:int):
+    session, main_session = sessions
+    return borrow_from_branch_logic(session, branch, book_id, user_id, main_session)
+
+@router.post("/branches/{branch}/loans/{loan_id}/return", response_model=LoanPublic)
+def return_to_branch(sessions:BranchSessions, branch:str, loan_id:int):
+    session, main_session = sessions
+    return return_branch_loan_logic(session, branch, loan_id, main_session)
+
+# Merged view of a book across all branches, read from every branch
+# database in parallel.
+@router.get("/catalog/{isbn}", response_model=CatalogEntry)
+def get_catalog(session:SessionLocal, branch_router:BranchRouterDep, isbn:str):
+    return get_catalog_logic(session, branch_router, isbn)
+
+
+@router.websocket("/ws/availability")
+async def availability_updates(websocket:WebSocket):
+    await availability_socket_logic(websocket)
+
+
+@router.put("/admin/books/{book_id}/inventory-shards", response_model=BookPublic)
+def shard_book_inventory(session:WriteSession, book_id:int, shards:Annotated[int, Query(ge=0, le=64)]):
+    return shard_book_inventory_logic(session, book_id, shards)
+
+@router.put("/admin/branches/{branch}/books/{book_id}/stock", response_model=BranchStockPublic)
+def set_branch_stock(
+        sessions:BranchSessions,
+        branch:str,
+        book_id:int,
+        total_copies:Annotated[int, Query(ge=0)]
+        ):
+    session, main_session = sessions
+    return set_branch_stock_logic(session, book_id, branch, total_copies, main_session)
+
+@router.get("/admin/inventory/reconcile", response_model=dict)
+def check_inventory(session:SessionLocal):
+    return reconcile_inventory_logic(session)
+
+@router.post("/admin/inventory/reconcile", response_model=dict)
+def repair_inventory(session:WriteSession, batch_size:Annotated[int, Query(gt=0, le=5000)]=500):
+    return reconcile_inventory_logic(session, repair=True, batch_size=batch_size)
+
+@router.post("/admin/loans/archive", response_model=dict)
+def archive_loans(
+        request:Request,
+        session:WriteSession,
+        older_than_days:Annotated[int | None, Query(ge=0)]=None,
+        batch_size:Annotated[int | None, Query(gt=0, le=10000)]=None,
+        max_batches:Annotated[int | None, Query(gt=0, le=100)]=None
+        ):
+    settings = request.app.state.settings
+    return archive_loans_logic(
+        session,
+        settings.loan_archive_after_days if older_than_days is None else older_than_days,
+        batch_size or settings.loan_archive_batch_size,
+        max_batches or settings.loan_archive_max_batches
+        )
+
+@router.get("/metrics", response_model=dict)
+def get_metrics():
+    return metrics.snapshot()
+
+# Both run on the event loop, so they answer even when the threadpool is
+# busy; the database is only probed (in the threadpool) once the cached
+# probe is stale.
+@router.get("/health/live", response_model=dict)
+async def health_live():
+    return {"status": "ok"}
+
+@router.get("/health/ready", response_model=dict)
+async def health_ready(request:Request):
+    monitor = request.app.state.health
+    engine = get_engine(request.app.state.settings)
+    # An overloaded process is not probed: the answer is 503 either way.
+    if not monitor.overload_reasons(engine) and monitor.probe_is_stale():
+        running = monitor.refresh(engine)
+        if monitor.last_probe is None:
+            # Only the first check waits for its probe, and no longer than
+            # the probe timeout.
+            await asyncio.wait([asyncio.wrap_future(running)], timeout=request.app.state.settings.health_probe_timeout_ms / 1000)
+    ready, report = monitor.readiness(engine)
+    return JSONResponse(report, status_code=200 if ready else 503)
+
+@asynccontextmanager
+async def lifespan(app:FastAPI):
+    settings = app.state.settings
+    if settings.db_concurrency > 0:
+        # Enough threads for every slot, so requests queue in the limiter
+        # rather than for a thread, but not so many that they pile up on
+        # pool checkout.
+        to_thread.current_default_thread_limiter().total_tokens = settings.db_concurrency + SPARE_THREADS
+    if settings.db_prewarm_connections > 0:
+        await run_in_threadpool(prewarm_pool, get_engine(settings), settings.db_prewarm_connections)
+    if settings.db_prewarm_caches:
+        await run_in_threadpool(warm_caches, get_engine(settings))
+    if settings.change_listener_enabled:
+        # Branch writes record their change events in the main database too.
+        app.state.change_listener = ChangeListener(get_engine(settings), settings.change_poll_interval_ms / 1000)
+        app.state.change_listener.start()
+    book_suggestions.start(lambda: load_book_suggestions(get_engine(settings)))
+    yield
+    book_suggestions.stop()
+    if settings.change_listener_enabled:
+        app.state.change_listener.stop()
+    app.state.branch_router.shutdown()
 
-@app.get("/loans/{loan_id}", response_model=LoanPublic)
-def get_loan(session:SessionLocal, loan_id:int):
-    return get_loan_logic(session, loan_id)
+def create_app(settings:Settings | None = None) -> FastAPI:
+    settings = settings or get_settings()
+    app = FastAPI(lifespan=lifespan)
+    app.state.settings = settings
+    app.state.branch_router = BranchRouter(settings)
+    app.state.health = HealthMonitor(settings)
+    app.add_middleware(InFlightMiddleware, monitor=app.state.health)
+    app.add_exception_handler(OperationalError, database_timeout_handler)
+    app.add_exception_handler(ClientDisconnected, client_disconnected_handler)
+    metrics.register_gauge("http.in_flight", lambda: app.state.health.in_flight)
+    app.state.response_cache = ResponseCache(settings.response_cache_entries)
+    metrics.register_gauge("response_cache.hits", lambda: app.state.response_cache.hits)
+    metrics.register_gauge("response_cache.misses", lambda: app.state.response_cache.misses)
+    metrics.register_gauge("sql.compiled_cache.hit_rate", compiled_cache_hit_rate)
+    if settings.db_concurrency > 0:
+        app.state.db_limiter = ConcurrencyLimiter(settings.db_concurrency, settings.db_concurrency * QUEUE_PER_SLOT)
+        metrics.register_gauge("db_concurrency.active", lambda: app.state.db_limiter.active)
+        metrics.register_gauge("db_concurrency.waiting", app.state.db_limiter.waiting)
+    if settings.borrow_admission_enabled:
+        app.state.borrow_admission = BorrowAdmission(
+            settings.borrow_user_rate_per_second,
+            settings.borrow_user_burst,
+            settings.borrow_book_max_in_flight
+            )
+        metrics.register_gauge("admission.borrow.in_flight", app.state.borrow_admission.in_flight)
+    # On SQLite the leader would sit out its window holding the only write
+    # slot, with no other borrow able to join.
+    if settings.borrow_batch_window_ms > 0 and not is_sqlite(settings):
+        # A batch takes the book's row lock once for all of its borrows, so
+        # it takes one in-flight slot of the book, not one per borrow.
+        app.state.borrow_coalescer = BorrowCoalescer(
+            settings.borrow_batch_window_ms / 1000,
+            settings.borrow_batch_max_size,
+            admission=getattr(app.state, "borrow_admission", None)
+            )
+    app.include_router(router)
+    return app
 
-@app.post("/loans/{loan_id}/return", response_model=LoanPublic)
-def return_book(session:SessionLocal, loan_id:int):
-    return return_book_logic(session, loan_id)
\ No newline at end of file
+app = create_app()
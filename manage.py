@@ -0,0 +1,107 @@
+import argparse
+import json
+from sqlmodel import Session
+from config import get_settings
+from database import get_engine
+
+def archive_loans(args):
+    from crud import archive_loans_logic
+    settings = get_settings()
+    with Session(get_engine(settings)) as session:
+        return archive_loans_logic(
+            session,
+            settings.loan_archive_after_days if args.older_than_days is None else args.older_than_days,
+            args.batch_size or settings.loan_archive_batch_size,
+            args.max_batches
+            )
+
+def reconcile_inventory(args):
+    from crud import reconcile_inventory_logic
+    with Session(get_engine()) as session:
+        return reconcile_inventory_logic(session, repair=args.repair, batch_size=args.batch_size)
+
+def prune_changes(args):
+    from changes import prune_change_events
+    settings = get_settings()
+    with Session(get_engine(settings)) as session:
+        return prune_change_events(
+            session,
+            settings.change_event_retention_hours if args.older_than_hours is None else args.older_than_hours
+            )
+
+def count_related(args):
+    from crud import count_cooccurrences_logic
+    settings = get_settings()
+    with Session(get_engine(settings)) as session:
+        return count_cooccurrences_logic(
+            session,
+            args.batch_size or settings.cooccurrence_batch_size,
+            args.max_batches,
+            settings.cooccurrence_settle_seconds
+            )
+
+def rebuild_related(args):
+    from crud import rebuild_cooccurrence_logic
+    with Session(get_engine()) as session:
+        return rebuild_cooccurrence_logic(session)
+
+def seed(args):
+    from datetime import datetime, timezone
+    from seed import seed_database
+    anchor = datetime.fromisoformat(args.anchor).replace(tzinfo=timezone.utc) if args.anchor else None
+    return seed_database(
+        get_engine(),
+        books=args.books,
+        users=args.users,
+        loans=args.loans,
+        seed=args.seed,
+        anchor=anchor,
+        chunk_size=args.chunk_size,
+        active_fraction=args.active_fraction
+        )
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Maintenance commands for the library API.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    archive = commands.add_parser("archive-loans", help="Move old returned loans to loan_archive.")
+    archive.add_argument("--older-than-days", type=int, default=None)
+    archive.add_argument("--batch-size", type=int, default=None)
+    archive.add_argument("--max-batches", type=int, default=None)
+    archive.set_defaults(handler=archive_loans)
+
+    reconcile = commands.add_parser("reconcile-inventory", help="Compare available copies with active loans.")
+    reconcile.add_argument("--repair", action="store_true")
+    reconcile.add_argument("--batch-size", type=int, default=500)
+    reconcile.set_defaults(handler=reconcile_inventory)
+
+    prune = commands.add_parser("prune-changes", help="Delete old rows from change_event.")
+    prune.add_argument("--older-than-hours", type=int, default=None)
+    prune.set_defaults(handler=prune_changes)
+
+    counter = commands.add_parser("count-related", help="Count the also-borrowed pairs of the loans made since the last run.")
+    counter.add_argument("--batch-size", type=int, default=None)
+    counter.add_argument("--max-batches", type=int, default=None)
+    counter.set_defaults(handler=count_related)
+
+    related = commands.add_parser("rebuild-related", help="Recount the also-borrowed pairs from the loan history.")
+    related.set_defaults(handler=rebuild_related)
+
+    seeder = commands.add_parser("seed", help="Bulk insert synthetic books, users and loans.")
+    seeder.add_argument("--books", type=int, default=100_000)
+    seeder.add_argument("--users", type=int, default=50_000)
+    seeder.add_argument("--loans", type=int, default=1_000_000)
+    seeder.add_argument("--seed", type=int, default=0)
+    seeder.add_argument("--anchor", default=None, help="Reference date for loan dates, e.g. 2026-01-01. Defaults to today (UTC).")
+    seeder.add_argument("--chunk-size", type=int, default=50_000)
+    seeder.add_argument("--active-fraction", type=float, default=0.1)
+    seeder.set_defaults(handler=seed)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    print(json.dumps(args.handler(args)))
+
+if __name__ == "__main__":
+    main()
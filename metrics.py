@@ -0,0 +1,30 @@
+import threading
+
+class Metrics:
+    # Process-local counters and gauges, exposed as JSON on GET /metrics.
+    def __init__(self):
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name:str, value:float=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def register_gauge(self, name:str, read):
+        self._gauges[name] = read
+
+    def get(self, name:str):
+        return self._counters.get(name, 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        gauges = {name: read() for name, read in self._gauges.items()}
+        return {"counters": counters, "gauges": gauges}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+metrics = Metrics()
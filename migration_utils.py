@@ -0,0 +1,108 @@
+from alembic import op
+from sqlalchemy import text
+
+# Helpers for migrations that run against a live database. On PostgreSQL
+# they work outside the migration transaction so that no long lock is held
+# on big tables like loan; other dialects get the plain operation.
+
+def is_postgresql():
+    return op.get_bind().dialect.name == "postgresql"
+
+def index_is_invalid(index_name:str):
+    return bool(op.get_bind().execute(
+        text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+        {"name": index_name}
+        ).scalar())
+
+def constraint_exists(constraint_name:str, table_name:str):
+    # Offline (--sql) runs cannot look, and start from a known schema.
+    if op.get_context().as_sql:
+        return False
+    return bool(op.get_bind().execute(
+        text("SELECT 1 FROM pg_constraint WHERE conname = :name AND conrelid = to_regclass(:table)"),
+        {"name": constraint_name, "table": table_name}
+        ).scalar())
+
+def create_index_concurrently(
+        index_name:str,
+        table_name:str,
+        columns:list[str],
+        unique:bool=False,
+        **kw
+        ):
+    if not is_postgresql():
+        op.create_index(index_name, table_name, columns, unique=unique, **kw)
+        return
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    with op.get_context().autocommit_block():
+        # An interrupted concurrent build leaves an INVALID index behind,
+        # which IF NOT EXISTS would keep; drop it so the migration can be rerun.
+        if index_is_invalid(index_name):
+            op.drop_index(index_name, table_name=table_name, postgresql_concurrently=True)
+        op.create_index(
+            index_name,
+            table_name,
+            columns,
+            unique=unique,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+            **kw
+            )
+
+def drop_index_concurrently(index_name:str, table_name:str):
+    if not is_postgresql():
+        op.drop_index(index_name, table_name=table_name, if_exists=True)
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index(index_name, table_name=table_name, postgresql_concurrently=True, if_exists=True)
+
+def backfill_in_batches(
+        table_name:str,
+        assignments:str,
+        condition:str | None=None,
+        batch_size:int=10_000,
+        params:dict | None=None
+        ):
+    # Walks the primary key in ranges of batch_size and commits each UPDATE
+    # on its own, so rows are only locked for one batch at a time.
+    where = f" AND ({condition})" if condition else ""
+    statement = text(f'UPDATE "{table_name}" SET {assignments} WHERE id >= :start AND id < :end{where}')
+    updated = 0
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        low, high = bind.execute(text(f'SELECT MIN(id), MAX(id) FROM "{table_name}"')).one()
+        if low is None:
+            return 0
+        for start in range(low, high + 1, batch_size):
+            result = bind.execute(statement, {**(params or {}), "start": start, "end": start + batch_size})
+            updated += result.rowcount
+    return updated
+
+def add_check_constraint(constraint_name:str, table_name:str, condition:str):
+    if not is_postgresql():
+        op.create_check_constraint(constraint_name, table_name, condition)
+        return
+    # Added NOT VALID, the constraint only holds its ACCESS EXCLUSIVE lock
+    # for a moment. VALIDATE CONSTRAINT then checks the existing rows in a
+    # transaction of its own, under a lock that lets reads and writes through.
+    with op.get_context().autocommit_block():
+        if not constraint_exists(constraint_name, table_name):
+            op.execute(f'ALTER TABLE "{table_name}" ADD CONSTRAINT "{constraint_name}" CHECK ({condition}) NOT VALID')
+        op.execute(f'ALTER TABLE "{table_name}" VALIDATE CONSTRAINT "{constraint_name}"')
+
+def set_not_null(table_name:str, column_name:str):
+    if not is_postgresql():
+        op.alter_column(table_name, column_name, nullable=False)
+        return
+    # SET NOT NULL scans the table under ACCESS EXCLUSIVE, unless a validated
+    # IS NOT NULL check already proves the column has no NULLs (PostgreSQL 12+).
+    constraint_name = f"ck_{table_name}_{column_name}_not_null"
+    add_check_constraint(constraint_name, table_name, f'"{column_name}" IS NOT NULL')
+    version = op.get_bind().dialect.server_version_info
+    if version is not None and version < (12,):
+        # The scan cannot be skipped there, so the check stays in place of
+        # NOT NULL and the column is left nullable.
+        return
+    with op.get_context().autocommit_block():
+        op.alter_column(table_name, column_name, nullable=False)
+        op.drop_constraint(constraint_name, table_name, type_="check")
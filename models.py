@@ -1,4 +1,5 @@
-from sqlmodel import SQLModel, Field, Column, TIMESTAMP, DateTime, func, Relationship
+from sqlmodel import SQLModel, Field, Column, TIMESTAMP, DateTime, func, Relationship, Index, SmallInteger
+from sqlalchemy import CheckConstraint, TypeDecorator, text
 from pydantic import model_validator
 from datetime import datetime, timezone, timedelta
 from typing import List
@@ -12,8 +13,32 @@ class Book(SQLModel, table=True):
     publication_year: int = Field(nullable=False)
     total_copies: int = Field(default=1, nullable=False, ge=0)
     available_copies: int | None = Field(default=None, nullable=True)
+    # When above 0, available_copies is NULL and the stock is spread over
+    # this many BookInventorySlot rows so borrows do not all lock one row.
+    inventory_shards: int = Field(default=0, nullable=False, ge=0)
 
     loans: List["Loan"] = Relationship(back_populates="book")
+    inventory: List["BookInventorySlot"] = Relationship(back_populates="book", cascade_delete=True)
+
+class BookInventorySlot(SQLModel, table=True):
+    __tablename__ = "book_inventory_slot"
+
+    book_id: int = Field(foreign_key="book.id", primary_key=True, ondelete="CASCADE")
+    slot: int = Field(primary_key=True)
+    available_copies: int = Field(default=0, nullable=False, ge=0)
+
+    book: Book | None = Relationship(back_populates="inventory")
+
+class BranchStock(SQLModel, table=True):
+    __tablename__ = "branch_stock"
+
+    # Copies of a book held by one library branch. Branch stock is separate
+    # from the book's own total/available copies, which stay the stock of
+    # the main library.
+    book_id: int = Field(foreign_key="book.id", primary_key=True, ondelete="CASCADE")
+    branch: str = Field(primary_key=True)
+    total_copies: int = Field(default=0, nullable=False, ge=0)
+    available_copies: int = Field(default=0, nullable=False, ge=0)
 
 class User(SQLModel, table=True):
     id: int | None = Field(default=None, primary_key=True)
@@ -22,15 +47,45 @@ class User(SQLModel, table=True):
 
     loans: List["Loan"] = Relationship(back_populates="user")
 
-# class LoanStatus(str, Enum):
-#     BORROWED = "borrowed"
-#     RETURNED = "returned"
-#     OVERDUE = "overdue"
+class LoanStatus(str, Enum):
+    BORROWED = "borrowed"
+    RETURNED = "returned"
+    OVERDUE = "overdue"
+
+# The codes stored in the status columns. Only ever append to this; the
+# check constraints and the active-loan index predicates depend on them.
+LOAN_STATUS_CODES = {LoanStatus.BORROWED: 0, LoanStatus.RETURNED: 1, LoanStatus.OVERDUE: 2}
+LOAN_STATUSES = {code: status for status, code in LOAN_STATUS_CODES.items()}
+LOAN_STATUS_CHECK = f"status IN ({', '.join(str(code) for code in LOAN_STATUSES)})"
+ACTIVE_LOAN_PREDICATE = text(f"status <> {LOAN_STATUS_CODES[LoanStatus.RETURNED]}")
+
+class LoanStatusType(TypeDecorator):
+    # A SMALLINT per row instead of the status text; Python code and the
+    # API keep seeing LoanStatus values.
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else LOAN_STATUS_CODES[LoanStatus(value)]
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else LOAN_STATUSES[value]
 
 class Loan(SQLModel, table=True):
+    __table_args__ = (
+        CheckConstraint(LOAN_STATUS_CHECK, name="ck_loan_status"),
+        # Most loans are returned; the active ones are what borrows, returns
+        # and reconciliation look up, so these indexes stay small.
+        Index("ix_loan_active_book_id", "book_id", postgresql_where=ACTIVE_LOAN_PREDICATE, sqlite_where=ACTIVE_LOAN_PREDICATE),
+        Index("ix_loan_active_user_id", "user_id", postgresql_where=ACTIVE_LOAN_PREDICATE, sqlite_where=ACTIVE_LOAN_PREDICATE),
+        # Archived loans keep their id, so an id must never be handed out
+        # again once its loan has moved to loan_archive.
+        {"sqlite_autoincrement": True},
+    )
+
     id: int | None = Field(default=None, primary_key=True)
-    book_id: int = Field(foreign_key="book.id", nullable=False)
-    user_id: int = Field(foreign_key="user.id", nullable=False)
+    book_id: int = Field(foreign_key="book.id", nullable=False, index=True)
+    user_id: int = Field(foreign_key="user.id", nullable=False, index=True)
     borrow_date: datetime = Field(
         default_factory=lambda: datetime.now(timezone.utc),
         sa_column=Column(
@@ -46,7 +101,12 @@ class Loan(SQLModel, table=True):
         )
     )
     return_date: datetime | None = None
-    status: str = Field(default='borrowed')
+    status: LoanStatus = Field(
+        default=LoanStatus.BORROWED,
+        sa_column=Column(LoanStatusType(), nullable=False)
+    )
+    # The branch the copy was lent from; None for the main library's stock.
+    branch: str | None = Field(default=None, nullable=True)
     book: Book | None = Relationship(back_populates="loans")
     user: User | None = Relationship(back_populates="loans")
 
@@ -60,4 +120,115 @@ class Loan(SQLModel, table=True):
     def add_due_date(self):
         if self.due_date is None:
             self.due_date = self.borrow_date + timedelta(days=14)
-        return self
\ No newline at end of file
+        return self
+
+class LoanArchive(SQLModel, table=True):
+    __tablename__ = "loan_archive"
+    __table_args__ = (
+        CheckConstraint(LOAN_STATUS_CHECK, name="ck_loan_archive_status"),
+    )
+
+    # Keeps the id the loan had in the loan table, so lookups by id still work.
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    book_id: int = Field(foreign_key="book.id", nullable=False, index=True)
+    user_id: int = Field(foreign_key="user.id", nullable=False, index=True)
+    borrow_date: datetime = Field(
+        sa_column=Column(
+            DateTime(timezone=True),
+            nullable=False,
+        )
+    )
+    due_date: datetime = Field(
+        sa_column=Column(
+            DateTime(timezone=True),
+            nullable=False,
+        )
+    )
+    return_date: datetime | None = None
+    status: LoanStatus = Field(
+        default=LoanStatus.RETURNED,
+        sa_column=Column(LoanStatusType(), nullable=False)
+    )
+    branch: str | None = Field(default=None, nullable=True)
+    archived_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        sa_column=Column(
+            DateTime(timezone=True),
+            nullable=False,
+            server_default=func.now()
+        )
+    )
+    book: Book | None = Relationship()
+    user: User | None = Relationship()
+
+class BookCooccurrence(SQLModel, table=True):
+    __tablename__ = "book_cooccurrence"
+    __table_args__ = (
+        Index("ix_book_cooccurrence_top", "book_id", "borrowers", "related_book_id"),
+    )
+
+    # Number of users who borrowed both books, kept for both orders of
+    # each pair so "also borrowed" is a single index range scan.
+    book_id: int = Field(foreign_key="book.id", primary_key=True, ondelete="CASCADE")
+    related_book_id: int = Field(foreign_key="book.id", primary_key=True, ondelete="CASCADE")
+    borrowers: int = Field(default=0, nullable=False)
+
+class JobCursor(SQLModel, table=True):
+    __tablename__ = "job_cursor"
+
+    # How far a periodic job has read, e.g. the last loan id counted into
+    # book_cooccurrence.
+    name: str = Field(primary_key=True)
+    position: int = Field(default=0, nullable=False)
+
+class ChangeEvent(SQLModel, table=True):
+    __tablename__ = "change_event"
+    # Never hand out an id again once old rows are pruned; the change feed
+    # cursors depend on it.
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    # One row per committed change to a book, user or loan, written in the
+    # same transaction. The id orders the changes and serves as their
+    # version; entity_id is NULL when a whole collection changed at once.
+    id: int | None = Field(default=None, primary_key=True)
+    entity: str = Field(nullable=False)
+    entity_id: int | None = Field(default=None, nullable=True)
+    # insert, update, delete or archive (a loan moved to loan_archive).
+    operation: str = Field(default="update", nullable=False)
+    # The API process that made the change.
+    origin: str = Field(nullable=False)
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        sa_column=Column(
+            DateTime(timezone=True),
+            nullable=False,
+            server_default=func.now()
+        )
+    )
+
+class Hold(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_hold_book_id_status_created_at", "book_id", "status", "created_at"),
+    )
+
+    id: int | None = Field(default=None, primary_key=True)
+    book_id: int = Field(foreign_key="book.id", nullable=False)
+    user_id: int = Field(foreign_key="user.id", nullable=False)
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        sa_column=Column(
+            DateTime(timezone=True),
+            nullable=False,
+            server_default=func.now()
+        )
+    )
+    status: str = Field(default='waiting')
+    # Not a foreign key: the loan may later be moved to loan_archive with the same id.
+    loan_id: int | None = Field(default=None, nullable=True)
+    fulfilled_at: datetime | None = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True),
+            nullable=True,
+        )
+    )
@@ -0,0 +1,126 @@
+import asyncio
+import json
+from collections import defaultdict
+from fastapi import WebSocket, WebSocketDisconnect
+
+MAX_SUBSCRIPTIONS_PER_SOCKET = 500
+
+class Subscriber:
+    # Only the latest event per book is kept, so a slow or idle client costs
+    # at most one pending event per subscribed book rather than a backlog.
+    __slots__ = ("book_ids", "pending", "ready")
+
+    def __init__(self):
+        self.book_ids = set()
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def push(self, event:dict):
+        self.pending[event["book_id"]] = event
+        self.ready.set()
+
+    async def next_events(self):
+        await self.ready.wait()
+        self.ready.clear()
+        events = list(self.pending.values())
+        self.pending.clear()
+        return events
+
+class AvailabilityHub:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._loop = None
+
+    def connect(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is None or self._loop.is_closed():
+            self._loop = loop
+        return Subscriber()
+
+    def disconnect(self, subscriber:Subscriber):
+        self.unsubscribe(subscriber, list(subscriber.book_ids))
+
+    def subscribe(self, subscriber:Subscriber, book_ids:list[int]):
+        for book_id in book_ids:
+            if len(subscriber.book_ids) >= MAX_SUBSCRIPTIONS_PER_SOCKET:
+                break
+            subscriber.book_ids.add(book_id)
+            self._subscribers[book_id].add(subscriber)
+
+    def unsubscribe(self, subscriber:Subscriber, book_ids:list[int]):
+        for book_id in book_ids:
+            subscriber.book_ids.discard(book_id)
+            subscribers = self._subscribers.get(book_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[book_id]
+
+    def subscriber_count(self, book_id:int):
+        return len(self._subscribers.get(book_id, ()))
+
+    def publish(
+            self,
+            book_id:int,
+            reason:str,
+            available_copies:int | None = None,
+            total_copies:int | None = None
+            ):
+        # Called from the sync CRUD paths running in the threadpool, after
+        # commit. Books nobody listens to cost a single dict lookup.
+        loop = self._loop
+        if loop is None or book_id not in self._subscribers:
+            return
+        event = {
+            "book_id": book_id,
+            "reason": reason,
+            "available_copies": available_copies,
+            "total_copies": total_copies,
+            }
+        try:
+            loop.call_soon_threadsafe(self._dispatch, event)
+        except RuntimeError:
+            # The loop has shut down; there is nobody left to notify.
+            self._loop = None
+
+    def _dispatch(self, event:dict):
+        for subscriber in self._subscribers.get(event["book_id"], ()):
+            subscriber.push(event)
+
+availability_hub = AvailabilityHub()
+
+def parse_book_ids(values) -> list[int]:
+    if not isinstance(values, list):
+        return []
+    return [value for value in values if isinstance(value, int) and not isinstance(value, bool)]
+
+async def _forward_events(websocket:WebSocket, subscriber:Subscriber):
+    while True:
+        for event in await subscriber.next_events():
+            await websocket.send_text(json.dumps(event, separators=(",", ":")))
+
+async def availability_socket_logic(
+        websocket:WebSocket,
+        hub:AvailabilityHub = availability_hub
+        ):
+    await websocket.accept()
+    subscriber = hub.connect()
+    sender = asyncio.create_task(_forward_events(websocket, subscriber))
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except ValueError:
+                await websocket.send_json({"error": "Messages must be JSON objects."})
+                continue
+            if not isinstance(message, dict):
+                await websocket.send_json({"error": "Messages must be JSON objects."})
+                continue
+            hub.subscribe(subscriber, parse_book_ids(message.get("subscribe")))
+            hub.unsubscribe(subscriber, parse_book_ids(message.get("unsubscribe")))
+            await websocket.send_json({"subscribed": sorted(subscriber.book_ids)})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        hub.disconnect(subscriber)
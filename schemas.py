@@ -1,6 +1,17 @@
 from sqlmodel import Field, SQLModel
 from pydantic import ConfigDict, model_validator
 from datetime import datetime
+from models import LoanStatus
+
+class LoanBase(SQLModel):
+    book_id: int
+    user_id: int
+
+class LoanPublicShort(LoanBase):
+    id: int
+    due_date: datetime
+    return_date: datetime | None
+    status: LoanStatus
 
 class BookBase(SQLModel):
     title: str
@@ -12,14 +23,34 @@ class BookBase(SQLModel):
 class BookCreate(BookBase):
     pass
 
-class BookPublic(BookBase):
+class BookPublicBase(BookBase):
     id: int
     available_copies: int
+
+    @model_validator(mode="before")
+    @classmethod
+    def sum_inventory_slots(cls, data):
+        # Sharded books keep their stock in inventory slots, not in available_copies.
+        if not getattr(data, "inventory_shards", 0):
+            return data
+        values = {name: getattr(data, name) for name in cls.model_fields}
+        values["available_copies"] = sum(slot.available_copies for slot in data.inventory)
+        return values
+
+class BookPublic(BookPublicBase):
     loans: list[LoanPublicShort]
 
-class BookPublicShort(BookBase):
-    id: int
-    available_copies: int
+class BookPublicShort(BookPublicBase):
+    pass
+
+class BookSuggestion(SQLModel):
+    text: str
+    field: str
+    book_ids: list[int]
+
+class RelatedBook(SQLModel):
+    book: BookPublicShort
+    borrowers: int
 
 class UserBase(SQLModel):
     name: str
@@ -35,10 +66,6 @@ class UserPublic(UserBase):
 class UserPublicShort(UserBase):
     id: int
 
-class LoanBase(SQLModel):
-    book_id: int
-    user_id: int
-
 class LoanCreate(LoanBase):
     pass
 
@@ -49,16 +76,49 @@ class LoanPublic(LoanBase):
     borrow_date: datetime
     due_date: datetime
     return_date: datetime | None
-    status: str
-
-class LoanPublicShort(LoanBase):
-    id: int
-    due_date: datetime
-    return_date: datetime | None
-    status: str
+    status: LoanStatus
+    branch: str | None = None
 
 class BookBorrowRequest(SQLModel):
     user_id: int
 
 class BookReturnRequest(SQLModel):
-    loan_id: int
\ No newline at end of file
+    loan_id: int
+
+class HoldBase(SQLModel):
+    book_id: int
+    user_id: int
+
+class HoldPublic(HoldBase):
+    id: int
+    created_at: datetime
+    status: str
+    loan_id: int | None
+    fulfilled_at: datetime | None
+
+class BranchStockPublic(SQLModel):
+    book_id: int
+    branch: str
+    total_copies: int
+    available_copies: int
+
+class CatalogEntry(SQLModel):
+    isbn: str
+    title: str
+    author: str
+    publication_year: int
+    total_copies: int
+    available_copies: int
+    branches: list[BranchStockPublic]
+
+class ChangePublic(SQLModel):
+    version: int
+    entity: str
+    entity_id: int | None
+    operation: str
+    changed_at: datetime
+
+class ChangeFeed(SQLModel):
+    changes: list[ChangePublic]
+    next: int
+    has_more: bool
@@ -0,0 +1,228 @@
+import bisect
+import csv
+import io
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate, islice
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from models import LOAN_STATUS_CODES, LoanStatus
+
+# Synthetic catalog, patrons and loan history for staging and benchmarks.
+# The same seed and anchor always produce the same rows.
+
+BOOK_COLUMNS = ["id", "title", "author", "isbn", "publication_year", "total_copies", "available_copies", "inventory_shards"]
+USER_COLUMNS = ["id", "name", "email"]
+LOAN_COLUMNS = ["id", "book_id", "user_id", "borrow_date", "due_date", "return_date", "status"]
+BORROWED = LOAN_STATUS_CODES[LoanStatus.BORROWED]
+RETURNED = LOAN_STATUS_CODES[LoanStatus.RETURNED]
+
+TITLE_WORDS = [
+    "Silent", "River", "Shadow", "Garden", "Empire", "Winter", "Glass", "Iron", "Hidden", "Last",
+    "Crimson", "Northern", "Secret", "Golden", "Broken", "Distant", "Night", "Summer", "Paper", "Stone",
+    "House", "City", "Ocean", "Forest", "Kingdom", "Letter", "Voyage", "Mirror", "Orchard", "Lantern",
+    ]
+FIRST_NAMES = [
+    "Ada", "Ben", "Chloe", "Dmitri", "Elena", "Farid", "Grace", "Hiro", "Ines", "Jonas",
+    "Kemi", "Luca", "Maya", "Nadia", "Omar", "Priya", "Quinn", "Rosa", "Sven", "Tara",
+    ]
+LAST_NAMES = [
+    "Abbott", "Baptiste", "Chen", "Dubois", "Eriksen", "Fischer", "Garcia", "Haddad", "Ivanova", "Jensen",
+    "Kowalski", "Lopez", "Moreau", "Nakamura", "Okafor", "Petrov", "Quispe", "Rossi", "Silva", "Tanaka",
+    ]
+
+DAY = 86400
+# Loans are borrowed up to ACTIVE_DAYS before the anchor while active, or
+# HISTORY_DAYS before that once returned, and kept for at most LOAN_DAYS.
+ACTIVE_DAYS = 30
+HISTORY_DAYS = 730
+LOAN_DAYS = 30
+DUE_DAYS = 14
+
+class Timestamps:
+    # Loan dates are whole seconds away from the anchor. Formatting them
+    # from a table of day strings and one of time-of-day strings costs two
+    # list lookups, where building and formatting a datetime per value was
+    # the bulk of the seeding time. The text is what SQLAlchemy's DateTime
+    # stores on SQLite (naive UTC); suffix adds the offset where the column
+    # stores one.
+    def __init__(self, anchor:datetime, days_before:int, days_after:int, suffix:str=""):
+        if anchor.tzinfo is not None:
+            anchor = anchor.astimezone(timezone.utc)
+        first = anchor.date() - timedelta(days=days_before)
+        self.days = [(first + timedelta(days=day)).isoformat() + " " for day in range(days_before + days_after + 1)]
+        fraction = f".{anchor.microsecond:06d}{suffix}"
+        self.times = [f"{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}{fraction}" for second in range(DAY)]
+        # Seconds from the start of the first day to the anchor.
+        self.origin = days_before * DAY + anchor.hour * 3600 + anchor.minute * 60 + anchor.second
+
+def generate_books(rng:random.Random, start_id:int, count:int, anchor:datetime):
+    random = rng.random
+    for book_id in range(start_id, start_id + count):
+        title = " ".join(rng.choices(TITLE_WORDS, k=2 + int(random() * 3)))
+        author = f"{FIRST_NAMES[int(random() * len(FIRST_NAMES))]} {LAST_NAMES[int(random() * len(LAST_NAMES))]}"
+        # Mostly recent publications, a long tail back to 1900.
+        year = max(1900, anchor.year - int(rng.expovariate(1 / 15)))
+        copies = min(1 + int(rng.expovariate(1 / 2)), 20)
+        yield (book_id, title, author, f"SYN-{book_id:012d}", year, copies, copies, 0)
+
+def generate_users(rng:random.Random, start_id:int, count:int):
+    random = rng.random
+    for user_id in range(start_id, start_id + count):
+        name = f"{FIRST_NAMES[int(random() * len(FIRST_NAMES))]} {LAST_NAMES[int(random() * len(LAST_NAMES))]}"
+        yield (user_id, name, f"user{user_id}@example.com")
+
+def generate_loans(
+        rng:random.Random,
+        start_id:int,
+        count:int,
+        book_ids:list[int],
+        total_copies:list[int],
+        user_ids:list[int],
+        anchor:datetime,
+        active_fraction:float,
+        popularity_skew:float,
+        active:list[int],
+        timestamp_suffix:str=""
+        ):
+    # Book popularity follows a Zipf-like curve over a shuffled ranking, so
+    # the bestsellers are spread over the id range instead of being the first ids.
+    ranking = list(range(len(book_ids)))
+    rng.shuffle(ranking)
+    cum_weights = list(accumulate(1 / (rank + 1) ** popularity_skew for rank in range(len(book_ids))))
+    total_weight = cum_weights[-1]
+    last_rank = len(book_ids) - 1
+    timestamps = Timestamps(anchor, ACTIVE_DAYS + 1 + HISTORY_DAYS, DUE_DAYS, timestamp_suffix)
+    days, times, origin = timestamps.days, timestamps.times, timestamps.origin
+    # Plain random() calls: randrange() costs several Python calls per value.
+    random = rng.random
+    user_count = len(user_ids)
+    for loan_id in range(start_id, start_id + count):
+        index = ranking[min(bisect.bisect(cum_weights, random() * total_weight), last_rank)]
+        user_id = user_ids[int(random() * user_count)]
+        if random() < active_fraction and active[index] < total_copies[index]:
+            # Active loans started in the last 30 days, so their due dates
+            # fall both before (overdue) and after the anchor.
+            day, second = divmod(origin - int(random() * ACTIVE_DAYS * DAY), DAY)
+            return_date = None
+            status = BORROWED
+            active[index] += 1
+        else:
+            borrowed = origin - (ACTIVE_DAYS + 1) * DAY - int(random() * HISTORY_DAYS * DAY)
+            day, second = divmod(borrowed, DAY)
+            returned_day, returned_second = divmod(borrowed + 1 + int(random() * (LOAN_DAYS * DAY - 1)), DAY)
+            return_date = days[returned_day] + times[returned_second]
+            status = RETURNED
+        yield (loan_id, book_ids[index], user_id, days[day] + times[second], days[day + DUE_DAYS] + times[second], return_date, status)
+
+def chunked(rows, size:int):
+    iterator = iter(rows)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+class BulkWriter:
+    # COPY on PostgreSQL, driver-level executemany elsewhere. Rows hold
+    # values ready for the driver: timestamps come as text already.
+    def __init__(self, engine:Engine):
+        self.engine = engine
+        self.dialect = engine.dialect.name
+        # PostgreSQL columns keep the UTC offset; SQLite stores naive UTC.
+        self.timestamp_suffix = "+00:00" if self.dialect == "postgresql" else ""
+
+    def write(self, table:str, columns:list[str], rows:list[tuple]):
+        with self.engine.begin() as connection:
+            if self.dialect == "postgresql":
+                self._copy(connection, table, columns, rows)
+            else:
+                placeholders = ", ".join("?" if self.dialect == "sqlite" else "%s" for _ in columns)
+                quoted = ", ".join(columns)
+                connection.exec_driver_sql(f'INSERT INTO "{table}" ({quoted}) VALUES ({placeholders})', rows)
+
+    def _copy(self, connection, table:str, columns:list[str], rows:list[tuple]):
+        buffer = io.StringIO()
+        # csv writes None as an empty field, which COPY reads as NULL.
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor = connection.connection.dbapi_connection.cursor()
+        try:
+            cursor.copy_expert(f'COPY "{table}" ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+        finally:
+            cursor.close()
+
+def next_id(engine:Engine, table:str) -> int:
+    with engine.connect() as connection:
+        return (connection.execute(text(f'SELECT MAX(id) FROM "{table}"')).scalar() or 0) + 1
+
+def seed_database(
+        engine:Engine,
+        books:int,
+        users:int,
+        loans:int,
+        seed:int=0,
+        anchor:datetime | None=None,
+        chunk_size:int=50_000,
+        active_fraction:float=0.1,
+        popularity_skew:float=1.1
+        ):
+    anchor = anchor or datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    rng = random.Random(seed)
+    writer = BulkWriter(engine)
+    started = time.perf_counter()
+
+    first_book = next_id(engine, "book")
+    book_ids, total_copies = [], []
+    for chunk in chunked(generate_books(rng, first_book, books, anchor), chunk_size):
+        book_ids.extend(row[0] for row in chunk)
+        total_copies.extend(row[5] for row in chunk)
+        writer.write("book", BOOK_COLUMNS, chunk)
+
+    first_user = next_id(engine, "user")
+    for chunk in chunked(generate_users(rng, first_user, users), chunk_size):
+        writer.write("user", USER_COLUMNS, chunk)
+    user_ids = range(first_user, first_user + users)
+
+    # Active loans per generated book, counted while the loans are produced
+    # so no pass over the loan table is needed afterwards.
+    active = [0] * len(book_ids)
+    if loans and book_ids and users:
+        first_loan = next_id(engine, "loan")
+        rows = generate_loans(
+            rng,
+            first_loan,
+            loans,
+            book_ids,
+            total_copies,
+            user_ids,
+            anchor,
+            active_fraction,
+            popularity_skew,
+            active,
+            writer.timestamp_suffix
+            )
+        for chunk in chunked(rows, chunk_size):
+            writer.write("loan", LOAN_COLUMNS, chunk)
+
+    with engine.begin() as connection:
+        lent = [
+            {"id": book_id, "available": copies - count}
+            for book_id, copies, count in zip(book_ids, total_copies, active)
+            if count
+            ]
+        if lent:
+            connection.execute(text("UPDATE book SET available_copies = :available WHERE id = :id"), lent)
+        if engine.dialect.name == "postgresql":
+            for table in ("book", "user", "loan"):
+                connection.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), COALESCE(MAX(id), 1)) FROM \"{table}\""
+                    ))
+
+    elapsed = time.perf_counter() - started
+    rows = books + users + loans
+    return {
+        "books": books,
+        "users": users,
+        "loans": loans,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed) if elapsed else rows,
+        }
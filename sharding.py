@@ -0,0 +1,119 @@
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import Depends, HTTPException, Request
+from sqlmodel import Session
+from typing import Annotated
+from admission import db_concurrency_slot
+from config import Settings
+from database import get_engine, open_write_session, sqlite_write_slots
+from timeouts import QueryGuard, cancel_on_disconnect
+
+class BranchRouter:
+    # Maps each library branch to the database that holds its stock and
+    # loans. Several branches may share one database.
+    def __init__(self, settings:Settings):
+        self.settings = settings
+        self.databases = {
+            branch: url or settings.sqlalchemy_database_url
+            for branch, url in settings.branch_databases.items()
+            }
+        # Started on first use and again after shutdown(), so an app can go
+        # through its lifespan more than once.
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def branches(self) -> list[str]:
+        return sorted(self.databases)
+
+    def is_remote(self, branch:str) -> bool:
+        return self.database_for(branch) != self.settings.sqlalchemy_database_url
+
+    def remote_branches(self) -> list[str]:
+        # Branches whose loans are not in the main database.
+        return [branch for branch in self.branches() if self.is_remote(branch)]
+
+    def database_for(self, branch:str) -> str:
+        url = self.databases.get(branch)
+        if url is None:
+            raise HTTPException(status_code=404, detail="Branch not found.")
+        return url
+
+    def fan_out(self, read, branches:list[str] | None = None) -> list:
+        # read(session, branches) runs once per database, in parallel, with
+        # the branches that live there; the row lists are concatenated.
+        groups = defaultdict(list)
+        for branch in self.branches() if branches is None else branches:
+            groups[self.database_for(branch)].append(branch)
+        if not groups:
+            return []
+
+        def run(url, group):
+            with Session(get_engine(self.settings, url), expire_on_commit=False) as session:
+                return read(session, group)
+
+        executor = self._start()
+        futures = [executor.submit(run, url, group) for url, group in groups.items()]
+        return [row for future in futures for row in future.result()]
+
+    def _start(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=max(self.settings.branch_fan_out_workers, 1),
+                    thread_name_prefix="branch-fan-out"
+                    )
+            return self._executor
+
+    def shutdown(self):
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+async def get_branch_router(request:Request) -> BranchRouter:
+    # Async so it runs on the event loop rather than taking a worker thread.
+    return request.app.state.branch_router
+
+async def branch_write_slot(request:Request, branch:str):
+    router = request.app.state.branch_router
+    async with sqlite_write_slots(router.settings, router.database_for(branch)):
+        yield
+
+async def branch_and_main_write_slots(request:Request, branch:str):
+    router = request.app.state.branch_router
+    async with sqlite_write_slots(router.settings, router.settings.sqlalchemy_database_url, router.database_for(branch)):
+        yield
+
+def get_branch_session(
+        request:Request,
+        branch:str,
+        _slot:Annotated[None, Depends(db_concurrency_slot)],
+        _write_slot:Annotated[None, Depends(branch_write_slot)],
+        guard:Annotated[QueryGuard, Depends(cancel_on_disconnect)]
+        ):
+    # A write session on the branch's database, as get_write_session is on
+    # the main one.
+    with open_write_session(request, guard, request.app.state.branch_router.database_for(branch)) as session:
+        yield session
+
+def get_branch_sessions(
+        request:Request,
+        branch:str,
+        _slot:Annotated[None, Depends(db_concurrency_slot)],
+        _write_slots:Annotated[None, Depends(branch_and_main_write_slots)],
+        guard:Annotated[QueryGuard, Depends(cancel_on_disconnect)]
+        ):
+    # For branch writes that also use the main database: the branch session
+    # and, when the branch has a database of its own, a main session.
+    router = request.app.state.branch_router
+    with open_write_session(request, guard, router.database_for(branch)) as session:
+        if not router.is_remote(branch):
+            yield session, None
+            return
+        with open_write_session(request, guard) as main_session:
+            yield session, main_session
+
+BranchRouterDep = Annotated[BranchRouter, Depends(get_branch_router)]
+BranchSession = Annotated[Session, Depends(get_branch_session)]
+BranchSessions = Annotated[tuple[Session, Session | None], Depends(get_branch_sessions)]
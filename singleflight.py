@@ -0,0 +1,68 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from metrics import metrics
+from timeouts import ClientDisconnected
+
+class Flight:
+    __slots__ = ("outcome", "waiters")
+
+    def __init__(self):
+        # Not tied to an event loop, so requests on any loop can wait on it.
+        self.outcome = Future()
+        self.waiters = 0
+
+class SingleFlight:
+    # Concurrent calls with the same key share one run: the first caller
+    # awaits produce() while the others wait for its result (or exception)
+    # on the event loop, holding no worker thread, connection or
+    # concurrency slot. Nothing is kept once the call returns, so later
+    # calls run again.
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def waiting(self, key) -> int:
+        with self._lock:
+            flight = self._flights.get(key)
+            return flight.waiters if flight is not None else 0
+
+    async def do(self, key, produce):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+            else:
+                flight.waiters += 1
+        if not leader:
+            metrics.increment("single_flight.coalesced")
+            # Shielded: a waiter that goes away must not cancel the flight.
+            try:
+                return await asyncio.shield(asyncio.wrap_future(flight.outcome))
+            except ClientDisconnected:
+                # The leader's client went away and its read was cancelled;
+                # that is no answer for this caller, so run it again.
+                metrics.increment("single_flight.retries")
+                return await self.do(key, produce)
+        metrics.increment("single_flight.flights")
+        try:
+            result = await produce()
+        except asyncio.CancelledError:
+            self._land(key, flight, error=ClientDisconnected())
+            raise
+        except Exception as error:
+            self._land(key, flight, error=error)
+            raise
+        self._land(key, flight, result=result)
+        return result
+
+    def _land(self, key, flight:Flight, result=None, error=None):
+        with self._lock:
+            del self._flights[key]
+        if error is not None:
+            flight.outcome.set_exception(error)
+        else:
+            flight.outcome.set_result(result)
+
+single_flight = SingleFlight()
@@ -0,0 +1,88 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from admission import BorrowAdmission, ConcurrencyLimiter
+from metrics import metrics
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_user_rate_limit():
+    clock = FakeClock()
+    admission = BorrowAdmission(user_rate=0.5, user_burst=2, book_max_in_flight=10, clock=clock)
+    for _ in range(2):
+        admission.acquire(1, 1)
+        admission.release(1)
+    with pytest.raises(HTTPException) as err:
+        admission.acquire(1, 1)
+    assert err.value.status_code == 429
+    assert err.value.headers["Retry-After"] == "2"
+    admission.acquire(2, 1)
+    clock.now = 2.0
+    admission.acquire(1, 1)
+
+def test_book_in_flight_limit():
+    admission = BorrowAdmission(user_rate=100, user_burst=100, book_max_in_flight=2)
+    rejected = metrics.get("admission.borrow.rejected_book_in_flight")
+    admission.acquire(1, 7)
+    admission.acquire(2, 7)
+    assert admission.in_flight() == 2
+    with pytest.raises(HTTPException) as err:
+        admission.acquire(3, 7)
+    assert err.value.headers["Retry-After"] == "1"
+    assert metrics.get("admission.borrow.rejected_book_in_flight") == rejected + 1
+    admission.acquire(3, 8)
+    admission.release(7)
+    admission.acquire(3, 7)
+
+def test_concurrency_limiter_queues_in_order():
+    async def scenario():
+        limiter = ConcurrencyLimiter(limit=1, max_waiting=2)
+        order = []
+
+        async def request(name):
+            await limiter.acquire()
+            order.append(name)
+            await asyncio.sleep(0)
+            limiter.release()
+
+        await limiter.acquire()
+        tasks = [asyncio.create_task(request(name)) for name in ("a", "b")]
+        await asyncio.sleep(0)
+        assert (limiter.active, limiter.waiting()) == (1, 2)
+        rejected = metrics.get("db_concurrency.rejected")
+        with pytest.raises(HTTPException) as err:
+            await limiter.acquire()
+        assert err.value.status_code == 503
+        assert metrics.get("db_concurrency.rejected") == rejected + 1
+        limiter.release()
+        await asyncio.gather(*tasks)
+        assert order == ["a", "b"]
+        assert (limiter.active, limiter.waiting()) == (0, 0)
+
+    asyncio.run(scenario())
+
+def test_concurrency_limiter_cancelled_waiter():
+    async def scenario():
+        limiter = ConcurrencyLimiter(limit=1, max_waiting=2)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter.waiting() == 0
+        # Handed the slot, then cancelled before it could run.
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert (limiter.active, limiter.waiting()) == (0, 0)
+
+    asyncio.run(scenario())
@@ -0,0 +1,66 @@
+import threading
+import time
+from autocomplete import MAX_SUGGESTION_BOOKS, PrefixIndex
+
+ROWS = [
+    (1, "The Hobbit", "J. R. R. Tolkien"),
+    (2, "The Silmarillion", "J. R. R. Tolkien"),
+    (3, "Thinking,  Fast and Slow", "Daniel Kahneman"),
+    ]
+
+def make_index(rows=ROWS):
+    index = PrefixIndex()
+    index.rebuild(rows)
+    return index
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_search_matches_titles_and_authors_by_prefix():
+    index = make_index()
+    assert index.search("the", 10) == [("The Hobbit", "title", [1]), ("The Silmarillion", "title", [2])]
+    assert index.search("  THINKING, fast", 10) == [("Thinking,  Fast and Slow", "title", [3])]
+    # An author is suggested once, with all of their books.
+    assert index.search("j. r", 10) == [("J. R. R. Tolkien", "author", [1, 2])]
+    assert index.search("th", 2) == [("The Hobbit", "title", [1]), ("The Silmarillion", "title", [2])]
+    assert index.search("x", 10) == []
+
+def test_refresh_applies_changed_books_only():
+    index = make_index()
+    index.invalidate("loan", 1)
+    index.invalidate("book", 1)
+    index.invalidate("book", 3)
+    # Book 1 was renamed and book 3 deleted.
+    index.refresh(lambda book_ids: [(1, "There and Back Again", "J. R. R. Tolkien")] if sorted(book_ids) == [1, 3] else [])
+    assert index.search("th", 10) == [("The Silmarillion", "title", [2]), ("There and Back Again", "title", [1])]
+    assert index.search("d", 10) == []
+
+def test_full_load_runs_in_background_and_old_index_keeps_serving():
+    index = make_index(ROWS[:1])
+    release = threading.Event()
+    loads = []
+
+    def load_all():
+        loads.append(threading.current_thread().name)
+        release.wait(5)
+        return ROWS
+
+    index.start(load_all)
+    wait_for(lambda: loads)
+    assert loads == ["autocomplete-load"]
+    # Searches answer from the old index while the load is running.
+    assert index.search("th", 10) == [("The Hobbit", "title", [1])]
+    # A book changed during the load is read again after it.
+    index.invalidate("book", 3)
+    release.set()
+    wait_for(lambda: index.search("d", 10))
+    index.refresh(lambda book_ids: [(3, "Thinking, Fast and Slow", "D. Kahneman")])
+    assert index.search("d", 10) == [("D. Kahneman", "author", [3])]
+    index.stop()
+
+def test_suggestion_book_ids_are_capped():
+    index = make_index([(book_id, f"Volume {book_id}", "Prolific") for book_id in range(100, 0, -1)])
+    assert index.search("prolific", 10) == [("Prolific", "author", list(range(1, MAX_SUGGESTION_BOOKS + 1)))]
@@ -0,0 +1,99 @@
+import threading
+import pytest
+from fastapi import HTTPException
+from batching import BorrowCoalescer
+from config import Settings
+from main import create_app
+
+def test_concurrent_borrows_share_one_batch():
+    batches = []
+
+    def borrow_batch(session, book_id, user_ids):
+        batches.append((book_id, list(user_ids)))
+        return [HTTPException(status_code=412) if user_id == 3 else f"loan-{user_id}" for user_id in user_ids]
+
+    coalescer = BorrowCoalescer(window_seconds=0.2, max_batch=10, borrow_batch=borrow_batch)
+    results = {}
+
+    def borrow(user_id):
+        try:
+            results[user_id] = coalescer.borrow(None, 7, user_id)
+        except HTTPException as error:
+            results[user_id] = error.status_code
+
+    threads = [threading.Thread(target=borrow, args=(user_id,)) for user_id in range(1, 6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(batches) == 1
+    assert sorted(batches[0][1]) == [1, 2, 3, 4, 5]
+    assert results == {1: "loan-1", 2: "loan-2", 3: 412, 4: "loan-4", 5: "loan-5"}
+
+def test_full_batch_starts_a_new_one():
+    batches = []
+
+    def borrow_batch(session, book_id, user_ids):
+        batches.append(list(user_ids))
+        return user_ids
+
+    coalescer = BorrowCoalescer(window_seconds=0.2, max_batch=2, borrow_batch=borrow_batch)
+    threads = [threading.Thread(target=coalescer.borrow, args=(None, 1, user_id)) for user_id in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(len(batch) for batch in batches) == [2, 2]
+
+def test_failed_batch_fails_every_request():
+    def borrow_batch(session, book_id, user_ids):
+        raise HTTPException(status_code=404, detail="Book not found.")
+
+    coalescer = BorrowCoalescer(window_seconds=0, max_batch=10, borrow_batch=borrow_batch)
+    with pytest.raises(HTTPException) as err:
+        coalescer.borrow(None, 1, 1)
+    assert err.value.status_code == 404
+
+def test_book_in_flight_cap_counts_batches():
+    app = create_app(Settings(
+        sqlalchemy_database_url="postgresql://localhost/library",
+        borrow_batch_window_ms=200,
+        borrow_book_max_in_flight=1,
+        borrow_batch_max_size=4,
+        change_listener_enabled=False
+        ))
+    admission, coalescer = app.state.borrow_admission, app.state.borrow_coalescer
+    batches = []
+    running = threading.Event()
+    release = threading.Event()
+
+    def borrow_batch(session, book_id, user_ids):
+        batches.append(list(user_ids))
+        running.set()
+        release.wait()
+        return [f"loan-{user_id}" for user_id in user_ids]
+
+    coalescer._borrow_batch = borrow_batch
+    results = {}
+
+    def borrow(user_id):
+        # As the borrow_admission dependency does when coalescing is on.
+        admission.acquire(user_id, 7, book_slot=False)
+        try:
+            results[user_id] = coalescer.borrow(None, 7, user_id)
+        except HTTPException as error:
+            results[user_id] = error.status_code
+
+    threads = [threading.Thread(target=borrow, args=(user_id,)) for user_id in range(1, 5)]
+    for thread in threads:
+        thread.start()
+    assert running.wait(5)
+    # One batch holds the book's only slot, so a new batch is turned away.
+    assert admission.in_flight() == 1
+    borrow(5)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == {**{user_id: f"loan-{user_id}" for user_id in range(1, 5)}, 5: 429}
+    assert [sorted(batch) for batch in batches] == [[1, 2, 3, 4]]
+    assert admission.in_flight() == 0
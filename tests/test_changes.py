@@ -0,0 +1,102 @@
+import time
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlmodel import SQLModel, Session, create_engine, select
+import changes
+from cache import collection_versions
+from crud import CHANGE_FEED
+from changes import ChangeBus, ChangeListener, parse_payload, prune_change_events, record_changes
+from models import Book, ChangeEvent, User
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'changes.db'}")
+    SQLModel.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+def make_book(isbn:str):
+    return Book(title="t", author="a", isbn=isbn, publication_year=2000, total_copies=1, available_copies=1)
+
+def remote_change(engine, entity:str, entity_id:int | None):
+    # A change committed by another API process.
+    with Session(engine) as session:
+        session.add(ChangeEvent(entity=entity, entity_id=entity_id, origin="other-node"))
+        session.commit()
+
+def test_changes_written_on_commit(engine):
+    before = collection_versions.get("books", "users")
+    with Session(engine) as session:
+        book = make_book("a")
+        session.add(book)
+        record_changes(session, book, book, ("user", None, "update"))
+        session.commit()
+        book_id = book.id
+        events = session.exec(select(ChangeEvent)).all()
+    assert [(event.entity, event.entity_id, event.operation, event.origin) for event in events] == [
+        ("book", book_id, "insert", changes.NODE_ID),
+        ("user", None, "update", changes.NODE_ID)
+        ]
+    assert collection_versions.get("books", "users") == (before[0] + 1, before[1] + 1)
+
+def test_rolled_back_changes_are_dropped(engine):
+    before = collection_versions.get("books")
+    with Session(engine) as session:
+        book = make_book("a")
+        session.add(book)
+        record_changes(session, book)
+        session.rollback()
+        session.commit()
+        assert session.exec(select(ChangeEvent)).all() == []
+    assert collection_versions.get("books") == before
+
+def test_listener_applies_remote_changes_only(engine):
+    bus = ChangeBus()
+    received = []
+    bus.subscribe(lambda entity, entity_id: received.append((entity, entity_id)))
+    remote_change(engine, "book", 1)
+    listener = ChangeListener(engine, bus=bus)
+    # Changes from before the listener started are skipped.
+    assert listener.poll() == 0
+
+    with Session(engine) as session:
+        user = User(name="n", email="e")
+        session.add(user)
+        record_changes(session, user)
+        session.commit()
+    remote_change(engine, "book", 2)
+    remote_change(engine, "loan", None)
+    before = collection_versions.get("books", "users", "loans")
+    assert listener.poll() == 2
+    assert received == [("book", 2), ("loan", None)]
+    assert collection_versions.get("books", "users", "loans") == (before[0] + 1, before[1], before[2] + 1)
+    assert listener.poll() == 0
+
+def test_listener_thread_invalidates_quickly(engine):
+    listener = ChangeListener(engine, poll_interval=0.01)
+    listener.start()
+    try:
+        while listener.last_id is None:
+            time.sleep(0.005)
+        before = collection_versions.get("books")
+        remote_change(engine, "book", 7)
+        deadline = time.monotonic() + 2
+        while collection_versions.get("books") == before and time.monotonic() < deadline:
+            time.sleep(0.005)
+        assert collection_versions.get("books") == (before[0] + 1,)
+    finally:
+        listener.stop()
+
+def test_parse_payload():
+    assert parse_payload("12:book:4:abc") == (12, "book", 4, "abc")
+    assert parse_payload("13:loan::abc") == (13, "loan", None, "abc")
+
+def test_prune_change_events(engine):
+    remote_change(engine, "book", 1)
+    with Session(engine) as session:
+        assert prune_change_events(session, 1) == {"deleted": 0}
+        assert prune_change_events(session, -1) == {"deleted": 1}
+
+def test_change_times_come_from_the_database_clock():
+    assert "clock_timestamp()" in str(changes.RECORD_CHANGES.compile(dialect=postgresql.dialect()))
+    assert "clock_timestamp() - make_interval(secs =>" in str(CHANGE_FEED.compile(dialect=postgresql.dialect()))
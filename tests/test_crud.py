@@ -5,6 +5,10 @@ from models import *
 from crud import *
 from schemas import *
 import sqlalchemy.exc as exc
+from sqlalchemy import event, literal_column
+from database import compiled_cache_hit_rate, instrument_engine, record_compiled_cache
+from metrics import metrics
+from autocomplete import book_suggestions
 
 # Fixtures and config
 
@@ -28,7 +32,7 @@ def test_session(make_test_engine):
     connection = make_test_engine.connect()
     transaction = connection.begin()
 
-    session = Session(bind=connection)
+    session = Session(bind=connection, expire_on_commit=False)
     yield session
 
     session.close()
@@ -174,4 +178,424 @@ def test_get_loan_logic(test_session, loan_init):
     assert loan.id == 1
     assert loan.book_id == 1
     assert loan.user_id == 1
-    assert loan.status == 'borrowed'
\ No newline at end of file
+    assert loan.status == 'borrowed'
+
+@pytest.fixture
+def hold_book_init(test_session, user_init):
+    book = Book(
+        title="hold_title",
+        author="hold_author",
+        isbn="hold_isbn",
+        publication_year=2001,
+        total_copies=1,
+        available_copies=0
+        )
+    test_session.add(book)
+    test_session.commit()
+    loan = Loan(
+            book_id=book.id,
+            user_id=user_init.id,
+            borrow_date=datetime.now(timezone.utc),
+            due_date=datetime.now(timezone.utc)+timedelta(days=14),
+            return_date=None
+            )
+    test_session.add(loan)
+    test_session.commit()
+    # The logic functions open their own transaction, so hand out plain ids
+    # instead of expired instances that would autobegin one on access.
+    book_id, loan_id = book.id, loan.id
+    test_session.commit()
+    return book_id, loan_id
+
+def make_user(test_session, name):
+    user = User(name=name, email=f"{name}_email")
+    test_session.add(user)
+    test_session.commit()
+    user_id = user.id
+    test_session.commit()
+    return user_id
+
+def test_place_hold_logic(test_session, hold_book_init):
+    book_id, _ = hold_book_init
+    user_id = make_user(test_session, "hold_user")
+    hold = place_hold_logic(test_session, book_id, user_id)
+    assert hold.id is not None
+    assert hold.book_id == book_id
+    assert hold.user_id == user_id
+    assert hold.status == "waiting"
+    assert hold.loan_id is None
+
+def test_place_hold_logic_available_book(test_session, book_init, user_init):
+    book_id, user_id = book_init.id, user_init.id
+    test_session.commit()
+    with pytest.raises(HTTPException) as err:
+        place_hold_logic(test_session, book_id, user_id)
+    assert err.value.status_code == 412
+
+def test_place_hold_logic_duplicate(test_session, hold_book_init):
+    book_id, _ = hold_book_init
+    user_id = make_user(test_session, "hold_user")
+    place_hold_logic(test_session, book_id, user_id)
+    test_session.commit()
+    with pytest.raises(HTTPException) as err:
+        place_hold_logic(test_session, book_id, user_id)
+    assert err.value.status_code == 412
+
+def test_return_book_logic_allocates_oldest_hold(test_session, hold_book_init):
+    book_id, loan_id = hold_book_init
+    first_id = make_user(test_session, "first_user")
+    second_id = make_user(test_session, "second_user")
+    first_hold_id = place_hold_logic(test_session, book_id, first_id).id
+    test_session.commit()
+    second_hold_id = place_hold_logic(test_session, book_id, second_id).id
+    test_session.commit()
+
+    returned = return_book_logic(test_session, loan_id)
+    assert returned.status == "returned"
+    first_hold = get_hold_logic(test_session, first_hold_id)
+    assert get_book_logic(test_session, book_id).available_copies == 0
+    assert first_hold.status == "fulfilled"
+    assert first_hold.loan_id is not None
+    assert get_hold_logic(test_session, second_hold_id).status == "waiting"
+    allocated = get_loan_logic(test_session, first_hold.loan_id)
+    assert allocated.user_id == first_id
+    assert allocated.status == "borrowed"
+    assert [hold.id for hold in get_book_holds_logic(test_session, book_id)] == [second_hold_id]
+
+def test_return_book_logic_without_holds(test_session, hold_book_init):
+    book_id, loan_id = hold_book_init
+    return_book_logic(test_session, loan_id)
+    assert get_book_logic(test_session, book_id).available_copies == 1
+
+def test_cancel_hold_logic(test_session, hold_book_init):
+    book_id, loan_id = hold_book_init
+    user_id = make_user(test_session, "hold_user")
+    hold_id = place_hold_logic(test_session, book_id, user_id).id
+    test_session.commit()
+    cancelled = cancel_hold_logic(test_session, hold_id)
+    assert cancelled.status == "cancelled"
+    test_session.commit()
+    return_book_logic(test_session, loan_id)
+    assert get_book_logic(test_session, book_id).available_copies == 1
+
+def make_returned_loan(test_session, book_id, user_id, days_ago):
+    returned = datetime.now(timezone.utc) - timedelta(days=days_ago)
+    loan = Loan(
+            book_id=book_id,
+            user_id=user_id,
+            borrow_date=returned - timedelta(days=7),
+            due_date=returned + timedelta(days=7),
+            return_date=returned,
+            status="returned"
+            )
+    test_session.add(loan)
+    test_session.commit()
+    loan_id = loan.id
+    test_session.commit()
+    return loan_id
+
+def test_archive_loans_logic(test_session, loan_init):
+    book_id, user_id, active_id = loan_init.book_id, loan_init.user_id, loan_init.id
+    old_ids = [make_returned_loan(test_session, book_id, user_id, 200) for _ in range(3)]
+    recent_id = make_returned_loan(test_session, book_id, user_id, 1)
+
+    result = archive_loans_logic(test_session, older_than_days=90, batch_size=2)
+    assert result == {"archived": 3, "batches": 2, "has_more": False}
+    assert {loan.id for loan in get_loans_logic(test_session)} == {active_id, recent_id}
+    archived = get_loan_logic(test_session, old_ids[0], include_archived=True)
+    assert type(archived) == LoanArchive
+    assert archived.status == "returned"
+    with pytest.raises(HTTPException):
+        get_loan_logic(test_session, old_ids[0])
+
+def test_archive_loans_logic_stops_after_max_batches(test_session, loan_init):
+    book_id, user_id = loan_init.book_id, loan_init.user_id
+    for _ in range(5):
+        make_returned_loan(test_session, book_id, user_id, 200)
+    assert archive_loans_logic(test_session, older_than_days=90, batch_size=2, max_batches=2) == {"archived": 4, "batches": 2, "has_more": True}
+    assert archive_loans_logic(test_session, older_than_days=90, batch_size=2, max_batches=2) == {"archived": 1, "batches": 1, "has_more": False}
+
+def test_archived_loan_ids_are_not_reused(test_session, loan_init):
+    book_id, user_id = loan_init.book_id, loan_init.user_id
+    newest_id = make_returned_loan(test_session, book_id, user_id, 200)
+    archive_loans_logic(test_session, older_than_days=90)
+    assert make_returned_loan(test_session, book_id, user_id, 1) > newest_id
+
+def test_get_loans_logic_with_history(test_session, loan_init):
+    book_id, user_id, active_id = loan_init.book_id, loan_init.user_id, loan_init.id
+    old_id = make_returned_loan(test_session, book_id, user_id, 200)
+    archive_loans_logic(test_session, older_than_days=90)
+
+    history = get_loans_logic(test_session, include_archived=True)
+    assert [loan.id for loan in history] == sorted([active_id, old_id])
+    assert [loan.id for loan in get_loans_logic(test_session, limit=1, offset=1, include_archived=True)] == [max(active_id, old_id)]
+    user_history = get_user_loans_logic(test_session, user_id, include_archived=True)
+    assert len(user_history) == 2
+    assert [loan.id for loan in get_user_loans_logic(test_session, user_id)] == [active_id]
+
+def test_get_books_batch_logic(test_session, book_init):
+    book_id = book_init.id
+    books = get_books_batch_logic(test_session, ids=[999, book_id, book_id])
+    assert books[0] is None
+    assert books[1].id == book_id
+    assert books[2].id == book_id
+    books = get_books_batch_logic(test_session, isbns=["test_isbn", "missing_isbn"])
+    assert books[0].id == book_id
+    assert books[1] is None
+
+def test_parse_batch_keys():
+    assert parse_batch_keys("3, 1,2", int) == [3, 1, 2]
+    with pytest.raises(HTTPException) as err:
+        parse_batch_keys("1,a", int)
+    assert err.value.status_code == 422
+    with pytest.raises(HTTPException):
+        parse_batch_keys(",".join(str(i) for i in range(MAX_BATCH_SIZE + 1)), int)
+
+def test_sharded_inventory(test_session, book_init, user_init):
+    book_id, user_id = book_init.id, user_init.id
+    test_session.commit()
+    book = shard_book_inventory_logic(test_session, book_id, 4)
+    assert book.inventory_shards == 4
+    assert book.available_copies is None
+    assert sorted(slot.available_copies for slot in book.inventory) == [2, 2, 3, 3]
+    assert BookPublic.model_validate(book).available_copies == 10
+    test_session.commit()
+
+    loan_ids = []
+    for _ in range(10):
+        loan_ids.append(borrow_book_logic(test_session, book_id, user_id).id)
+        test_session.commit()
+    assert get_available_copies(test_session, get_book_logic(test_session, book_id)) == 0
+    test_session.commit()
+
+    return_book_logic(test_session, loan_ids[0])
+    test_session.commit()
+    book = get_book_logic(test_session, book_id)
+    assert BookPublic.model_validate(book).available_copies == 1
+    test_session.commit()
+
+    book = shard_book_inventory_logic(test_session, book_id, 0)
+    assert book.inventory_shards == 0
+    assert book.available_copies == 1
+    assert book.inventory == []
+
+def test_sharded_inventory_exhausted(test_session, book_init, user_init):
+    book_id, user_id = book_init.id, user_init.id
+    test_session.commit()
+    shard_book_inventory_logic(test_session, book_id, 16)
+    test_session.commit()
+    for _ in range(10):
+        borrow_book_logic(test_session, book_id, user_id)
+        test_session.commit()
+    with pytest.raises(HTTPException) as err:
+        borrow_book_logic(test_session, book_id, user_id)
+    assert err.value.status_code == 412
+
+def test_borrow_books_batch_logic(test_session, user_init):
+    book = Book(
+        title="batch_title",
+        author="batch_author",
+        isbn="batch_isbn",
+        publication_year=2001,
+        total_copies=2,
+        available_copies=2
+        )
+    test_session.add(book)
+    test_session.commit()
+    book_id, user_id = book.id, user_init.id
+    test_session.commit()
+    results = borrow_books_batch_logic(test_session, book_id, [user_id, 999, user_id, user_id])
+    assert type(results[0]) == LoanPublic
+    assert results[0].book.id == book_id
+    assert results[0].user.id == user_id
+    assert results[1].status_code == 404
+    assert type(results[2]) == LoanPublic
+    assert results[2].id != results[0].id
+    assert results[3].status_code == 412
+    assert get_book_logic(test_session, book_id).available_copies == 0
+
+def test_reconcile_inventory_logic(test_session, loan_init):
+    book_id = loan_init.book_id
+    test_session.commit()
+    result = reconcile_inventory_logic(test_session)
+    assert result["mismatches"] == [{
+        "id": book_id,
+        "total_copies": 10,
+        "active_loans": 1,
+        "available_copies": 10,
+        "expected_copies": 9
+        }]
+    assert result["repaired"] == 0
+
+    result = reconcile_inventory_logic(test_session, repair=True, batch_size=1)
+    assert result["repaired"] == 1
+    assert get_book_logic(test_session, book_id).available_copies == 9
+    assert reconcile_inventory_logic(test_session)["mismatches"] == []
+
+def test_reconcile_inventory_logic_sharded(test_session, loan_init):
+    book_id = loan_init.book_id
+    test_session.commit()
+    shard_book_inventory_logic(test_session, book_id, 3)
+    test_session.commit()
+    assert reconcile_inventory_logic(test_session)["mismatches"][0]["available_copies"] == 10
+    reconcile_inventory_logic(test_session, repair=True)
+    book = get_book_logic(test_session, book_id)
+    assert BookPublic.model_validate(book).available_copies == 9
+
+def test_reconcile_repair_serves_waiting_holds(test_session, book_init, user_init):
+    book_id, user_id = book_init.id, user_init.id
+    # Copies that went missing from the count leave a hold waiting.
+    book_init.available_copies = 0
+    test_session.add(Hold(book_id=book_id, user_id=user_id, created_at=datetime.now(timezone.utc)))
+    test_session.commit()
+    assert reconcile_inventory_logic(test_session, repair=True)["repaired"] == 1
+    assert get_book_holds_logic(test_session, book_id) == []
+    loans = get_user_loans_logic(test_session, user_id)
+    assert [loan.book_id for loan in loans] == [book_id]
+    assert get_book_logic(test_session, book_id).available_copies == 9
+    assert reconcile_inventory_logic(test_session)["mismatches"] == []
+
+def test_branch_stock_and_loans(test_session, book_init, user_init):
+    book_id, user_id = book_init.id, user_init.id
+    test_session.commit()
+    stock = set_branch_stock_logic(test_session, book_id, "north", 2)
+    assert (stock.total_copies, stock.available_copies) == (2, 2)
+    loan = borrow_from_branch_logic(test_session, "north", book_id, user_id)
+    loan_id = loan.id
+    assert loan.branch == "north"
+    assert test_session.get(BranchStock, (book_id, "north")).available_copies == 1
+    # Branch loans leave the main library's stock alone.
+    assert get_book_logic(test_session, book_id).available_copies == 10
+    assert reconcile_inventory_logic(test_session)["mismatches"] == []
+    test_session.commit()
+    assert set_branch_stock_logic(test_session, book_id, "north", 4).available_copies == 3
+    loan = return_branch_loan_logic(test_session, "north", loan_id)
+    assert loan.status == LoanStatus.RETURNED
+    assert test_session.get(BranchStock, (book_id, "north")).available_copies == 4
+    test_session.commit()
+    with pytest.raises(HTTPException) as e:
+        return_book_logic(test_session, loan_id)
+    assert e.value.status_code == 404
+
+def test_borrow_from_branch_not_stocked(test_session, book_init, user_init):
+    book_id, user_id = book_init.id, user_init.id
+    test_session.commit()
+    with pytest.raises(HTTPException) as e:
+        borrow_from_branch_logic(test_session, "south", book_id, user_id)
+    assert e.value.detail == "This branch does not stock this book."
+
+def test_related_books(test_session):
+    books = [Book(title=f"b{i}", author="a", isbn=f"related-{i}", publication_year=2000, total_copies=5, available_copies=5) for i in range(3)]
+    users = [User(name=f"u{i}", email=f"related-{i}") for i in range(3)]
+    test_session.add_all(books + users)
+    test_session.commit()
+    b, u = [book.id for book in books], [user.id for user in users]
+    # A repeat borrow (u2 and b0) does not count twice.
+    for user, book in [(0, 0), (0, 1), (1, 0), (0, 2), (1, 1), (2, 0), (2, 0)]:
+        borrow_book_logic(test_session, b[book], u[user])
+        test_session.commit()
+    borrow_books_batch_logic(test_session, b[1], [u[2]])
+    test_session.commit()
+    # Fresh loans wait for the settle time; the rest is counted in batches
+    # that carry on where the last run stopped.
+    assert count_cooccurrences_logic(test_session) == {"counted": 0, "batches": 0}
+    assert count_cooccurrences_logic(test_session, batch_size=5, max_batches=1, settle_seconds=0) == {"counted": 5, "batches": 1}
+    assert count_cooccurrences_logic(test_session, batch_size=5, settle_seconds=0) == {"counted": 3, "batches": 1}
+
+    related = lambda book: [(entry.book.id, entry.borrowers) for entry in get_related_books_logic(test_session, b[book])]
+    assert related(0) == [(b[1], 3), (b[2], 1)]
+    assert related(2) == [(b[1], 1), (b[0], 1)]
+    pairs = lambda: sorted(tuple(row) for row in test_session.exec(select(BookCooccurrence.book_id, BookCooccurrence.related_book_id, BookCooccurrence.borrowers)))
+    incremental = pairs()
+    test_session.commit()
+    assert rebuild_cooccurrence_logic(test_session) == {"pairs": 6}
+    assert pairs() == incremental
+    test_session.commit()
+    assert count_cooccurrences_logic(test_session, settle_seconds=0) == {"counted": 0, "batches": 0}
+    with pytest.raises(HTTPException) as e:
+        get_related_books_logic(test_session, -1)
+    assert e.value.status_code == 404
+
+def test_loan_status_stored_as_code(test_session, book_init, user_init):
+    book_id, user_id = book_init.id, user_init.id
+    test_session.commit()
+    loan_id = borrow_book_logic(test_session, book_id, user_id).id
+    stored = lambda: test_session.exec(select(literal_column("status")).select_from(Loan).where(Loan.id == loan_id)).one()
+    assert stored() == LOAN_STATUS_CODES[LoanStatus.BORROWED]
+    test_session.commit()
+    loan = return_book_logic(test_session, loan_id)
+    assert loan.status == LoanStatus.RETURNED
+    assert stored() == LOAN_STATUS_CODES[LoanStatus.RETURNED]
+    assert LoanPublic.model_validate(loan).model_dump(mode="json")["status"] == "returned"
+
+def test_active_loan_queries_use_partial_index(test_session, loan_init):
+    query = select(func.count()).select_from(Loan).where(Loan.book_id == loan_init.book_id, LOAN_IS_ACTIVE)
+    compiled = query.compile(dialect=test_session.get_bind().dialect, compile_kwargs={"render_postcompile": True})
+    # SQLite refuses INDEXED BY when the WHERE clause does not imply the index predicate.
+    forced = str(compiled).replace("FROM loan", "FROM loan INDEXED BY ix_loan_active_book_id")
+    assert test_session.connection().exec_driver_sql(forced, tuple(compiled.params.values())).scalar() == 1
+    assert test_session.exec(query).one() == 1
+
+def test_hot_statements_hit_compiled_cache(make_test_engine, test_session, book_init, user_init):
+    book_id, user_id = book_init.id, user_init.id
+    test_session.commit()
+    instrument_engine(make_test_engine)
+    try:
+        get_books_logic(test_session, 0, 10)
+        get_user_loans_logic(test_session, user_id, 0, 10)
+        hits, misses = metrics.get("sql.compiled_cache.hits"), metrics.get("sql.compiled_cache.misses")
+        get_books_logic(test_session, 5, 20)
+        get_user_loans_logic(test_session, user_id, 10, 5)
+        assert metrics.get("sql.compiled_cache.misses") == misses
+        assert metrics.get("sql.compiled_cache.hits") >= hits + 2
+    finally:
+        event.remove(make_test_engine, "after_cursor_execute", record_compiled_cache)
+    assert 0 < compiled_cache_hit_rate() <= 1
+
+def test_change_feed(test_session, loan_init):
+    since = get_changes_logic(test_session, 0, 1000).next
+    book = create_book_logic(test_session, BookCreate(title="t", author="a", isbn="feed", publication_year=2000, total_copies=1))
+    update_book_logic(test_session, book.id, BookCreate(title="t2", author="a", isbn="feed", publication_year=2000, total_copies=2))
+    delete_book_logic(test_session, book.id)
+    loan_init.status = LoanStatus.RETURNED
+    loan_init.return_date = datetime.now(timezone.utc) - timedelta(days=400)
+    test_session.commit()
+    archive_loans_logic(test_session, older_than_days=365)
+    feed = get_changes_logic(test_session, since, 3)
+    assert [(change.entity, change.entity_id, change.operation) for change in feed.changes] == [
+        ("book", book.id, "insert"), ("book", book.id, "update"), ("book", book.id, "delete")
+        ]
+    assert feed.has_more
+    feed = get_changes_logic(test_session, feed.next, 3)
+    assert [(change.entity, change.operation) for change in feed.changes] == [("loan", "archive")]
+    assert (feed.next, feed.has_more) == (since + 4, False)
+
+def test_change_feed_waits_on_gaps(test_session):
+    since = get_changes_logic(test_session, 0, 1000).next
+    now = datetime.now(timezone.utc)
+    test_session.add_all([
+        ChangeEvent(id=since + 1, entity="book", entity_id=1, origin="test"),
+        ChangeEvent(id=since + 3, entity="book", entity_id=3, origin="test", created_at=now - timedelta(seconds=2)),
+        ])
+    test_session.commit()
+    # since + 2 may still be committed by another transaction.
+    feed = get_changes_logic(test_session, since, 10)
+    assert ([change.version for change in feed.changes], feed.has_more) == ([since + 1], True)
+    # Once the later change is older than the settle time, the gap is skipped.
+    feed = get_changes_logic(test_session, since, 10, settle_seconds=1)
+    assert [change.version for change in feed.changes] == [since + 1, since + 3]
+    test_session.exec(delete(ChangeEvent).where(ChangeEvent.id <= since + 1))
+    test_session.commit()
+    # A cursor that was not followed up before its changes were pruned.
+    with pytest.raises(HTTPException) as e:
+        get_changes_logic(test_session, since + 1, 10)
+    assert e.value.status_code == 410
+
+def test_autocomplete_books(test_session, book_init):
+    book_suggestions.rebuild(test_session.exec(SUGGESTION_ROWS).all())
+    assert autocomplete_books_logic(test_session, "TEST_T") == [BookSuggestion(text="test_title", field="title", book_ids=[book_init.id])]
+    book = create_book_logic(test_session, BookCreate(title="Test Pilot", author="b", isbn="suggest", publication_year=2000, total_copies=1))
+    assert [suggestion.text for suggestion in autocomplete_books_logic(test_session, "test")] == ["Test Pilot", "test_author", "test_title"]
+    delete_book_logic(test_session, book.id)
+    assert [suggestion.text for suggestion in autocomplete_books_logic(test_session, "test", limit=2)] == ["test_author", "test_title"]
+    book_suggestions.reset()
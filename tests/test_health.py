@@ -0,0 +1,92 @@
+import threading
+import time
+import pytest
+from fastapi.testclient import TestClient
+import database
+from config import Settings
+from database import get_engine
+from main import create_app
+
+@pytest.fixture
+def make_client(tmp_path):
+    urls = []
+
+    def make(**overrides):
+        url = f"sqlite:///{tmp_path / f'health{len(urls)}.db'}"
+        urls.append(url)
+        return TestClient(create_app(Settings(sqlalchemy_database_url=url, change_listener_enabled=False, **overrides)))
+
+    yield make
+    for url in urls:
+        engine = database._engines.pop(url, None)
+        if engine is not None:
+            engine.dispose()
+
+def test_live(make_client):
+    assert make_client().get("/health/live").json() == {"status": "ok"}
+
+def test_ready(make_client):
+    client = make_client()
+    response = client.get("/health/ready")
+    assert response.status_code == 200
+    report = response.json()
+    assert report["status"] == "ready" and report["reasons"] == []
+    assert report["db_latency_ms"] >= 0 and report["pool_usage"] == 0
+    # The probe is cached between checks.
+    probe = client.app.state.health.last_probe
+    client.get("/health/ready")
+    assert client.app.state.health.last_probe is probe
+
+def test_not_ready_when_database_is_slow(make_client):
+    response = make_client(health_max_db_latency_ms=-1).get("/health/ready")
+    assert response.status_code == 503
+    assert response.json()["reasons"] == ["Database round trip is too slow."]
+
+def test_not_ready_when_pool_is_saturated(make_client):
+    client = make_client(health_max_pool_usage=0.1)
+    engine = get_engine(client.app.state.settings)
+    held = [engine.connect() for _ in range(2)]
+    try:
+        response = client.get("/health/ready")
+        assert response.status_code == 503
+        assert response.json()["reasons"] == ["Connection pool is saturated."]
+        # Answered without probing the database.
+        assert client.app.state.health.last_probe is None
+    finally:
+        for connection in held:
+            connection.close()
+    assert client.get("/health/ready").status_code == 200
+
+def test_not_ready_with_too_many_requests_in_flight(make_client):
+    client = make_client(health_max_in_flight=0)
+    client.app.state.health.in_flight = 1
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert response.json()["in_flight"] == 1
+    assert client.app.state.health.last_probe is None
+    client.app.state.health.in_flight = 0
+    client.get("/metrics")
+    assert client.app.state.health.in_flight == 0
+
+def test_stale_probe_is_refreshed_in_the_background(make_client):
+    client = make_client(health_probe_interval_ms=0, health_probe_timeout_ms=100)
+    monitor = client.app.state.health
+    assert client.get("/health/ready").status_code == 200
+    release = threading.Event()
+    probe = monitor.probe
+    monitor.probe = lambda engine: release.wait(5) and probe(engine)
+    try:
+        # The check answers from the last probe while the new one hangs,
+        # until the hanging probe runs past its timeout.
+        started = time.perf_counter()
+        assert client.get("/health/ready").status_code == 200
+        assert time.perf_counter() - started < 0.5
+        time.sleep(0.15)
+        response = client.get("/health/ready")
+        assert response.status_code == 503
+        assert response.json()["reasons"] == ["Database probe timed out."]
+    finally:
+        release.set()
+    deadline = time.monotonic() + 5
+    while client.get("/health/ready").status_code != 200:
+        assert time.monotonic() < deadline
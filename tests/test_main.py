@@ -1,14 +1,17 @@
 from sqlmodel import create_engine, Session, SQLModel
 from sqlalchemy.pool import StaticPool
-from fastapi import Depends
+from contextlib import nullcontext
+from fastapi import Request
 import pytest
-from typing import Annotated
 from models import *
 from main import app
-from database import get_session
+from database import SharedReads, get_session, get_shared_reads, get_write_session
+from autocomplete import book_suggestions
+from crud import SUGGESTION_ROWS
 from fastapi.testclient import TestClient
 from schemas import *
 import sqlalchemy.exc as exc
+from sqlalchemy import event
 
 # Fixtures and config
 
@@ -32,7 +35,7 @@ def test_session(make_test_engine):
     connection = make_test_engine.connect()
     transaction = connection.begin()
 
-    session = Session(bind=connection)
+    session = Session(bind=connection, expire_on_commit=False)
     yield session
 
     session.close()
@@ -44,10 +47,37 @@ def client(test_session):
     def get_test_session():
         yield test_session
 
+    async def get_test_reads(request:Request):
+        return SharedReads(request, None, lambda: nullcontext(test_session))
+
     app.dependency_overrides[get_session] = get_test_session
+    app.dependency_overrides[get_write_session] = get_test_session
+    app.dependency_overrides[get_shared_reads] = get_test_reads
+    # Fixtures write straight to the session without bumping collection
+    # versions, so start every test with an empty response cache.
+    app.state.response_cache.clear()
+    app.state.borrow_admission.reset()
     yield TestClient(app)
     app.dependency_overrides.clear()
 
+@pytest.fixture
+def statements(make_test_engine):
+    # The first word of every SQL statement sent to the database.
+    executed = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        executed.append(statement.split(None, 1)[0].upper())
+
+    event.listen(make_test_engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(make_test_engine, "before_cursor_execute", record)
+
+def count_from_here(test_session, statements):
+    # Each request starts from an empty identity map, as with a session per request.
+    test_session.commit()
+    test_session.expunge_all()
+    statements.clear()
+
 @pytest.fixture
 def book_init(test_session):
     book = Book(
@@ -186,4 +216,228 @@ def test_get_loans(client, loan_init):
 #     initial_copies = book_init.available_copies
 #     with test_session.begin_nested():
 #         response = client.post(f"/books/{book_init.id}/borrow?user_id={user_init.id}")
-#         assert response.status_code == 200
\ No newline at end of file
+#         assert response.status_code == 200
+def test_place_hold(client, test_session, user_init):
+    book = Book(
+        title="hold_title",
+        author="hold_author",
+        isbn="hold_isbn",
+        publication_year=2001,
+        total_copies=1,
+        available_copies=0
+        )
+    test_session.add(book)
+    test_session.commit()
+    book_id, user_id = book.id, user_init.id
+    test_session.commit()
+    response = client.post(f"/books/{book_id}/hold?user_id={user_id}")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["status"] == "waiting"
+    assert data["loan_id"] is None
+    response = client.get(f"/books/{book_id}/holds")
+    assert response.status_code == 200
+    assert [hold["id"] for hold in response.json()] == [data["id"]]
+    test_session.commit()
+    response = client.post(f"/holds/{data['id']}/cancel")
+    assert response.status_code == 200
+    assert response.json()["status"] == "cancelled"
+
+def test_place_hold_available_book(client, test_session, book_init, user_init):
+    book_id, user_id = book_init.id, user_init.id
+    test_session.commit()
+    response = client.post(f"/books/{book_id}/hold?user_id={user_id}")
+    assert response.status_code == 412
+
+def test_availability_updates(client, test_session, book_init, user_init):
+    book_id, user_id = book_init.id, user_init.id
+    test_session.commit()
+    with client.websocket_connect("/ws/availability") as websocket:
+        websocket.send_json({"subscribe": [book_id]})
+        assert websocket.receive_json() == {"subscribed": [book_id]}
+        response = client.post(f"/books/{book_id}/borrow?user_id={user_id}")
+        assert response.status_code == 200
+        event = websocket.receive_json()
+        assert event["book_id"] == book_id
+        assert event["reason"] == "borrowed"
+        assert event["available_copies"] == book_init.total_copies - 1
+        websocket.send_json({"unsubscribe": [book_id]})
+        assert websocket.receive_json() == {"subscribed": []}
+
+def test_get_loans_include_archived(client, test_session, loan_init):
+    returned = datetime.now(timezone.utc) - timedelta(days=200)
+    old_loan = Loan(
+            book_id=loan_init.book_id,
+            user_id=loan_init.user_id,
+            borrow_date=returned - timedelta(days=7),
+            due_date=returned + timedelta(days=7),
+            return_date=returned,
+            status="returned"
+            )
+    test_session.add(old_loan)
+    test_session.commit()
+    old_id = old_loan.id
+    test_session.commit()
+    response = client.post("/admin/loans/archive?older_than_days=90")
+    assert response.status_code == 200
+    assert response.json()["archived"] == 1
+    assert len(client.get("/loans").json()) == 1
+    data = client.get("/loans?include_archived=true").json()
+    assert len(data) == 2
+    assert data[1]["id"] == old_id
+    assert data[1]["book"]["id"] == data[1]["book_id"]
+    assert client.get(f"/loans/{old_id}").status_code == 404
+    assert client.get(f"/loans/{old_id}?include_archived=true").status_code == 200
+    assert len(client.get(f"/users/{data[0]['user_id']}/loans?include_archived=true").json()) == 2
+
+def test_get_books_batch(client, book_init):
+    response = client.get("/books?ids=2,1")
+    assert response.status_code == 200
+    data = response.json()
+    assert data[0] is None
+    assert data[1]["id"] == 1
+    assert client.get("/books?isbn=test_isbn").json()[0]["isbn"] == "test_isbn"
+    assert client.get("/books?ids=1&isbn=test_isbn").status_code == 422
+
+def test_get_users_and_loans_batch(client, loan_init):
+    users = client.get("/users?email=nobody,test_email").json()
+    assert users[0] is None
+    assert users[1]["email"] == "test_email"
+    loans = client.get("/loans?ids=1,5").json()
+    assert loans[0]["id"] == 1
+    assert loans[1] is None
+
+def test_get_books_compressed_and_cached(client, test_session):
+    for i in range(10):
+        test_session.add(Book(
+            title=f"compress_title_{i}",
+            author="compress_author",
+            isbn=f"compress_isbn_{i}",
+            publication_year=2000,
+            total_copies=3,
+            available_copies=3
+            ))
+    test_session.commit()
+    response = client.get("/books", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.json()) == 10
+    assert app.state.response_cache.misses == 1
+    client.get("/books", headers={"Accept-Encoding": "gzip"})
+    assert app.state.response_cache.hits == 1
+    client.post("/books",
+                json={
+                    "title": "compress_new",
+                    "author": "compress_author",
+                    "isbn": "compress_new",
+                    "publication_year": 2000,
+                    "total_copies": 1
+                    })
+    response = client.get("/books", headers={"Accept-Encoding": "gzip"})
+    assert len(response.json()) == 11
+    assert app.state.response_cache.misses == 2
+
+def test_get_users_small_response_uncompressed(client, user_init):
+    response = client.get("/users", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.json()[0]["email"] == "test_email"
+
+def test_borrow_rate_limited(client, test_session, book_init, user_init):
+    book_id, user_id = book_init.id, user_init.id
+    test_session.commit()
+    admission = app.state.borrow_admission
+    burst = admission.user_burst
+    admission.user_burst = 1
+    try:
+        response = client.post(f"/books/{book_id}/borrow?user_id={user_id}")
+        assert response.status_code == 200
+        response = client.post(f"/books/{book_id}/borrow?user_id={user_id}")
+        assert response.status_code == 429
+        assert "retry-after" in response.headers
+    finally:
+        admission.user_burst = burst
+        admission.reset()
+    counters = client.get("/metrics").json()["counters"]
+    assert counters["admission.borrow.rejected_user_rate"] >= 1
+
+def test_get_related_books(client, test_session, book_init, user_init):
+    test_session.add(BookCooccurrence(book_id=book_init.id, related_book_id=book_init.id, borrowers=2))
+    test_session.commit()
+    response = client.get(f"/books/{book_init.id}/related?limit=1")
+    assert response.status_code == 200
+    assert response.json() == [{"book": BookPublicShort.model_validate(book_init).model_dump(), "borrowers": 2}]
+    assert client.get("/books/999/related").status_code == 404
+    assert client.get(f"/books/{book_init.id}/related?limit=0").status_code == 422
+
+def test_reconcile_inventory(client, loan_init):
+    response = client.get("/admin/inventory/reconcile")
+    assert response.status_code == 200
+    assert response.json()["mismatches"][0]["expected_copies"] == 9
+    response = client.post("/admin/inventory/reconcile")
+    assert response.json()["repaired"] == 1
+    assert client.get("/admin/inventory/reconcile").json()["mismatches"] == []
+
+def test_write_statement_counts(client, test_session, book_init, user_init, statements):
+    book_id, user_id = book_init.id, user_init.id
+    book_body = {"title": "new", "author": "new", "isbn": "new_isbn", "publication_year": 2001, "total_copies": 3}
+
+    count_from_here(test_session, statements)
+    assert client.post("/books", json=book_body).json()["loans"] == []
+    # Every write ends with one INSERT into change_event.
+    assert statements == ["INSERT", "INSERT"]
+
+    count_from_here(test_session, statements)
+    assert client.put(f"/books/{book_id}", json={**book_body, "isbn": "test_isbn"}).json()["total_copies"] == 3
+    # The book, the update, and the loans listed in the response.
+    assert statements == ["SELECT", "UPDATE", "INSERT", "SELECT"]
+
+    count_from_here(test_session, statements)
+    assert client.post("/users", json={"name": "new", "email": "new_email"}).json()["loans"] == []
+    assert statements == ["INSERT", "INSERT"]
+
+    count_from_here(test_session, statements)
+    loan = client.post(f"/books/{book_id}/borrow?user_id={user_id}").json()
+    assert loan["book"]["available_copies"] == 2
+    # The stock UPDATE returns the book row, then the user and the new loan.
+    assert statements == ["UPDATE", "SELECT", "INSERT", "INSERT"]
+
+    count_from_here(test_session, statements)
+    returned = client.post(f"/loans/{loan['id']}/return").json()
+    assert returned["status"] == "returned"
+    assert returned["book"]["available_copies"] == 3
+    # Loan with its user, book, loan update, waiting holds, book update.
+    assert statements == ["SELECT", "SELECT", "UPDATE", "SELECT", "UPDATE", "INSERT"]
+
+def test_get_changes(client):
+    book_id = client.post("/books", json={"title": "t", "author": "a", "isbn": "changes", "publication_year": 2000, "total_copies": 1}).json()["id"]
+    response = client.get("/changes?limit=1000")
+    assert response.status_code == 200
+    feed = response.json()
+    assert [(change["entity"], change["entity_id"], change["operation"]) for change in feed["changes"][-1:]] == [("book", book_id, "insert")]
+    assert feed["next"] == feed["changes"][-1]["version"]
+    response = client.get(f"/changes?since={feed['next']}")
+    assert response.json() == {"changes": [], "next": feed["next"], "has_more": False}
+    assert client.get("/changes?limit=0").status_code == 422
+
+def test_changes_include_loans_made_for_holds(client, test_session):
+    book_id = client.post("/books", json={"title": "t", "author": "a", "isbn": "held", "publication_year": 2000, "total_copies": 1}).json()["id"]
+    user_id = client.post("/users", json={"name": "n", "email": "held@example.com"}).json()["id"]
+    loan = client.post(f"/books/{book_id}/borrow?user_id={user_id}").json()
+    hold = client.post(f"/books/{book_id}/hold?user_id={user_id}").json()
+    since = client.get("/changes?limit=1000").json()["next"]
+    test_session.commit()
+    client.post(f"/loans/{loan['id']}/return")
+    hold_loan_id = client.get(f"/holds/{hold['id']}").json()["loan_id"]
+    changes = client.get(f"/changes?since={since}").json()["changes"]
+    assert ("loan", hold_loan_id, "insert") in [(change["entity"], change["entity_id"], change["operation"]) for change in changes]
+    assert hold_loan_id != loan["id"]
+
+def test_autocomplete_books(client, test_session, book_init):
+    book_suggestions.rebuild(test_session.exec(SUGGESTION_ROWS).all())
+    response = client.get("/books/autocomplete?prefix=test_a")
+    assert response.status_code == 200
+    assert response.json() == [{"text": "test_author", "field": "author", "book_ids": [book_init.id]}]
+    assert client.get("/books/autocomplete?prefix=").status_code == 422
+    book_suggestions.reset()
@@ -0,0 +1,90 @@
+import io
+from pathlib import Path
+import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, inspect, text
+from migration_utils import backfill_in_batches, create_index_concurrently, drop_index_concurrently, set_not_null
+
+ALEMBIC_DIR = Path(__file__).resolve().parents[1] / "alembic"
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE item (id INTEGER PRIMARY KEY, code INTEGER, label VARCHAR)"))
+        connection.execute(text("INSERT INTO item (id, code) VALUES (:id, :code)"), [{"id": i, "code": i % 7} for i in range(1, 1001)])
+    yield engine
+    engine.dispose()
+
+def run(engine, operation):
+    with engine.connect() as connection:
+        with Operations.context(MigrationContext.configure(connection)):
+            result = operation()
+        connection.commit()
+    return result
+
+def test_revisions_form_a_single_chain():
+    script = ScriptDirectory(str(ALEMBIC_DIR))
+    assert script.get_bases() == ["6c3e8b995729"]
+    heads = script.get_heads()
+    assert len(heads) == 1
+    # Following down_revision from the head must reach the base through
+    # every revision once, with no merges or branches along the way.
+    chain = []
+    revision = script.get_revision(heads[0])
+    while revision is not None:
+        assert isinstance(revision.down_revision, (str, type(None)))
+        chain.append(revision.revision)
+        revision = script.get_revision(revision.down_revision) if revision.down_revision else None
+    assert chain[-1] == "6c3e8b995729"
+    assert sorted(chain) == sorted(script_revision.revision for script_revision in script.walk_revisions())
+
+def test_create_and_drop_index(engine):
+    run(engine, lambda: create_index_concurrently("ix_item_code", "item", ["code"]))
+    assert [index["name"] for index in inspect(engine).get_indexes("item")] == ["ix_item_code"]
+    run(engine, lambda: drop_index_concurrently("ix_item_code", "item"))
+    assert inspect(engine).get_indexes("item") == []
+
+def test_backfill_in_batches(engine):
+    updated = run(engine, lambda: backfill_in_batches(
+        "item",
+        "label = 'code-' || code",
+        condition="label IS NULL",
+        batch_size=64
+        ))
+    assert updated == 1000
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM item WHERE label IS NULL")).scalar() == 0
+        assert connection.execute(text("SELECT label FROM item WHERE id = 10")).scalar() == "code-3"
+    # Rows already filled are skipped on a rerun.
+    assert run(engine, lambda: backfill_in_batches("item", "label = NULL", condition="label IS NULL")) == 0
+
+def test_backfill_empty_table(engine):
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM item"))
+    assert run(engine, lambda: backfill_in_batches("item", "label = 'x'")) == 0
+
+def postgresql_script(operation, server_version=None):
+    # The SQL a migration would run on PostgreSQL, as `alembic upgrade --sql` prints it.
+    output = io.StringIO()
+    context = MigrationContext.configure(dialect_name="postgresql", opts={"as_sql": True, "output_buffer": output})
+    context.dialect.server_version_info = server_version
+    with Operations.context(context):
+        operation()
+    return [statement.strip() for statement in output.getvalue().split(";") if statement.strip()]
+
+def test_set_not_null_validates_a_check_first():
+    assert postgresql_script(lambda: set_not_null("loan", "status")) == [
+        "COMMIT",
+        'ALTER TABLE "loan" ADD CONSTRAINT "ck_loan_status_not_null" CHECK ("status" IS NOT NULL) NOT VALID',
+        'ALTER TABLE "loan" VALIDATE CONSTRAINT "ck_loan_status_not_null"',
+        "BEGIN",
+        "COMMIT",
+        "ALTER TABLE loan ALTER COLUMN status SET NOT NULL",
+        "ALTER TABLE loan DROP CONSTRAINT ck_loan_status_not_null",
+        "BEGIN"
+        ]
+    # Before PostgreSQL 12 the validated check is kept instead.
+    assert not any("SET NOT NULL" in statement for statement in postgresql_script(lambda: set_not_null("loan", "status"), (11, 20)))
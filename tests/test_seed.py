@@ -0,0 +1,69 @@
+from datetime import datetime, timezone
+import pytest
+from sqlalchemy import text
+from sqlmodel import SQLModel, Session, create_engine
+from crud import reconcile_inventory_logic
+from seed import DAY, Timestamps, seed_database
+
+ANCHOR = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+@pytest.fixture
+def make_engine(tmp_path):
+    engines = []
+
+    def make(name:str):
+        engine = create_engine(f"sqlite:///{tmp_path / name}")
+        SQLModel.metadata.create_all(engine)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.dispose()
+
+def dump(engine, table:str):
+    with engine.connect() as connection:
+        return connection.execute(text(f'SELECT * FROM "{table}" ORDER BY id')).all()
+
+def test_seed_inserts_requested_rows(make_engine):
+    engine = make_engine("seed.db")
+    stats = seed_database(engine, books=200, users=50, loans=2000, anchor=ANCHOR, chunk_size=300)
+    assert (stats["books"], stats["users"], stats["loans"]) == (200, 50, 2000)
+    assert [len(dump(engine, table)) for table in ("book", "user", "loan")] == [200, 50, 2000]
+
+def test_seed_is_deterministic(make_engine):
+    first, second = make_engine("first.db"), make_engine("second.db")
+    for engine in (first, second):
+        seed_database(engine, books=50, users=20, loans=500, seed=7, anchor=ANCHOR)
+    for table in ("book", "user", "loan"):
+        assert dump(first, table) == dump(second, table)
+
+def test_seeded_loans_are_consistent(make_engine):
+    engine = make_engine("seed.db")
+    seed_database(engine, books=100, users=30, loans=3000, anchor=ANCHOR, active_fraction=0.3)
+    with engine.connect() as connection:
+        assert connection.execute(text(
+            "SELECT COUNT(*) FROM loan WHERE julianday(due_date) - julianday(borrow_date) != 14 "
+            "OR borrow_date > '2026-01-01' OR return_date <= borrow_date "
+            "OR (status = 1) != (return_date IS NOT NULL)"
+            )).scalar() == 0
+        assert connection.execute(text(
+            "SELECT COUNT(*) FROM book WHERE available_copies < 0 OR available_copies > total_copies"
+            )).scalar() == 0
+        assert connection.execute(text("SELECT COUNT(*) FROM loan WHERE status = 0")).scalar() > 0
+    with Session(engine) as session:
+        assert reconcile_inventory_logic(session)["mismatches"] == []
+
+def test_seed_appends_after_existing_rows(make_engine):
+    engine = make_engine("seed.db")
+    seed_database(engine, books=10, users=5, loans=40, anchor=ANCHOR)
+    seed_database(engine, books=10, users=5, loans=40, seed=1, anchor=ANCHOR)
+    assert [row.id for row in dump(engine, "book")] == list(range(1, 21))
+    assert len({row.isbn for row in dump(engine, "book")}) == 20
+    assert len({row.email for row in dump(engine, "user")}) == 10
+
+def test_timestamps_match_the_stored_format():
+    timestamps = Timestamps(datetime(2026, 1, 1, 12, 30, 5, tzinfo=timezone.utc), 2, 1, "+00:00")
+    day, second = divmod(timestamps.origin - DAY, DAY)
+    assert timestamps.days[day] + timestamps.times[second] == "2025-12-31 12:30:05.000000+00:00"
+    assert datetime.fromisoformat(timestamps.days[-1] + timestamps.times[-1]) == datetime(2026, 1, 2, 23, 59, 59, tzinfo=timezone.utc)
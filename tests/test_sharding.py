@@ -0,0 +1,130 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlmodel import Session, SQLModel
+from config import Settings
+from crud import get_loans_logic
+from database import get_engine
+from main import create_app
+from models import Book, BranchStock, User
+
+BOOK = {"title": "Dune", "author": "Frank Herbert", "isbn": "978-0441013593", "publication_year": 1965}
+
+@pytest.fixture
+def settings(tmp_path):
+    # north and east share a database, south has its own.
+    shared = f"sqlite:///{tmp_path / 'shared.db'}"
+    return Settings(
+        sqlalchemy_database_url=shared,
+        branch_databases={"north": "", "east": shared, "south": f"sqlite:///{tmp_path / 'south.db'}"}
+        )
+
+@pytest.fixture
+def client(settings):
+    app = create_app(settings)
+    router = app.state.branch_router
+    for url in set(router.databases.values()):
+        SQLModel.metadata.create_all(get_engine(settings, url))
+    # Books and users only go into the main database.
+    with Session(get_engine(settings)) as session:
+        session.add(Book(**BOOK, total_copies=0, available_copies=0))
+        session.add(User(name="Ada", email="ada@example.com"))
+        session.commit()
+    with TestClient(app) as client:
+        yield client
+    for url in set(router.databases.values()):
+        get_engine(settings, url).dispose()
+
+def test_fan_out_reads_each_database_once(client):
+    router = client.app.state.branch_router
+    calls = router.fan_out(lambda session, branches: [sorted(branches)])
+    assert sorted(calls) == [["east", "north"], ["south"]]
+    assert client.get("/branches").json() == ["east", "north", "south"]
+
+def test_catalog_merges_branches(client):
+    for branch, copies in (("north", 2), ("east", 1), ("south", 3)):
+        response = client.put(f"/admin/branches/{branch}/books/1/stock", params={"total_copies": copies})
+        assert response.status_code == 200
+    assert client.post("/branches/south/books/1/borrow", params={"user_id": 1}).status_code == 200
+
+    entry = client.get(f"/catalog/{BOOK['isbn']}").json()
+    assert entry["title"] == "Dune"
+    assert (entry["total_copies"], entry["available_copies"]) == (6, 5)
+    assert [(stock["branch"], stock["available_copies"]) for stock in entry["branches"]] == [
+        ("east", 1), ("north", 2), ("south", 2)
+        ]
+    assert client.get("/catalog/unknown").status_code == 404
+
+def test_branch_borrow_and_return(client, settings):
+    client.put("/admin/branches/south/books/1/stock", params={"total_copies": 1})
+    loan = client.post("/branches/south/books/1/borrow", params={"user_id": 1}).json()
+    assert loan["branch"] == "south"
+    assert client.post("/branches/south/books/1/borrow", params={"user_id": 1}).status_code == 412
+    # The loan lives in the south database only.
+    assert client.post(f"/branches/north/loans/{loan['id']}/return").status_code == 404
+    response = client.post(f"/branches/south/loans/{loan['id']}/return")
+    assert response.json()["status"] == "returned"
+    with Session(get_engine(settings, settings.branch_databases["south"])) as session:
+        assert session.get(BranchStock, (1, "south")).available_copies == 1
+    assert client.post("/branches/west/books/1/borrow", params={"user_id": 1}).status_code == 404
+
+def test_concurrent_branch_writes_queue_on_sqlite(client):
+    # Without the write queue and BEGIN IMMEDIATE, most of these fail with
+    # "database is locked".
+    client.put("/admin/branches/south/books/1/stock", params={"total_copies": 40})
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        borrows = list(pool.map(lambda _: client.post("/branches/south/books/1/borrow", params={"user_id": 1}), range(40)))
+        assert [response.status_code for response in borrows] == [200] * 40
+        returns = list(pool.map(lambda loan: client.post(f"/branches/south/loans/{loan.json()['id']}/return"), borrows))
+    assert [response.status_code for response in returns] == [200] * 40
+    assert client.get(f"/catalog/{BOOK['isbn']}").json()["available_copies"] == 40
+
+def test_branch_loans_have_unique_ids_and_are_readable(client, settings):
+    client.put("/admin/branches/north/books/1/stock", params={"total_copies": 2})
+    client.put("/admin/branches/south/books/1/stock", params={"total_copies": 2})
+    north = client.post("/branches/north/books/1/borrow", params={"user_id": 1}).json()
+    south = client.post("/branches/south/books/1/borrow", params={"user_id": 1}).json()
+    later_north = client.post("/branches/north/books/1/borrow", params={"user_id": 1}).json()
+    assert len({north["id"], south["id"], later_north["id"]}) == 3
+    assert (south["book"]["title"], south["user"]["name"]) == ("Dune", "Ada")
+
+    assert client.get(f"/loans/{south['id']}").json()["branch"] == "south"
+    assert [loan["id"] for loan in client.get("/loans").json()] == [north["id"], south["id"], later_north["id"]]
+    with Session(get_engine(settings)) as session:
+        page = get_loans_logic(session, offset=1, limit=1, branch_router=client.app.state.branch_router)
+        assert [loan.id for loan in page] == [south["id"]]
+    assert [loan and loan["branch"] for loan in client.get(f"/loans?ids={south['id']},999").json()] == ["south", None]
+    assert [loan["id"] for loan in client.get("/users/1").json()["loans"]] == [north["id"], south["id"], later_north["id"]]
+    assert len(client.get("/users/1/loans").json()) == 3
+
+def test_branch_database_gets_books_and_users_from_main(client, settings):
+    assert client.put("/admin/branches/south/books/2/stock", params={"total_copies": 1}).status_code == 404
+    client.put("/admin/branches/south/books/1/stock", params={"total_copies": 1})
+    assert client.post("/branches/south/books/1/borrow", params={"user_id": 2}).status_code == 404
+    with Session(get_engine(settings, settings.branch_databases["south"])) as session:
+        assert session.get(Book, 1).title == "Dune"
+        assert session.get(User, 1) is None
+    assert client.post("/branches/south/books/1/borrow", params={"user_id": 1}).status_code == 200
+    with Session(get_engine(settings, settings.branch_databases["south"])) as session:
+        assert session.get(User, 1).name == "Ada"
+
+def test_app_restarts(client):
+    client.__exit__(None, None, None)
+    with TestClient(client.app) as restarted:
+        assert restarted.get(f"/catalog/{BOOK['isbn']}").status_code == 404
+        restarted.put("/admin/branches/south/books/1/stock", params={"total_copies": 1})
+        assert restarted.get(f"/catalog/{BOOK['isbn']}").json()["total_copies"] == 1
+
+def test_branch_changes_reach_the_main_feed(client, settings):
+    # The feed only reads the main database, wherever the loan is stored.
+    since = client.get("/changes?limit=1000").json()["next"]
+    client.put("/admin/branches/south/books/1/stock", params={"total_copies": 1})
+    loan = client.post("/branches/south/books/1/borrow", params={"user_id": 1}).json()
+    client.post(f"/branches/south/loans/{loan['id']}/return")
+    feed = client.get(f"/changes?since={since}").json()
+    assert [(change["entity"], change["entity_id"], change["operation"]) for change in feed["changes"]] == [
+        ("loan", loan["id"], "insert"), ("loan", loan["id"], "update")
+        ]
+    with Session(get_engine(settings, settings.branch_databases["south"])) as session:
+        assert session.exec(text("SELECT count(*) FROM change_event")).one()[0] == 0
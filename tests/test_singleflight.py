@@ -0,0 +1,80 @@
+import asyncio
+from metrics import metrics
+from singleflight import SingleFlight
+
+async def run_concurrently(flight, key, produce, callers):
+    calls = [asyncio.create_task(flight.do(key, produce)) for _ in range(callers)]
+    while flight.waiting(key) < callers - 1:
+        await asyncio.sleep(0)
+    return calls
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight()
+    calls = []
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def produce():
+            calls.append(1)
+            await release.wait()
+            return b"book"
+
+        waiting = await run_concurrently(flight, "books/1", produce, 5)
+        release.set()
+        results = await asyncio.gather(*waiting)
+        # The result is not kept once the flight lands.
+        again = await flight.do("books/1", lambda: asyncio.sleep(0, b"again"))
+        return results, again
+
+    coalesced = metrics.get("single_flight.coalesced")
+    results, again = asyncio.run(scenario())
+    assert calls == [1]
+    assert results == [b"book"] * 5
+    assert again == b"again"
+    assert metrics.get("single_flight.coalesced") - coalesced == 4
+
+def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def produce():
+            await release.wait()
+            raise LookupError("Book not found.")
+
+        waiting = await run_concurrently(flight, "books/2", produce, 3)
+        release.set()
+        return await asyncio.gather(*waiting, return_exceptions=True)
+
+    errors = asyncio.run(scenario())
+    assert len(errors) == 3
+    assert all(isinstance(error, LookupError) for error in errors)
+    assert flight.waiting("books/2") == 0
+
+def test_waiter_going_away_leaves_the_flight_running():
+    flight = SingleFlight()
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def produce():
+            await release.wait()
+            return b"book"
+
+        leader, waiter = await run_concurrently(flight, "books/3", produce, 2)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return await leader
+
+    assert asyncio.run(scenario()) == b"book"
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+
+    async def scenario():
+        return [await flight.do(key, lambda key=key: asyncio.sleep(0, key)) for key in ("a", "b")]
+
+    assert asyncio.run(scenario()) == ["a", "b"]
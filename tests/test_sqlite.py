@@ -0,0 +1,122 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from anyio import to_thread
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import SQLModel, Session
+import database
+import main
+from cache import collection_versions
+from config import Settings
+from crud import get_book_logic
+from database import get_engine, get_write_engine
+from metrics import metrics
+from main import create_app
+from models import Book, User
+from singleflight import single_flight
+
+@pytest.fixture
+def settings(tmp_path):
+    settings = Settings(
+        sqlalchemy_database_url=f"sqlite:///{tmp_path / 'embedded.db'}",
+        borrow_admission_enabled=False,
+        change_listener_enabled=False
+        )
+    yield settings
+    engine = database._engines.pop(settings.sqlalchemy_database_url, None)
+    database._write_engines.pop(settings.sqlalchemy_database_url, None)
+    database._write_queues.pop(settings.sqlalchemy_database_url, None)
+    if engine is not None:
+        engine.dispose()
+
+def test_pragmas_applied_on_connect(settings):
+    with get_engine(settings).connect() as connection:
+        pragma = lambda name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+        assert pragma("journal_mode") == "wal"
+        assert pragma("synchronous") == 1
+        assert pragma("busy_timeout") == 5000
+        assert pragma("temp_store") == 2
+
+def test_writes_begin_immediate(settings):
+    engine = get_engine(settings)
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    with Session(engine) as session:
+        session.connection()
+    with Session(get_write_engine(settings)) as session:
+        session.connection()
+    assert statements == ["BEGIN", "BEGIN IMMEDIATE"]
+
+def test_queued_writes_leave_threads_for_reads(settings):
+    settings.sqlite_write_queue_size = 60
+    SQLModel.metadata.create_all(get_engine(settings))
+    with TestClient(create_app(settings)) as client:
+        queue = database.get_write_queue(settings)
+        # More writes wait than the threadpool has threads.
+        client.portal.call(queue.acquire)
+        with ThreadPoolExecutor(max_workers=50) as pool:
+            writes = [pool.submit(client.post, "/users", json={"name": f"u{i}", "email": f"u{i}@example.com"}) for i in range(50)]
+            while queue.waiting() < 50:
+                time.sleep(0.01)
+            assert client.get("/books").status_code == 200
+            client.portal.call(queue.release)
+            assert [write.result().status_code for write in writes] == [200] * 50
+        assert (queue.active, queue.waiting()) == (0, 0)
+
+def test_no_group_commit_on_sqlite(settings):
+    settings.borrow_batch_window_ms = 5
+    assert not hasattr(create_app(settings).state, "borrow_coalescer")
+
+def test_concurrent_borrows_are_serialized(settings):
+    engine = get_engine(settings)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(Book(title="t", author="a", isbn="i", publication_year=2000, total_copies=10, available_copies=10))
+        session.add_all([User(name=f"user{i}", email=f"user{i}@example.com") for i in range(20)])
+        session.commit()
+
+    client = TestClient(create_app(settings))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        codes = list(pool.map(lambda user_id: client.post(f"/books/1/borrow?user_id={user_id}").status_code, range(1, 21)))
+    assert sorted(codes) == [200] * 10 + [412] * 10
+    assert client.get("/books/1").json()["available_copies"] == 0
+
+def test_db_concurrency_limits_requests_and_threadpool(settings):
+    settings.db_concurrency = 2
+    SQLModel.metadata.create_all(get_engine(settings))
+    with TestClient(create_app(settings)) as client:
+        assert client.portal.call(lambda: to_thread.current_default_thread_limiter().total_tokens) == 10
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            codes = list(pool.map(lambda _: client.get("/books").status_code, range(16)))
+        assert codes == [200] * 16
+        gauges = metrics.snapshot()["gauges"]
+        assert (gauges["db_concurrency.active"], gauges["db_concurrency.waiting"]) == (0, 0)
+
+def test_requests_joining_a_read_hold_no_slot(settings, monkeypatch):
+    settings.db_concurrency = 1
+    SQLModel.metadata.create_all(get_engine(settings))
+    with Session(get_engine(settings)) as session:
+        session.add(Book(title="t", author="a", isbn="i", publication_year=2000, total_copies=1, available_copies=1))
+        session.commit()
+    started, release = threading.Event(), threading.Event()
+
+    def get_book(session, book_id):
+        started.set()
+        release.wait(5)
+        return get_book_logic(session, book_id)
+
+    monkeypatch.setattr(main, "get_book_logic", get_book)
+    app = create_app(settings)
+    with TestClient(app) as client:
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            responses = [pool.submit(client.get, "/books/1") for _ in range(6)]
+            started.wait(5)
+            key = ("/books/1", "", collection_versions.get("books", "loans"))
+            while single_flight.waiting(key) < 5:
+                time.sleep(0.01)
+            # Only the request running the query has the one slot.
+            assert (app.state.db_limiter.active, app.state.db_limiter.waiting()) == (1, 0)
+            release.set()
+            assert [response.result().status_code for response in responses] == [200] * 6
@@ -0,0 +1,114 @@
+import os
+import re
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.engine.default import CACHE_HIT
+from sqlmodel import SQLModel
+import database
+from config import Settings
+from main import create_app
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Generous enough for a cold CI runner; tighten with the env var locally.
+IMPORT_TIME_BUDGET_SECONDS = float(os.getenv("IMPORT_TIME_BUDGET_SECONDS", "3.0"))
+
+def import_env():
+    env = dict(os.environ)
+    env.pop("SQLALCHEMY_DATABASE_URL", None)
+    return env
+
+def test_import_without_database_url():
+    result = subprocess.run(
+        [sys.executable, "-c", "import main, database; assert not database._engines"],
+        cwd=ROOT,
+        env=import_env(),
+        capture_output=True,
+        text=True
+        )
+    assert result.returncode == 0, result.stderr
+
+def test_import_time_budget():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT,
+        env=import_env(),
+        capture_output=True,
+        text=True
+        )
+    assert result.returncode == 0, result.stderr
+    match = re.search(r"^import time:\s+\d+ \|\s+(\d+) \| main$", result.stderr, re.MULTILINE)
+    assert match
+    cumulative_seconds = int(match.group(1)) / 1_000_000
+    assert cumulative_seconds < IMPORT_TIME_BUDGET_SECONDS
+
+def test_create_app_is_lazy(tmp_path):
+    url = f"sqlite:///{tmp_path / 'lazy.db'}"
+    app = create_app(Settings(sqlalchemy_database_url=url))
+    assert app.state.settings.sqlalchemy_database_url == url
+    assert url not in database._engines
+
+def test_lifespan_prewarms_pool(tmp_path):
+    url = f"sqlite:///{tmp_path / 'prewarm.db'}"
+    app = create_app(Settings(sqlalchemy_database_url=url, db_prewarm_connections=2, change_listener_enabled=False))
+    try:
+        with TestClient(app):
+            # The autocomplete load may be holding one of them already.
+            pool = database._engines[url].pool
+            assert pool.checkedin() + pool.checkedout() == 2
+    finally:
+        database._engines.pop(url).dispose()
+
+def test_lifespan_warms_caches(tmp_path):
+    settings = Settings(sqlalchemy_database_url=f"sqlite:///{tmp_path / 'warm.db'}", db_prewarm_caches=True)
+    engine = database.get_engine(settings)
+    SQLModel.metadata.create_all(engine)
+    cache_hits = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        # The autocomplete load runs alongside and compiles its own query.
+        if context.compiled is not None and threading.current_thread().name != "autocomplete-load":
+            cache_hits.append(context.cache_hit == CACHE_HIT)
+
+    try:
+        with TestClient(create_app(settings)) as client:
+            event.listen(engine, "after_cursor_execute", record)
+            for path in ("/books", "/users", "/loans"):
+                assert client.get(path).status_code == 200
+        assert cache_hits and all(cache_hits)
+    finally:
+        database._engines.pop(settings.sqlalchemy_database_url).dispose()
+
+def test_engine_is_made_once_per_url(tmp_path, monkeypatch):
+    settings = Settings(sqlalchemy_database_url=f"sqlite:///{tmp_path / 'once.db'}")
+    made = []
+    make_engine = database.make_engine
+
+    def slow_make_engine(settings, url=None):
+        made.append(url)
+        threading.Event().wait(0.05)
+        return make_engine(settings, url)
+
+    monkeypatch.setattr(database, "make_engine", slow_make_engine)
+    engines = []
+    threads = [threading.Thread(target=lambda: engines.append(database.get_engine(settings))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        assert len(made) == 1 and len(set(map(id, engines))) == 1
+    finally:
+        database._engines.pop(settings.sqlalchemy_database_url).dispose()
+
+def test_apps_have_their_own_response_cache():
+    small, large = (
+        create_app(Settings(sqlalchemy_database_url="sqlite://", response_cache_entries=entries))
+        for entries in (1, 500)
+        )
+    assert small.state.response_cache is not large.state.response_cache
+    assert (small.state.response_cache.max_entries, large.state.response_cache.max_entries) == (1, 500)
@@ -0,0 +1,162 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, SQLModel
+import database
+import main
+from cache import collection_versions
+from config import Settings
+from crud import get_book_logic
+from database import get_engine
+from main import create_app
+from models import Book
+from singleflight import single_flight
+from metrics import metrics
+from timeouts import ClientDisconnected, QueryGuard, classify_error, database_timeout_handler, guard_session, timeouts_for
+
+# Counts forever; only a timeout or a cancel ends it.
+ENDLESS = text("WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT count(*) FROM n")
+# Returns its first row at once; the rest only come while fetching.
+ENDLESS_ROWS = text("WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT x FROM n")
+
+@pytest.fixture
+def settings(tmp_path):
+    settings = Settings(
+        sqlalchemy_database_url=f"sqlite:///{tmp_path / 'timeouts.db'}",
+        borrow_admission_enabled=False,
+        change_listener_enabled=False
+        )
+    yield settings
+    engine = database._engines.pop(settings.sqlalchemy_database_url, None)
+    database._write_engines.pop(settings.sqlalchemy_database_url, None)
+    if engine is not None:
+        engine.dispose()
+
+@pytest.fixture
+def engine(settings):
+    return get_engine(settings)
+
+async def get(app, path:str, disconnect:asyncio.Event | None = None) -> int:
+    # Drives the ASGI app directly, so the client can hang up mid-request.
+    messages = []
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await (disconnect or asyncio.Event()).wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "headers": [], "root_path": "",
+        "client": ("testclient", 50000), "server": ("testserver", 80)
+        }
+    await app(scope, receive, send)
+    return next(message["status"] for message in messages if message["type"] == "http.response.start")
+
+def test_statement_timeout_on_sqlite(engine):
+    guard = QueryGuard()
+    with Session(engine) as session:
+        guard_session(session, guard, 50, 0)
+        started = time.monotonic()
+        with pytest.raises(OperationalError) as error:
+            session.exec(ENDLESS)
+        assert time.monotonic() - started < 2
+        assert classify_error(error.value, guard) == "statement_timeout"
+        session.rollback()
+        with pytest.raises(OperationalError) as error:
+            session.exec(ENDLESS_ROWS).all()
+        assert classify_error(error.value, guard) == "statement_timeout"
+        session.rollback()
+        assert session.exec(text("SELECT 1")).scalar() == 1
+    # Connections outside request sessions keep no deadline.
+    with engine.connect() as connection:
+        assert connection.info.get("statement_timeout_ms") is None
+
+def test_cancel_running_statement(engine):
+    guard = QueryGuard()
+    errors = []
+
+    def run():
+        with Session(engine) as session:
+            guard_session(session, guard, 0, 0)
+            try:
+                session.exec(ENDLESS)
+            except OperationalError as error:
+                errors.append(classify_error(error, guard))
+                session.rollback()
+            # Nothing more runs for a client that has gone away.
+            with pytest.raises(ClientDisconnected):
+                session.exec(text("SELECT 1"))
+
+    worker = threading.Thread(target=run)
+    worker.start()
+    time.sleep(0.2)
+    cancelled = metrics.get("db.cancelled_on_disconnect")
+    guard.cancel()
+    worker.join(timeout=5)
+    assert errors == ["cancelled"]
+    assert metrics.get("db.cancelled_on_disconnect") == cancelled + 1
+
+def test_endpoint_timeouts():
+    settings = Settings(db_endpoint_timeouts_ms={"GET /loans": {"statement": 15000}})
+    request = lambda method: SimpleNamespace(method=method, scope={"route": SimpleNamespace(path="/loans")})
+    assert timeouts_for(settings, request("GET")) == (15000, 2000)
+    assert timeouts_for(settings, request("POST")) == (5000, 2000)
+
+def test_timeouts_mapped_to_responses():
+    request = SimpleNamespace(state=SimpleNamespace(query_guard=QueryGuard()))
+    respond = lambda message: asyncio.run(database_timeout_handler(request, OperationalError("SELECT 1", {}, sqlite3.OperationalError(message))))
+    lock_timeouts = metrics.get("db.lock_timeouts")
+    response = respond("database is locked")
+    assert (response.status_code, response.headers["Retry-After"]) == (503, "1")
+    assert metrics.get("db.lock_timeouts") == lock_timeouts + 1
+    assert respond("interrupted").status_code == 504
+    with pytest.raises(OperationalError):
+        respond("no such table: book")
+
+def test_shared_read_survives_leader_disconnect(settings, engine, monkeypatch):
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(Book(title="t", author="a", isbn="i", publication_year=2000, total_copies=1, available_copies=1))
+        session.commit()
+    started = threading.Event()
+    calls = []
+
+    def get_book(session, book_id):
+        calls.append(book_id)
+        if len(calls) == 1:
+            # The first client's read is still running when it hangs up.
+            started.set()
+            session.exec(ENDLESS)
+        return get_book_logic(session, book_id)
+
+    monkeypatch.setattr(main, "get_book_logic", get_book)
+    app = create_app(settings)
+
+    async def scenario():
+        hang_up = asyncio.Event()
+        first = asyncio.create_task(get(app, "/books/1", hang_up))
+        await asyncio.to_thread(started.wait, 5)
+        second = asyncio.create_task(get(app, "/books/1"))
+        key = ("/books/1", "", collection_versions.get("books", "loans"))
+        while not single_flight.waiting(key):
+            await asyncio.sleep(0.01)
+        hang_up.set()
+        return await asyncio.gather(first, second)
+
+    retries = metrics.get("single_flight.retries")
+    assert asyncio.run(scenario()) == [499, 200]
+    assert len(calls) == 2
+    assert metrics.get("single_flight.retries") == retries + 1
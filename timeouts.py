@@ -0,0 +1,185 @@
+import asyncio
+import threading
+import time
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session as OrmSession
+from config import Settings
+from metrics import metrics
+
+# Progress handler period on SQLite, in virtual machine instructions.
+SQLITE_CHECK_EVERY = 1000
+# PostgreSQL error codes for a statement cancelled (by statement_timeout or
+# a cancel request) and for lock_timeout.
+QUERY_CANCELED = "57014"
+LOCK_NOT_AVAILABLE = "55P03"
+
+class ClientDisconnected(Exception):
+    pass
+
+class QueryGuard:
+    # One per request: remembers the driver connection of its open
+    # transaction, so the statement running on it can be cancelled from the
+    # event loop once the client goes away.
+    def __init__(self):
+        self.cancelled = False
+        self._running = None
+        self._lock = threading.Lock()
+
+    def started(self, driver_connection):
+        with self._lock:
+            if self.cancelled:
+                raise ClientDisconnected()
+            self._running = driver_connection
+
+    def finished(self):
+        with self._lock:
+            self._running = None
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            running = self._running
+        if running is None:
+            return
+        metrics.increment("db.cancelled_on_disconnect")
+        # Both are safe to call from another thread: psycopg2 sends a cancel
+        # request to the server, sqlite3 interrupts the running statement.
+        if hasattr(running, "interrupt"):
+            running.interrupt()
+        else:
+            running.cancel()
+
+def timeouts_for(settings:Settings, request:Request) -> tuple[int, int]:
+    route = request.scope.get("route")
+    key = f"{request.method} {route.path}" if route is not None else None
+    overrides = settings.db_endpoint_timeouts_ms.get(key, {})
+    return (
+        overrides.get("statement", settings.db_statement_timeout_ms),
+        overrides.get("lock", settings.db_lock_timeout_ms)
+        )
+
+async def _watch_disconnect(request:Request, guard:QueryGuard):
+    # Sync routes have read their body by now, so the only message left to
+    # receive is the disconnect.
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            guard.cancel()
+            return
+
+async def cancel_on_disconnect(request:Request):
+    guard = QueryGuard()
+    request.state.query_guard = guard
+    watcher = asyncio.create_task(_watch_disconnect(request, guard))
+    try:
+        yield guard
+    finally:
+        watcher.cancel()
+
+def guard_session(session:OrmSession, guard:QueryGuard, statement_ms:int, lock_ms:int):
+    session.info["query_guard"] = guard
+    session.info["timeouts"] = (statement_ms, lock_ms)
+
+@event.listens_for(OrmSession, "after_begin")
+def _apply_timeouts(session, transaction, connection):
+    # Handed to the connection for the length of the transaction; the pool
+    # clears them again on checkin.
+    if "timeouts" not in session.info:
+        return
+    statement_ms, lock_ms = session.info["timeouts"]
+    connection.info["query_guard"] = session.info["query_guard"]
+    connection.info["statement_timeout_ms"] = statement_ms
+    if connection.dialect.name == "postgresql":
+        # One round trip; is_local=true scopes both to this transaction.
+        connection.exec_driver_sql(
+            f"SELECT set_config('statement_timeout', '{int(statement_ms)}', true), "
+            f"set_config('lock_timeout', '{int(lock_ms)}', true)"
+            )
+
+def configure_timeouts(engine:Engine) -> Engine:
+    sqlite = engine.dialect.name == "sqlite"
+
+    if sqlite:
+        # SQLite has no statement timeout: a progress handler aborts the
+        # statement once its deadline has passed. Lock waits are bounded by
+        # the busy_timeout pragma instead of lock_timeout.
+        @event.listens_for(engine, "connect")
+        def install_progress_handler(dbapi_connection, connection_record):
+            info = connection_record.info
+            def past_deadline():
+                deadline = info.get("deadline")
+                return deadline is not None and time.monotonic() > deadline
+            dbapi_connection.set_progress_handler(past_deadline, SQLITE_CHECK_EVERY)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_execute(connection, cursor, statement, parameters, context, executemany):
+        guard = connection.info.get("query_guard")
+        if guard is not None:
+            guard.started(connection.connection.driver_connection)
+        if sqlite and connection.info.get("statement_timeout_ms"):
+            connection.info["deadline"] = time.monotonic() + connection.info["statement_timeout_ms"] / 1000
+
+    # Rows are mostly produced while they are fetched, after execute()
+    # returns, so the deadline and the guard stay armed until the next
+    # statement replaces them or the transaction ends. A failed statement is
+    # over, though, and must not cut short the rollback that follows.
+    @event.listens_for(engine, "handle_error")
+    def on_error(context):
+        if context.connection is not None:
+            context.connection.info.pop("deadline", None)
+
+    @event.listens_for(engine, "commit")
+    def on_commit(connection):
+        _transaction_done(connection.info)
+
+    @event.listens_for(engine, "rollback")
+    def on_rollback(connection):
+        _transaction_done(connection.info)
+
+    @event.listens_for(engine, "checkin")
+    def forget_request(dbapi_connection, connection_record):
+        _transaction_done(connection_record.info)
+        for key in ("query_guard", "statement_timeout_ms"):
+            connection_record.info.pop(key, None)
+
+    return engine
+
+def _transaction_done(info:dict):
+    info.pop("deadline", None)
+    guard = info.get("query_guard")
+    if guard is not None:
+        guard.finished()
+
+def classify_error(error:OperationalError, guard:QueryGuard | None) -> str | None:
+    if guard is not None and guard.cancelled:
+        return "cancelled"
+    code = getattr(error.orig, "pgcode", None)
+    message = str(error.orig)
+    if code == QUERY_CANCELED or message == "interrupted":
+        return "statement_timeout"
+    if code == LOCK_NOT_AVAILABLE or message == "database is locked":
+        return "lock_timeout"
+    return None
+
+async def client_disconnected_handler(request:Request, error:ClientDisconnected):
+    # Nobody reads this answer; 499 is what proxies log for it.
+    return JSONResponse({"detail": "Client closed the request."}, status_code=499)
+
+async def database_timeout_handler(request:Request, error:OperationalError):
+    kind = classify_error(error, getattr(request.state, "query_guard", None))
+    if kind is None:
+        raise error
+    if kind == "cancelled":
+        return await client_disconnected_handler(request, None)
+    metrics.increment(f"db.{kind}s")
+    if kind == "lock_timeout":
+        return JSONResponse(
+            {"detail": "Timed out waiting for a row locked by another request."},
+            status_code=503,
+            headers={"Retry-After": "1"}
+            )
+    return JSONResponse({"detail": "The database took too long to answer."}, status_code=504)